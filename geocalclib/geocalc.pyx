@@ -1,6 +1,6 @@
 # cython: language_level=3, emit_code_comments=False
 
-from libc.math cimport asin, atan, atan2, cos
+from libc.math cimport asin, atan, atan2, cos, fabs
 from libc.math cimport fmax, fmin, M_PI, sin, sqrt, tan
 from numpy cimport double_t, ndarray
 cimport cython
@@ -78,7 +78,7 @@ cdef double* RANDOM_LON = [
     0.8279, 0.7611, 0.8101, 0.9157, 0.004, 0.9844, 0.3872, 0.7046,
 ]
 
-cdef inline double deg2rad(double degrees):
+cdef inline double deg2rad(double degrees) nogil:
     return degrees * M_PI / 180.0
 
 
@@ -125,10 +125,7 @@ cpdef double distance(double lat1, double lon1,
                       double lat2, double lon2):
     # Default to Vincenty distance, falling back to Haversine if
     # Vincenty doesn't converge in VINCENTY_ITERATIONS iterations.
-    try:
-        return vincenty_distance(lat1, lon1, lat2, lon2)
-    except ValueError:
-        return haversine_distance(lat1, lon1, lat2, lon2)
+    return _distance(lat1, lon1, lat2, lon2)
 
 
 cpdef double haversine_distance(double lat1, double lon1,
@@ -152,17 +149,7 @@ cpdef double haversine_distance(double lat1, double lon1,
     equator, though generally below 0.3%, depending on latitude and
     direction of travel.
     """
-    cdef double a, c, dLat, dLon
-
-    dLat = deg2rad(lat2 - lat1) / 2.0
-    dLon = deg2rad(lon2 - lon1) / 2.0
-
-    lat1 = deg2rad(lat1)
-    lat2 = deg2rad(lat2)
-
-    a = sin(dLat) ** 2 + cos(lat1) * cos(lat2) * sin(dLon) ** 2
-    c = asin(fmin(1, sqrt(a)))
-    return 1000.0 * 2.0 * EARTH_RADIUS * c
+    return _haversine(lat1, lon1, lat2, lon2)
 
 
 cpdef double vincenty_distance(double lat1, double lon1,
@@ -176,6 +163,184 @@ cpdef double vincenty_distance(double lat1, double lon1,
       * http://www.movable-type.co.uk/scripts/latlong-vincenty.html
       * https://github.com/geopy/geopy/blob/master/geopy/distance.py
     """
+    cdef double result
+
+    result = _vincenty(lat1, lon1, lat2, lon2)
+    if result < 0.0:
+        raise ValueError("Vincenty formula failed to converge!")
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef ndarray distances(const double[:] lats, const double[:] lons,
+                        double lat, double lon):
+    """
+    Compute the distances in meters from each of the points described
+    by the lats and lons arrays to the given lat/lon point.
+
+    Uses the same Vincenty with Haversine fallback calculation as
+    :func:`distance` and returns a one dimensional array of doubles.
+    """
+    cdef Py_ssize_t i, n
+    cdef double[::1] out
+
+    n = lats.shape[0]
+    if lons.shape[0] != n:
+        raise ValueError("lats and lons must have the same length.")
+
+    result = numpy.empty(n, dtype=numpy.double)
+    out = result
+    with nogil:
+        for i in range(n):
+            out[i] = _distance(lats[i], lons[i], lat, lon)
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef ndarray distances_from(double lat, double lon,
+                             const double[:] lats, const double[:] lons):
+    """
+    Compute the distances in meters from the given lat/lon point to
+    each of the points described by the lats and lons arrays.
+
+    Like :func:`distances` with the arguments passed to the calculation
+    in the opposite order, so each result is exactly equal to
+    ``distance(lat, lon, lats[i], lons[i])``.
+    """
+    cdef Py_ssize_t i, n
+    cdef double[::1] out
+
+    n = lats.shape[0]
+    if lons.shape[0] != n:
+        raise ValueError("lats and lons must have the same length.")
+
+    result = numpy.empty(n, dtype=numpy.double)
+    out = result
+    with nogil:
+        for i in range(n):
+            out[i] = _distance(lat, lon, lats[i], lons[i])
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef ndarray pairwise_distances(const double[:] lats1, const double[:] lons1,
+                                 const double[:] lats2, const double[:] lons2):
+    """
+    Compute the row-wise distances in meters between the points
+    (lats1[i], lons1[i]) and (lats2[i], lons2[i]).
+
+    Returns a one dimensional array of doubles.
+    """
+    cdef Py_ssize_t i, n
+    cdef double[::1] out
+
+    n = lats1.shape[0]
+    if (lons1.shape[0] != n or lats2.shape[0] != n or
+            lons2.shape[0] != n):
+        raise ValueError("All input arrays must have the same length.")
+
+    result = numpy.empty(n, dtype=numpy.double)
+    out = result
+    with nogil:
+        for i in range(n):
+            out[i] = _distance(lats1[i], lons1[i], lats2[i], lons2[i])
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef ndarray cross_distances(const double[:] lats1, const double[:] lons1,
+                              const double[:] lats2, const double[:] lons2):
+    """
+    Compute the distances in meters between each point of the first
+    set of points and each point of the second set of points.
+
+    Returns a two dimensional array of doubles, with one row for
+    every point of the first set, similar to
+    :func:`scipy.spatial.distance.cdist`.
+    """
+    cdef Py_ssize_t i, j, m, n
+    cdef double[:, ::1] out
+
+    m = lats1.shape[0]
+    n = lats2.shape[0]
+    if lons1.shape[0] != m or lons2.shape[0] != n:
+        raise ValueError("lats and lons must have the same length.")
+
+    result = numpy.empty((m, n), dtype=numpy.double)
+    out = result
+    with nogil:
+        for i in range(m):
+            for j in range(n):
+                out[i, j] = _distance(lats1[i], lons1[i], lats2[j], lons2[j])
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef ndarray condensed_distances(const double[:] lats, const double[:] lons):
+    """
+    Compute the distances in meters between all pairs of points
+    described by the lats and lons arrays.
+
+    Returns the condensed distance matrix as a one dimensional array
+    of doubles, in the same format as returned by
+    :func:`scipy.spatial.distance.pdist`. The distance between
+    point i and point j (with i < j) is stored at the index
+    ``n * i - i * (i + 1) // 2 + j - i - 1``.
+    """
+    cdef Py_ssize_t i, j, k, n
+    cdef double[::1] out
+
+    n = lats.shape[0]
+    if lons.shape[0] != n:
+        raise ValueError("lats and lons must have the same length.")
+
+    result = numpy.empty(n * (n - 1) // 2 if n > 1 else 0, dtype=numpy.double)
+    out = result
+    with nogil:
+        k = 0
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                out[k] = _distance(lats[i], lons[i], lats[j], lons[j])
+                k += 1
+    return result
+
+
+cdef double _distance(double lat1, double lon1,
+                      double lat2, double lon2) nogil:
+    cdef double result
+
+    result = _vincenty(lat1, lon1, lat2, lon2)
+    if result < 0.0:
+        result = _haversine(lat1, lon1, lat2, lon2)
+    return result
+
+
+@cython.cdivision(True)
+cdef double _haversine(double lat1, double lon1,
+                       double lat2, double lon2) nogil:
+    cdef double a, c, dLat, dLon
+
+    dLat = deg2rad(lat2 - lat1) / 2.0
+    dLon = deg2rad(lon2 - lon1) / 2.0
+
+    lat1 = deg2rad(lat1)
+    lat2 = deg2rad(lat2)
+
+    a = sin(dLat) ** 2 + cos(lat1) * cos(lat2) * sin(dLon) ** 2
+    c = asin(fmin(1, sqrt(a)))
+    return 1000.0 * 2.0 * EARTH_RADIUS * c
+
+
+@cython.cdivision(True)
+cdef double _vincenty(double lat1, double lon1,
+                      double lat2, double lon2) nogil:
+    # Returns -1.0 if the formula doesn't converge, so it can be
+    # used without holding the GIL.
     cdef double delta_lon, reduced_lat1, reduced_lat2
     cdef double sin_reduced1, cos_reduced1, sin_reduced2, cos_reduced2
     cdef double lambda_lon, lambda_prime
@@ -203,7 +368,7 @@ cpdef double vincenty_distance(double lat1, double lon1,
     lambda_prime = 2.0 * M_PI
 
     i = 0
-    while (abs(lambda_lon - lambda_prime) > VINCENTY_CUTOFF and
+    while (fabs(lambda_lon - lambda_prime) > VINCENTY_CUTOFF and
            i <= VINCENTY_ITERATIONS):
         i += 1
 
@@ -252,7 +417,7 @@ cpdef double vincenty_distance(double lat1, double lon1,
         )
 
     if i > VINCENTY_ITERATIONS:
-        raise ValueError("Vincenty formula failed to converge!")
+        return -1.0
 
     u_sq = (
         cos_sq_alpha *
@@ -430,18 +595,24 @@ cpdef double longitude_add(double lat, double lon, double distance):
     return fmax(MIN_LON, fmin(lon1, MAX_LON))
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 cpdef double max_distance(double lat, double lon,
                           ndarray[double_t, ndim=2] points):
     """
     Returns the maximum distance from the given lat/lon point to any of
     the provided points in the points array.
     """
-    cdef double dist, p_lat, p_lon, result
+    cdef Py_ssize_t i
+    cdef double result
+
+    if points.shape[0] and points.shape[1] != 2:
+        raise ValueError("points must be an array of lat/lon pairs.")
 
     result = 0.0
-    for p_lat, p_lon in points:
-        dist = distance(lat, lon, p_lat, p_lon)
-        result = fmax(result, dist)
+    with nogil:
+        for i in range(points.shape[0]):
+            result = fmax(result, _distance(lat, lon, points[i, 0], points[i, 1]))
     return result
 
 
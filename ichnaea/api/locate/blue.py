@@ -19,7 +19,9 @@ from ichnaea.api.locate.result import (
     Region,
     RegionResultList,
 )
-from ichnaea.api.locate.score import station_score
+from ichnaea.api.locate.score import station_array, station_scores
+from ichnaea.api.locate.shardquery import SHARD_QUERY
+from ichnaea.api.locate.stationcache import STATION_CACHE
 from ichnaea.geocode import GEOCODER
 from ichnaea.models import BlueShard
 from ichnaea.models.constants import MIN_BLUE_SIGNAL
@@ -33,6 +35,8 @@ class BluePositionMixin(object):
     """
 
     raven_client = None
+    station_cache = STATION_CACHE
+    shard_query = SHARD_QUERY
     result_list = PositionResultList
     result_type = Position
 
@@ -42,7 +46,14 @@ class BluePositionMixin(object):
     def search_blue(self, query):
         results = self.result_list()
 
-        blues = query_macs(query, query.blue, self.raven_client, BlueShard)
+        blues = query_macs(
+            query,
+            query.blue,
+            self.raven_client,
+            BlueShard,
+            self.station_cache,
+            self.shard_query,
+        )
         for cluster in cluster_networks(
             blues,
             query.blue,
@@ -69,6 +80,8 @@ class BlueRegionMixin(object):
     """
 
     raven_client = None
+    station_cache = STATION_CACHE
+    shard_query = SHARD_QUERY
     result_list = RegionResultList
     result_type = Region
 
@@ -80,9 +93,17 @@ class BlueRegionMixin(object):
 
         now = util.utcnow()
         regions = defaultdict(int)
-        blues = query_macs(query, query.blue, self.raven_client, BlueShard)
-        for blue in blues:
-            regions[blue.region] += station_score(blue, now)
+        blues = query_macs(
+            query,
+            query.blue,
+            self.raven_client,
+            BlueShard,
+            self.station_cache,
+            self.shard_query,
+        )
+        scores = station_scores(station_array(blues), now)
+        for blue, score in zip(blues, scores.tolist()):
+            regions[blue.region] += score
 
         for code, score in regions.items():
             region = GEOCODER.region_for_code(code)
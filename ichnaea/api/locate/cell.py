@@ -1,8 +1,7 @@
 """Search implementation using a cell database."""
 
 from base64 import b64decode
-from collections import defaultdict
-import math
+from collections import defaultdict, namedtuple
 
 import numpy
 from sqlalchemy import select
@@ -19,8 +18,16 @@ from ichnaea.api.locate.result import (
     Region,
     RegionResultList,
 )
-from ichnaea.api.locate.score import area_score, station_score
-from geocalc import distance
+from ichnaea.api.locate.score import (
+    area_array,
+    area_score,
+    area_scores,
+    station_array,
+    station_scores,
+)
+from ichnaea.api.locate.shardquery import SHARD_QUERY, shard_statement, ShardQuery
+from ichnaea.api.locate.stationcache import STATION_CACHE
+from geocalc import distances_from
 from ichnaea.geocode import GEOCODER
 from ichnaea.models import (
     area_id,
@@ -35,6 +42,24 @@ from ichnaea.models import (
 from ichnaea.models.constants import MIN_CELL_SIGNAL
 from ichnaea import util
 
+# All fields used in score calculation and those we
+# need for the position.
+CELL_STATION_FIELDS = (
+    "cellid",
+    "lat",
+    "lon",
+    "radius",
+    "region",
+    "samples",
+    "created",
+    "modified",
+    "last_seen",
+    "block_last",
+    "block_count",
+)
+
+CellStation = namedtuple("CellStation", CELL_STATION_FIELDS)
+
 NETWORK_DTYPE = numpy.dtype(
     [
         ("lat", numpy.double),
@@ -54,7 +79,7 @@ def cluster_cells(cells, lookups, min_age=0):
     Cluster cells by area.
     """
     now = util.utcnow()
-    today = now.date()
+    today = numpy.datetime64(now.date())
 
     # Create a dict of cell ids mapped to their age and signal strength.
     obs_data = {}
@@ -64,32 +89,22 @@ def cluster_cells(cells, lookups, min_age=0):
             lookup.signalStrength or MIN_CELL_SIGNAL[lookup.radioType],
         )
 
-    areas = defaultdict(list)
-    for cell in cells:
-        areas[area_id(cell)].append(cell)
+    stations = station_array(cells)
+    networks = numpy.empty(len(stations), dtype=NETWORK_DTYPE)
+    networks["lat"] = stations["lat"]
+    networks["lon"] = stations["lon"]
+    networks["radius"] = [cell.radius for cell in cells]
+    networks["age"] = [obs_data[cell.cellid][0] for cell in cells]
+    networks["signalStrength"] = [obs_data[cell.cellid][1] for cell in cells]
+    networks["score"] = station_scores(stations, now)
+    networks["id_b64"] = [encode_cellid(*cell.cellid, codec="base64") for cell in cells]
+    networks["seen_today"] = stations["last_seen"] >= today
 
-    clusters = []
-    for area_cells in areas.values():
-        clusters.append(
-            numpy.array(
-                [
-                    (
-                        cell.lat,
-                        cell.lon,
-                        cell.radius,
-                        obs_data[cell.cellid][0],
-                        obs_data[cell.cellid][1],
-                        station_score(cell, now),
-                        encode_cellid(*cell.cellid, codec="base64"),
-                        bool(cell.last_seen is not None and cell.last_seen >= today),
-                    )
-                    for cell in area_cells
-                ],
-                dtype=NETWORK_DTYPE,
-            )
-        )
+    areas = defaultdict(list)
+    for i, cell in enumerate(cells):
+        areas[area_id(cell)].append(i)
 
-    return clusters
+    return [networks[indices] for indices in areas.values()]
 
 
 def cluster_areas(areas, lookups, min_age=0):
@@ -97,7 +112,7 @@ def cluster_areas(areas, lookups, min_age=0):
     Cluster areas, treat each area as its own cluster.
     """
     now = util.utcnow()
-    today = now.date()
+    today = numpy.datetime64(now.date())
 
     # Create a dict of area ids mapped to their age and signal strength.
     obs_data = {}
@@ -107,27 +122,20 @@ def cluster_areas(areas, lookups, min_age=0):
             lookup.signalStrength or MIN_CELL_SIGNAL[lookup.radioType],
         )
 
-    clusters = []
-    for area in areas:
-        clusters.append(
-            numpy.array(
-                [
-                    (
-                        area.lat,
-                        area.lon,
-                        area.radius,
-                        obs_data[area.areaid][0],
-                        obs_data[area.areaid][1],
-                        area_score(area, now),
-                        encode_cellarea(*area.areaid, codec="base64"),
-                        bool(area.last_seen is not None and area.last_seen >= today),
-                    )
-                ],
-                dtype=NETWORK_DTYPE,
-            )
-        )
+    rows = area_array(areas)
+    networks = numpy.empty(len(rows), dtype=NETWORK_DTYPE)
+    networks["lat"] = rows["lat"]
+    networks["lon"] = rows["lon"]
+    networks["radius"] = [area.radius for area in areas]
+    networks["age"] = [obs_data[area.areaid][0] for area in areas]
+    networks["signalStrength"] = [obs_data[area.areaid][1] for area in areas]
+    networks["score"] = area_scores(rows, now)
+    networks["id_b64"] = [
+        encode_cellarea(*area.areaid, codec="base64") for area in areas
+    ]
+    networks["seen_today"] = rows["last_seen"] >= today
 
-    return clusters
+    return [networks[i : i + 1] for i in range(len(networks))]
 
 
 def aggregate_cell_position(networks, min_accuracy, max_accuracy):
@@ -145,18 +153,12 @@ def aggregate_cell_position(networks, min_accuracy, max_accuracy):
         score = networks[0]["score"]
         return (float(lat), float(lon), float(radius), float(score))
 
-    points = numpy.array(
-        [(net["lat"], net["lon"]) for net in networks], dtype=numpy.double
-    )
+    points = numpy.column_stack((networks["lat"], networks["lon"]))
 
-    weights = numpy.array(
-        [
-            net["score"]
-            * min(math.sqrt(2000.0 / net["age"]), 1.0)
-            / math.pow(net["signalStrength"], 2)
-            for net in networks
-        ],
-        dtype=numpy.double,
+    weights = (
+        networks["score"]
+        * numpy.minimum(numpy.sqrt(2000.0 / networks["age"]), 1.0)
+        / numpy.power(networks["signalStrength"].astype(numpy.double), 2)
     )
 
     lat, lon = numpy.average(points, axis=0, weights=weights)
@@ -164,58 +166,59 @@ def aggregate_cell_position(networks, min_accuracy, max_accuracy):
 
     # Guess the accuracy as the 95th percentile of the distances
     # from the lat/lon to the positions of all networks.
-    distances = numpy.array(
-        [distance(lat, lon, net["lat"], net["lon"]) for net in networks],
-        dtype=numpy.double,
-    )
-    accuracy = min(max(numpy.percentile(distances, 95), min_accuracy), max_accuracy)
+    dists = distances_from(lat, lon, networks["lat"], networks["lon"])
+    accuracy = min(max(numpy.percentile(dists, 95), min_accuracy), max_accuracy)
 
     return (float(lat), float(lon), float(accuracy), float(score))
 
 
-def query_cells(query, lookups, model, raven_client):
+def query_cells(
+    query, lookups, model, raven_client, station_cache=None, shard_query=None
+):
     # Given a location query and a list of lookup instances, query the
-    # database and return a list of model objects.
+    # database and return a list of station rows.
     cellids = [lookup.cellid for lookup in lookups]
     if not cellids:
         return []
 
-    # load all fields used in score calculation and those we
-    # need for the position
-    load_fields = (
-        "cellid",
-        "lat",
-        "lon",
-        "radius",
-        "region",
-        "samples",
-        "created",
-        "modified",
-        "last_seen",
-        "block_last",
-        "block_count",
-    )
     result = []
     today = util.utcnow().date()
 
     try:
+        if station_cache is not None:
+            cached, cellids = station_cache.get_many(model.station_type, cellids)
+            result.extend(
+                [
+                    station
+                    for station in cached.values()
+                    if station is not None and not station_blocked(station, today)
+                ]
+            )
+
+        radios = {lookup.cellid: lookup.radioType for lookup in lookups}
         shards = defaultdict(list)
-        for lookup in lookups:
-            shards[model.shard_model(lookup.radioType)].append(lookup.cellid)
-
-        for shard, shard_cellids in shards.items():
-            columns = shard.__table__.c
-            fields = [getattr(columns, f) for f in load_fields]
-            rows = (
-                query.session.execute(
-                    select(fields)
-                    .where(columns.lat.isnot(None))
-                    .where(columns.lon.isnot(None))
-                    .where(columns.cellid.in_(shard_cellids))
-                )
-            ).fetchall()
+        for cellid in cellids:
+            shards[model.shard_model(radios[cellid])].append(cellid)
+
+        if shard_query is None:
+            shard_query = ShardQuery()
+        statements = {
+            shard: shard_statement(shard, CELL_STATION_FIELDS, "cellid", shard_cellids)
+            for shard, shard_cellids in shards.items()
+        }
+        rows = shard_query.execute(query.session, model.station_type, statements)
+
+        loaded = dict.fromkeys(cellids)
+        stations = [CellStation(*row) for row in rows]
+        for station in stations:
+            loaded[encode_cellid(*station.cellid)] = station
+
+        result.extend(
+            [station for station in stations if not station_blocked(station, today)]
+        )
 
-            result.extend([row for row in rows if not station_blocked(row, today)])
+        if station_cache is not None and loaded:
+            station_cache.set_many(model.station_type, loaded)
     except Exception:
         raven_client.captureException()
 
@@ -265,6 +268,8 @@ class CellPositionMixin(object):
 
     cell_model = CellShard
     area_model = CellArea
+    station_cache = STATION_CACHE
+    shard_query = SHARD_QUERY
     result_list = PositionResultList
     result_type = Position
 
@@ -277,7 +282,14 @@ class CellPositionMixin(object):
         results = self.result_list()
 
         if query.cell:
-            cells = query_cells(query, query.cell, self.cell_model, self.raven_client)
+            cells = query_cells(
+                query,
+                query.cell,
+                self.cell_model,
+                self.raven_client,
+                self.station_cache,
+                self.shard_query,
+            )
             if cells:
                 for cluster in cluster_cells(cells, query.cell):
                     lat, lon, accuracy, score = aggregate_cell_position(
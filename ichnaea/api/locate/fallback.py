@@ -22,7 +22,7 @@ from ichnaea.api.schema import (
 from ichnaea.api.locate.constants import DataSource
 from ichnaea.api.locate.source import PositionSource
 from ichnaea.api.rate_limit import rate_limit_exceeded
-from geocalc import distance
+from geocalc import distances_from
 
 # Magic constant to cache not found.
 LOCATION_NOT_FOUND = "404"
@@ -412,10 +412,8 @@ class FallbackCache(object):
             lat = float(lat)
             lon = float(lon)
 
-            radius = 0.0
-            for circle in circles:
-                p_dist = distance(lat, lon, circle[0], circle[1]) + circle[2]
-                radius = max(radius, p_dist)
+            p_dists = distances_from(lat, lon, circles[:, 0], circles[:, 1])
+            radius = max((p_dists + circles[:, 2]).max(), 0.0)
 
             return ExternalResult(
                 lat=lat, lon=lon, accuracy=float(radius), fallback=results[0].fallback
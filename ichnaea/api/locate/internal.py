@@ -1,10 +1,20 @@
 """Implementation of a search source based on our internal data."""
 
 from ichnaea.api.locate.blue import BluePositionMixin, BlueRegionMixin
-from ichnaea.api.locate.cell import CellPositionMixin, CellRegionMixin
+from ichnaea.api.locate.cell import CellPositionMixin, CellRegionMixin, CellStation
 from ichnaea.api.locate.constants import DataSource
+from ichnaea.api.locate.mac import MacStation
+from ichnaea.api.locate.snapshot import configure_station_snapshots
 from ichnaea.api.locate.source import PositionSource, RegionSource
+from ichnaea.api.locate.stationcache import configure_shared_station_cache
 from ichnaea.api.locate.wifi import WifiPositionMixin, WifiRegionMixin
+from ichnaea.models import decode_cellid, decode_mac
+
+STATION_ROW_TYPES = {
+    "blue": (MacStation, decode_mac),
+    "cell": (CellStation, decode_cellid),
+    "wifi": (MacStation, decode_mac),
+}
 
 
 class BaseInternalSource(object):
@@ -13,6 +23,15 @@ class BaseInternalSource(object):
     fallback_field = None
     source = DataSource.internal
 
+    def __init__(self, *args, **kw):
+        super(BaseInternalSource, self).__init__(*args, **kw)
+        self.station_cache = configure_station_snapshots(
+            STATION_ROW_TYPES,
+            fallback=configure_shared_station_cache(
+                self.redis_client, STATION_ROW_TYPES, local_cache=self.station_cache
+            ),
+        )
+
     def should_search(self, query, results):
         if not super(BaseInternalSource, self).should_search(query, results):
             return False
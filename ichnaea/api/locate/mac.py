@@ -1,20 +1,49 @@
 """Search implementation using a mac based source."""
 
 from base64 import b64decode
-from collections import defaultdict
-import itertools
+from collections import defaultdict, namedtuple
 import math
 
 import numpy
 from scipy.cluster import hierarchy
 from scipy.optimize import leastsq
-from sqlalchemy import select
 
-from geocalc import distance
-from ichnaea.api.locate.score import station_score
+from geocalc import condensed_distances, distance, distances, distances_from
+from ichnaea.api.locate.score import station_array, station_scores
+from ichnaea.api.locate.shardquery import shard_statement, ShardQuery
 from ichnaea.models import decode_mac, encode_mac, station_blocked
 from ichnaea import util
 
+# A lower bound for the length of one degree of latitude and of one
+# degree of longitude at the equator, in meters.
+METERS_PER_DEGREE = 110000.0
+
+# Safety margin for the bounding box check in cluster_networks, which
+# is a close but not exact estimate on the surface of the ellipsoid.
+BBOX_MARGIN = 0.999
+
+# Constants for the WGS-84 ellipsoid.
+EARTH_MAJOR_RADIUS = 6378137.0
+EARTH_ECCENTRICITY_SQ = 0.0066943799901413165
+
+# All fields used in score calculation and those we
+# need for the position or region.
+MAC_STATION_FIELDS = (
+    "mac",
+    "lat",
+    "lon",
+    "radius",
+    "region",
+    "samples",
+    "created",
+    "modified",
+    "last_seen",
+    "block_last",
+    "block_count",
+)
+
+MacStation = namedtuple("MacStation", MAC_STATION_FIELDS)
+
 NETWORK_DTYPE = numpy.dtype(
     [
         ("lat", numpy.double),
@@ -37,7 +66,7 @@ def cluster_networks(
     a list of clusters of nearby networks.
     """
     now = util.utcnow()
-    today = now.date()
+    today = numpy.datetime64(now.date())
 
     # Create a dict of macs mapped to their age and signal strength.
     obs_data = {}
@@ -47,22 +76,18 @@ def cluster_networks(
             lookup.signalStrength or min_signal,
         )
 
-    networks = numpy.array(
-        [
-            (
-                model.lat,
-                model.lon,
-                model.radius or min_radius,
-                obs_data[model.mac][0],
-                obs_data[model.mac][1],
-                station_score(model, now),
-                encode_mac(model.mac, codec="base64"),
-                bool(model.last_seen is not None and model.last_seen >= today),
-            )
-            for model in models
-        ],
-        dtype=NETWORK_DTYPE,
+    stations = station_array(models)
+    networks = numpy.empty(len(stations), dtype=NETWORK_DTYPE)
+    networks["lat"] = stations["lat"]
+    networks["lon"] = stations["lon"]
+    networks["radius"] = numpy.where(
+        stations["radius"] > 0, stations["radius"], min_radius
     )
+    networks["age"] = [obs_data[model.mac][0] for model in models]
+    networks["signalStrength"] = [obs_data[model.mac][1] for model in models]
+    networks["score"] = station_scores(stations, now)
+    networks["mac_b64"] = [encode_mac(model.mac, codec="base64") for model in models]
+    networks["seen_today"] = stations["last_seen"] >= today
 
     # Only consider clusters that have at least 2 found networks
     # inside them. Otherwise someone could use a combination of
@@ -85,20 +110,24 @@ def cluster_networks(
             # neither of which is large enough to be returned.
             return []
 
-    # Calculate the condensed distance matrix based on distance in meters.
-    # This avoids calculating the square form, which would calculate
-    # each value twice and avoids calculating the diagonal of zeros.
-    # We avoid the special cases for length < 2 with the above checks.
-    # See scipy.spatial.distance.squareform and
-    # https://stackoverflow.com/questions/13079563
-    dist_matrix = numpy.zeros(length * (length - 1) // 2, dtype=numpy.double)
-    for i, (a, b) in enumerate(itertools.combinations(positions, 2)):
-        dist_matrix[i] = distance(a[0], a[1], b[0], b[1])
-
-    link_matrix = hierarchy.linkage(dist_matrix, method="complete")
-    assignments = hierarchy.fcluster(
-        link_matrix, max_distance, criterion="distance", depth=2
-    )
+    lats = networks["lat"]
+    lons = networks["lon"]
+    assignments = numpy.zeros(length, dtype=numpy.int64)
+    next_label = 1
+    for group in grid_groups(lats, lons, max_distance):
+        if (
+            len(group) < 2
+            or bbox_diameter(lats[group], lons[group]) <= max_distance * BBOX_MARGIN
+        ):
+            # All networks in the group are close to each other and
+            # complete-linkage would merge them into a single cluster.
+            assignments[group] = next_label
+            next_label += 1
+        else:
+            # Only use the expensive clustering for ambiguous groups.
+            labels = link_networks(lats[group], lons[group], max_distance)
+            assignments[group] = labels + (next_label - 1)
+            next_label += labels.max()
 
     indexed_clusters = defaultdict(list)
     for i, net in zip(assignments, networks):
@@ -112,55 +141,189 @@ def cluster_networks(
     return clusters
 
 
-def aggregate_mac_position(networks, minimum_accuracy):
-    # Idea based on https://gis.stackexchange.com/questions/40660
+def grid_groups(lats, lons, max_distance):
+    """
+    Split the networks into groups of nearby networks, returning a
+    list of index arrays.
 
-    def func(point, points):
-        return numpy.array(
-            [
-                distance(p["lat"], p["lon"], point[0], point[1])
-                * min(math.sqrt(2000.0 / p["age"]), 1.0)
-                / math.pow(p["signalStrength"], 2)
-                for p in points
-            ]
-        )
+    Each network is snapped into a grid cell at least max_distance
+    wide and tall, so any two networks within max_distance of each
+    other are in the same or in adjacent cells. Connected runs of
+    occupied cells form one group.
 
-    # Guess initial position as the weighted mean over all networks.
-    points = numpy.array(
-        [(net["lat"], net["lon"]) for net in networks], dtype=numpy.double
-    )
+    Complete-linkage merges between different groups happen at a
+    distance above max_distance, so clustering each group on its own
+    gives the same result as clustering all networks at once.
+    """
+    length = len(lats)
+    cell_lat = max_distance / METERS_PER_DEGREE
+    max_lat = float(numpy.abs(lats).max()) + cell_lat
+    if max_lat >= 89.0 or float(lons.max() - lons.min()) > 180.0:
+        # Close to the poles or across the antimeridian the grid doesn't
+        # work, treat all networks as one group.
+        return [numpy.arange(length)]
+
+    cell_lon = cell_lat / math.cos(math.radians(max_lat))
+    cells = numpy.column_stack(
+        (numpy.floor(lats / cell_lat), numpy.floor(lons / cell_lon))
+    ).astype(numpy.int64)
+    unique_cells, cell_index = numpy.unique(cells, axis=0, return_inverse=True)
+    cell_index = cell_index.reshape(-1)
+
+    # Union-find over the occupied cells, joining neighbouring cells.
+    positions = {(int(x), int(y)): i for i, (x, y) in enumerate(unique_cells)}
+    parents = list(range(len(unique_cells)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for (x, y), i in positions.items():
+        for dx, dy in ((0, 1), (1, -1), (1, 0), (1, 1)):
+            j = positions.get((x + dx, y + dy))
+            if j is not None:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = numpy.array([find(i) for i in range(len(parents))])[cell_index]
+    order = numpy.argsort(roots, kind="stable")
+    splits = numpy.flatnonzero(numpy.diff(roots[order])) + 1
+    return numpy.split(order, splits)
+
+
+def bbox_diameter(lats, lons):
+    """
+    Return the largest distance between two corners of the bounding
+    box around the given positions, which bounds the distance between
+    any two of the positions.
 
-    weights = numpy.array(
-        [
-            net["score"]
-            * min(math.sqrt(2000.0 / net["age"]), 1.0)
-            / math.pow(net["signalStrength"], 2)
-            for net in networks
-        ],
-        dtype=numpy.double,
+    Returns infinity if the bounding box is close to one of the poles
+    or crosses the antimeridian.
+    """
+    min_lat, max_lat = lats.min(), lats.max()
+    min_lon, max_lon = lons.min(), lons.max()
+    if max(abs(min_lat), abs(max_lat)) >= 89.0 or max_lon - min_lon > 180.0:
+        return numpy.inf
+    corners = condensed_distances(
+        numpy.array([min_lat, min_lat, max_lat, max_lat], dtype=numpy.double),
+        numpy.array([min_lon, max_lon, min_lon, max_lon], dtype=numpy.double),
     )
+    return corners.max()
 
-    initial = numpy.average(points, axis=0, weights=weights)
 
-    (lat, lon), cov_x, info, mesg, ier = leastsq(
-        func, initial, args=networks, full_output=True
+def link_networks(lats, lons, max_distance):
+    """
+    Cluster the positions using complete-linkage hierarchical
+    clustering, returning an array of cluster labels starting at 1.
+    """
+    # Calculate the condensed distance matrix based on distance in meters.
+    # This avoids calculating the square form, which would calculate
+    # each value twice and avoids calculating the diagonal of zeros.
+    # See scipy.spatial.distance.squareform and
+    # https://stackoverflow.com/questions/13079563
+    dist_matrix = condensed_distances(lats, lons)
+
+    link_matrix = hierarchy.linkage(dist_matrix, method="complete")
+    return hierarchy.fcluster(link_matrix, max_distance, criterion="distance", depth=2)
+
+
+def meters_per_degree(lat):
+    """
+    Return the length of one degree of latitude and one degree of
+    longitude in meters, at the given latitude on the WGS-84 ellipsoid.
+    """
+    sin_lat = math.sin(math.radians(lat))
+    denominator = 1.0 - EARTH_ECCENTRICITY_SQ * sin_lat ** 2
+    meridian = EARTH_MAJOR_RADIUS * (1.0 - EARTH_ECCENTRICITY_SQ) / denominator ** 1.5
+    normal = EARTH_MAJOR_RADIUS / math.sqrt(denominator)
+    return (
+        math.radians(meridian),
+        math.radians(normal * math.cos(math.radians(lat))),
     )
 
-    if ier not in (1, 2, 3, 4):
-        # No solution found, use initial estimate.
-        lat, lon = initial
+
+def aggregate_mac_position(networks, minimum_accuracy):
+    # Idea based on https://gis.stackexchange.com/questions/40660
+    # The position minimizes the sum of squared weighted distances
+    # to all networks.
+
+    lats = numpy.ascontiguousarray(networks["lat"], dtype=numpy.double)
+    lons = numpy.ascontiguousarray(networks["lon"], dtype=numpy.double)
+    age_weights = numpy.minimum(numpy.sqrt(2000.0 / networks["age"]), 1.0)
+    signal_squared = numpy.power(networks["signalStrength"].astype(numpy.double), 2)
+    residual_weights = age_weights / signal_squared
+
+    # Guess initial position as the weighted mean over all networks.
+    points = numpy.column_stack((lats, lons))
+    weights = networks["score"] * age_weights / signal_squared
+
+    initial = numpy.average(points, axis=0, weights=weights)
+
+    if bbox_diameter(lats, lons) <= minimum_accuracy:
+        # All networks are within the minimum accuracy of each other,
+        # so the plane is a close enough approximation of the surface.
+        # On the plane the sum of squared weighted distances is smallest
+        # at the mean weighted by the squared residual weights.
+        lat, lon = numpy.average(points, axis=0, weights=residual_weights ** 2)
+    else:
+        lat, lon = solve_mac_position(lats, lons, residual_weights, initial)
 
     # Guess the accuracy as the 95th percentile of the distances
     # from the lat/lon to the positions of all networks.
-    distances = numpy.array(
-        [distance(lat, lon, net["lat"], net["lon"]) for net in networks],
-        dtype=numpy.double,
+    accuracy = max(
+        numpy.percentile(distances_from(lat, lon, lats, lons), 95), minimum_accuracy
     )
-    accuracy = max(numpy.percentile(distances, 95), minimum_accuracy)
 
     return (float(lat), float(lon), float(accuracy))
 
 
+def solve_mac_position(lats, lons, residual_weights, initial):
+    """
+    Find the position minimizing the sum of squared weighted distances
+    to all networks, starting from the initial position.
+
+    The solver works in meters on a tangent plane around the initial
+    position. Each network contributes the vector pointing from it to
+    the position, scaled to the exact weighted distance. On the plane
+    the Jacobian of these residuals is a constant diagonal.
+    """
+    lat0, lon0 = initial
+    lat_scale, lon_scale = meters_per_degree(lat0)
+    xs = (lons - lon0) * lon_scale
+    ys = (lats - lat0) * lat_scale
+    jacobian = numpy.zeros((2 * len(lats), 2), dtype=numpy.double)
+    jacobian[0::2, 0] = residual_weights
+    jacobian[1::2, 1] = residual_weights
+
+    def func(offset):
+        dx = offset[0] - xs
+        dy = offset[1] - ys
+        planar = numpy.hypot(dx, dy)
+        exact = distances(
+            lats, lons, lat0 + offset[1] / lat_scale, lon0 + offset[0] / lon_scale
+        )
+        scale = numpy.divide(
+            exact * residual_weights,
+            planar,
+            out=residual_weights.copy(),
+            where=planar > 0.0,
+        )
+        return numpy.column_stack((dx * scale, dy * scale)).ravel()
+
+    offset, cov_x, info, mesg, ier = leastsq(
+        func, numpy.zeros(2), Dfun=lambda offset: jacobian, full_output=True
+    )
+
+    if ier not in (1, 2, 3, 4):
+        # No solution found, use initial estimate.
+        return (lat0, lon0)
+
+    return (lat0 + offset[1] / lat_scale, lon0 + offset[0] / lon_scale)
+
+
 def aggregate_cluster_position(
     cluster,
     result_type,
@@ -191,47 +354,50 @@ def aggregate_cluster_position(
     )
 
 
-def query_macs(query, lookups, raven_client, db_model):
+def query_macs(
+    query, lookups, raven_client, db_model, station_cache=None, shard_query=None
+):
     macs = [lookup.mac for lookup in lookups]
     if not macs:
         return []
 
-    # load all fields used in score calculation and those we
-    # need for the position or region
-    load_fields = (
-        "mac",
-        "lat",
-        "lon",
-        "radius",
-        "region",
-        "samples",
-        "created",
-        "modified",
-        "last_seen",
-        "block_last",
-        "block_count",
-    )
     result = []
     today = util.utcnow().date()
 
     try:
+        if station_cache is not None:
+            cached, macs = station_cache.get_many(db_model.station_type, macs)
+            result.extend(
+                [
+                    station
+                    for station in cached.values()
+                    if station is not None and not station_blocked(station, today)
+                ]
+            )
+
         shards = defaultdict(list)
         for mac in macs:
             shards[db_model.shard_model(mac)].append(mac)
 
-        for shard, shard_macs in shards.items():
-            columns = shard.__table__.c
-            fields = [getattr(columns, f) for f in load_fields]
-            rows = (
-                query.session.execute(
-                    select(fields)
-                    .where(columns.lat.isnot(None))
-                    .where(columns.lon.isnot(None))
-                    .where(columns.mac.in_(shard_macs))
-                )
-            ).fetchall()
-
-            result.extend([row for row in rows if not station_blocked(row, today)])
+        if shard_query is None:
+            shard_query = ShardQuery()
+        statements = {
+            shard: shard_statement(shard, MAC_STATION_FIELDS, "mac", shard_macs)
+            for shard, shard_macs in shards.items()
+        }
+        rows = shard_query.execute(query.session, db_model.station_type, statements)
+
+        loaded = dict.fromkeys(macs)
+        stations = [MacStation(*row) for row in rows]
+        for station in stations:
+            loaded[encode_mac(station.mac)] = station
+
+        result.extend(
+            [station for station in stations if not station_blocked(station, today)]
+        )
+
+        if station_cache is not None and loaded:
+            station_cache.set_many(db_model.station_type, loaded)
     except Exception:
         raven_client.captureException()
     return result
@@ -29,8 +29,10 @@ class Query(object):
 
     _fallback = None
     _geoip = None
+    _geoip_pending = False
     _ip = None
     _region = None
+    _region_pending = False
 
     def __init__(
         self,
@@ -113,8 +115,16 @@ class Query(object):
         """
         A GeoIP database entry for the originating IP address.
 
+        The entry is looked up on first access, so queries answered
+        without the GeoIP source don't need to look it up.
+
         Can return None if no database match could be found.
         """
+        if self._geoip_pending:
+            self._geoip_pending = False
+            self._geoip = self.geoip_db.lookup(self._ip)
+            self._region_pending = False
+            self._region = self._geoip.get("region_code") if self._geoip else None
         return self._geoip
 
     @property
@@ -142,23 +152,24 @@ class Query(object):
         except ValueError:
             valid = None
         self._ip = valid
-        if valid:
-            region = None
-            geoip = None
-            if self.geoip_db:
-                geoip = self.geoip_db.lookup(valid)
-                if geoip:
-                    region = geoip.get("region_code")
-            self._geoip = geoip
-            self._region = region
+        self._geoip = None
+        self._region = None
+        # Defer the GeoIP lookups until the results are needed.
+        self._geoip_pending = self._region_pending = bool(valid and self.geoip_db)
 
     @property
     def region(self):
         """
         The two letter region code of origin for this query.
 
+        Unless the full GeoIP database entry is already known, only
+        the region code is looked up on first access.
+
         Can return None, if no region could be determined.
         """
+        if self._region_pending:
+            self._region_pending = False
+            self._region = self.geoip_db.lookup_region(self._ip)
         return self._region
 
     @property
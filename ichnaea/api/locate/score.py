@@ -1,4 +1,44 @@
+from datetime import datetime, timedelta
 import math
+from operator import attrgetter
+
+import numpy
+import pytz
+
+DATE_TYPE = numpy.dtype("datetime64[D]")
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+EPOCH_ORDINAL = EPOCH.toordinal()
+NAT = numpy.datetime64("NaT").astype(numpy.int64)
+ONE_DAY = numpy.timedelta64(1, "D")
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Columns of a station or area row used for positions and scores,
+# stored in one structured array for all rows of a query. Missing
+# integers are stored as 0, missing dates as NaT.
+STATION_DTYPE = numpy.dtype(
+    [
+        ("lat", numpy.double),
+        ("lon", numpy.double),
+        ("radius", numpy.int64),
+        ("samples", numpy.int64),
+        ("created", "datetime64[us]"),
+        ("modified", "datetime64[us]"),
+        ("last_seen", "datetime64[D]"),
+        ("block_last", "datetime64[D]"),
+    ]
+)
+
+AREA_DTYPE = numpy.dtype(
+    [
+        ("lat", numpy.double),
+        ("lon", numpy.double),
+        ("radius", numpy.int64),
+        ("num_cells", numpy.int64),
+        ("created", "datetime64[us]"),
+        ("modified", "datetime64[us]"),
+        ("last_seen", "datetime64[D]"),
+    ]
+)
 
 
 def area_score(obj, now):
@@ -11,6 +51,108 @@ def station_score(obj, now):
     return score(obj, now, station_score_created, station_score_samples)
 
 
+def timestamp_column(values):
+    # Return a datetime64[us] array for a sequence of timezone aware
+    # datetimes, avoiding numpy's slow conversion of datetime objects.
+    return numpy.array(
+        [
+            NAT if value is None else (value - EPOCH) // ONE_MICROSECOND
+            for value in values
+        ],
+        dtype=numpy.int64,
+    ).view("datetime64[us]")
+
+
+def date_column(values):
+    # Return a datetime64[D] array for a sequence of dates.
+    return numpy.array(
+        [
+            NAT if value is None else value.toordinal() - EPOCH_ORDINAL
+            for value in values
+        ],
+        dtype=numpy.int64,
+    ).view("datetime64[D]")
+
+
+def row_array(rows, dtype):
+    # Return a structured array of the given dtype for a list of rows.
+    array = numpy.empty(len(rows), dtype=dtype)
+    if not rows:
+        return array
+
+    names = dtype.names
+    for name, column in zip(names, zip(*map(attrgetter(*names), rows))):
+        field_type = dtype[name]
+        if field_type.kind == "i":
+            column = [value or 0 for value in column]
+        elif field_type == DATE_TYPE:
+            column = date_column(column)
+        elif field_type.kind == "M":
+            column = timestamp_column(column)
+        array[name] = column
+    return array
+
+
+def station_array(stations):
+    # Return a structured array of STATION_DTYPE for a list of stations.
+    return row_array(stations, STATION_DTYPE)
+
+
+def area_array(areas):
+    # Return a structured array of AREA_DTYPE for a list of areas.
+    return row_array(areas, AREA_DTYPE)
+
+
+def area_scores(areas, now):
+    # Return an array of scores for an AREA_DTYPE array of areas.
+    return area_score_array(
+        areas["modified"],
+        areas["created"],
+        areas["last_seen"],
+        areas["num_cells"],
+        areas["radius"],
+        now,
+    )
+
+
+def station_scores(stations, now):
+    # Return an array of scores for a STATION_DTYPE array of stations.
+    return station_score_array(
+        stations["modified"],
+        stations["created"],
+        stations["last_seen"],
+        stations["block_last"],
+        stations["samples"],
+        stations["radius"],
+        now,
+    )
+
+
+def area_score_array(modified, created, last_seen, num_cells, radius, now):
+    # Return an array of area scores, with the same results as area_score.
+    # Timestamps are datetime64 arrays, dates datetime64[D] arrays with
+    # NaT for missing values and missing integers are 0.
+    return score_array(
+        modified,
+        last_seen,
+        created.astype("datetime64[D]"),
+        area_score_samples_array(num_cells, radius),
+        now,
+    )
+
+
+def station_score_array(modified, created, last_seen, block_last, samples, radius, now):
+    # Return an array of station scores, with the same results as
+    # station_score, for arrays of the same form as area_score_array.
+    return score_array(
+        modified,
+        last_seen,
+        station_score_created_array(created, block_last),
+        station_score_samples_array(samples, radius),
+        now,
+    )
+
+
 def score(obj, now, score_created, score_samples):
     # Returns a score as a floating point number.
     # The score represents the quality or trustworthiness of this record.
@@ -36,6 +178,24 @@ def score(obj, now, score_created, score_samples):
     return age_weight * collection_weight * score_samples(obj)
 
 
+def score_array(modified, last_seen, created, sample_weight, now):
+    # Vectorized version of score, given the created dates and
+    # sample weights.
+    now = numpy.datetime64((now - EPOCH) // ONE_MICROSECOND, "us")
+    month_old = numpy.maximum((now - modified) // ONE_DAY, 0) // 30
+    age_weight = 1 / numpy.sqrt(month_old + 1)
+
+    modified = modified.astype("datetime64[D]")
+    last_seen = numpy.where(
+        numpy.isnat(last_seen), modified, numpy.maximum(modified, last_seen)
+    )
+
+    collected_over = numpy.maximum((last_seen - created) // ONE_DAY, 1)
+    collection_weight = numpy.minimum(collected_over / 10.0, 1.0)
+
+    return age_weight * collection_weight * sample_weight
+
+
 def area_score_created(obj):
     # Areas don't keep track of blocklisting / movements.
     return obj.created.date()
@@ -51,6 +211,14 @@ def station_score_created(obj):
     return max(created, obj.block_last)
 
 
+def station_score_created_array(created, block_last):
+    # Vectorized version of station_score_created.
+    created = created.astype("datetime64[D]")
+    return numpy.where(
+        numpy.isnat(block_last), created, numpy.maximum(created, block_last)
+    )
+
+
 def area_score_samples(obj):
     # treat areas for which we get the exact same
     # cells multiple times as if we only got 1 cell
@@ -68,6 +236,12 @@ def area_score_samples(obj):
     return min(math.sqrt(max(samples, 1)), 10.0)
 
 
+def area_score_samples_array(num_cells, radius):
+    # Vectorized version of area_score_samples.
+    samples = numpy.where((num_cells > 1) & (radius == 0), 1, num_cells)
+    return numpy.minimum(numpy.sqrt(numpy.maximum(samples, 1)), 10.0)
+
+
 def station_score_samples(obj):
     # treat networks for which we get the exact same
     # observations multiple times as if we only got 1 sample
@@ -82,3 +256,16 @@ def station_score_samples(obj):
     # 6.64 for 100 samples
     # 10.0 for 1024 samples or more
     return min(max(math.log(max(samples, 1), 2), 0.5), 10.0)
+
+
+# The sample weight doesn't change beyond 1024 samples, so it's
+# looked up in a table of the weights for up to 1024 samples.
+STATION_SAMPLE_WEIGHTS = numpy.array(
+    [min(max(math.log(max(samples, 1), 2), 0.5), 10.0) for samples in range(1025)]
+)
+
+
+def station_score_samples_array(samples, radius):
+    # Vectorized version of station_score_samples.
+    samples = numpy.where((samples > 1) & (radius == 0), 1, samples)
+    return STATION_SAMPLE_WEIGHTS[numpy.minimum(samples, 1024)]
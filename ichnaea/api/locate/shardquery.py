@@ -0,0 +1,121 @@
+"""
+Queries of station rows spread over several shard tables, used by the
+internal position and region sources.
+"""
+
+from gevent.pool import Pool
+import markus
+from sqlalchemy import select, union_all
+from sqlalchemy.engine import Connection
+
+from ichnaea.conf import settings
+
+METRICS = markus.get_metrics()
+
+
+def configure_shard_query(mode=None, concurrency=None):
+    """
+    Configure and return a :class:`~ichnaea.api.locate.shardquery.ShardQuery`
+    instance.
+    """
+    mode = settings("station_query_mode") if mode is None else mode
+    if concurrency is None:
+        concurrency = settings("station_query_concurrency")
+    return ShardQuery(mode=mode, concurrency=concurrency)
+
+
+def shard_statement(shard, fields, key_field, keys):
+    """
+    Return a select statement for the given fields of all stations
+    with a position and one of the given keys in a shard table.
+    """
+    columns = shard.__table__.c
+    return (
+        select([getattr(columns, field) for field in fields])
+        .where(columns.lat.isnot(None))
+        .where(columns.lon.isnot(None))
+        .where(getattr(columns, key_field).in_(keys))
+    )
+
+
+class ShardQuery(object):
+    """
+    Executes one select statement per shard table and returns the
+    combined rows.
+
+    In the ``serial`` mode the statements are executed one after the
+    other on the request's database session. The ``union`` mode combines
+    them into a single UNION ALL statement, so there's only one round
+    trip to the database. The ``parallel`` mode executes them concurrently
+    in a pool of greenlets, each using its own pooled connection, so the
+    query takes as long as the slowest shard instead of the sum of all.
+
+    Sessions bound to a single connection, like those used in tests,
+    can't execute statements concurrently and fall back to the
+    ``serial`` mode.
+    """
+
+    def __init__(self, mode="serial", concurrency=1):
+        """
+        :param mode: One of ``serial``, ``union`` or ``parallel``.
+        :param concurrency: Maximum number of concurrent statements
+                            in the ``parallel`` mode.
+        """
+        self.mode = mode
+        self.concurrency = max(concurrency, 1)
+
+    def execute(self, session, station_type, statements):
+        """
+        Execute the statements and return a list of all rows.
+
+        :param statements: A mapping of shard models to select statements.
+        """
+        if not statements:
+            return []
+
+        mode = self.mode
+        if len(statements) == 1:
+            mode = "serial"
+
+        bind = session.get_bind()
+        if mode == "parallel" and isinstance(bind, Connection):
+            mode = "serial"
+
+        with METRICS.timer(
+            "locate.query.timing", tags=["type:%s" % station_type, "mode:%s" % mode]
+        ):
+            if mode == "union":
+                return session.execute(union_all(*statements.values())).fetchall()
+            elif mode == "parallel":
+                return self._execute_parallel(bind, station_type, statements)
+            return self._execute_serial(session, station_type, statements)
+
+    def _shard_timer(self, station_type, shard):
+        return METRICS.timer(
+            "locate.query.shard.timing",
+            tags=["type:%s" % station_type, "shard:%s" % shard.__tablename__],
+        )
+
+    def _execute_serial(self, session, station_type, statements):
+        rows = []
+        for shard, statement in statements.items():
+            with self._shard_timer(station_type, shard):
+                rows.extend(session.execute(statement).fetchall())
+        return rows
+
+    def _execute_parallel(self, engine, station_type, statements):
+        def fetch(item):
+            shard, statement = item
+            with self._shard_timer(station_type, shard):
+                with engine.connect() as connection:
+                    return connection.execute(statement).fetchall()
+
+        pool = Pool(min(self.concurrency, len(statements)))
+        rows = []
+        for shard_rows in pool.map(fetch, statements.items()):
+            rows.extend(shard_rows)
+        return rows
+
+
+# Module global holding the configured shard query.
+SHARD_QUERY = configure_shard_query()
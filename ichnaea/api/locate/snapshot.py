@@ -0,0 +1,204 @@
+"""
+Read-only snapshots of the station tables, stored in memory-mapped
+files and used in place of database queries by the internal sources.
+
+A snapshot file consists of a header followed by fixed-width records,
+sorted by the compact binary station key. Each record holds the key
+followed by the station row encoded by
+:func:`~ichnaea.api.locate.stationcache.encode_station`. The files are
+created by the ``location_dump`` script.
+"""
+
+import mmap
+import os.path
+import struct
+
+import markus
+
+from ichnaea.api.locate.stationcache import (
+    decode_station,
+    encode_station,
+    STATION_STRUCT,
+)
+from ichnaea.conf import settings
+
+METRICS = markus.get_metrics()
+
+# Header of a snapshot file: magic bytes, station type, size of the
+# station keys and the number of records.
+HEADER_STRUCT = struct.Struct("<8s8sHQ")
+SNAPSHOT_MAGIC = b"ICHNSNP1"
+
+# Size of the compact binary station keys, in bytes.
+KEY_SIZES = {"blue": 6, "cell": 11, "wifi": 6}
+
+
+def snapshot_filename(snapshot_dir, station_type):
+    """Return the path of a station type's snapshot file."""
+    return os.path.join(snapshot_dir, "%s.snapshot" % station_type)
+
+
+def write_snapshot(fd, station_type, records):
+    """
+    Write a snapshot to a binary file object and return the
+    number of records written.
+
+    :param records: An iterable of two-tuples of the binary station
+                    key and station row, sorted by the key.
+    """
+    key_size = KEY_SIZES[station_type]
+    start = fd.tell()
+    fd.write(b"\x00" * HEADER_STRUCT.size)
+
+    count = 0
+    last_key = None
+    for key, row in records:
+        if len(key) != key_size:
+            raise ValueError("Invalid station key: %r" % key)
+        if last_key is not None and key <= last_key:
+            raise ValueError("Station keys not sorted: %r" % key)
+        fd.write(key + encode_station(row))
+        last_key = key
+        count += 1
+
+    end = fd.tell()
+    fd.seek(start)
+    fd.write(
+        HEADER_STRUCT.pack(
+            SNAPSHOT_MAGIC, station_type.encode("ascii"), key_size, count
+        )
+    )
+    fd.seek(end)
+    return count
+
+
+class StationSnapshot(object):
+    """
+    A memory-mapped snapshot file of one station type.
+
+    Station keys are looked up by a binary search over the sorted
+    records. All web workers on the same machine share the pages of
+    the file in the operating system's page cache.
+    """
+
+    def __init__(self, filename, row_type, decode_key):
+        """
+        :param row_type: The type of the returned station rows.
+        :param decode_key: A function decoding the binary station key
+                           into the key field of the station row.
+        """
+        self.filename = filename
+        self.row_type = row_type
+        self.decode_key = decode_key
+        with open(filename, "rb") as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, station_type, key_size, count = HEADER_STRUCT.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self._mmap.close()
+            raise ValueError("Invalid station snapshot: %s" % filename)
+
+        self.station_type = station_type.rstrip(b"\x00").decode("ascii")
+        self.key_size = key_size
+        self.record_size = key_size + STATION_STRUCT.size
+        self.count = count
+        if len(self._mmap) != HEADER_STRUCT.size + count * self.record_size:
+            self._mmap.close()
+            raise ValueError("Truncated station snapshot: %s" % filename)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mmap.close()
+
+    def get(self, key):
+        """Return the station row for a binary key, or None."""
+        data = self._mmap
+        key_size = self.key_size
+        record_size = self.record_size
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER_STRUCT.size + mid * record_size
+            mid_key = data[offset : offset + key_size]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                value = data[offset + key_size : offset + record_size]
+                return self.row_type(self.decode_key(key), *decode_station(value))
+        return None
+
+
+class SnapshotStationCache(object):
+    """
+    A station cache answering lookups from snapshots. For station types
+    with a snapshot, stations not part of it are treated as unknown, so
+    no database queries are done. Lookups of other station types are
+    passed on to the fallback station cache, if there is one.
+    """
+
+    def __init__(self, snapshots, fallback=None):
+        """
+        :param snapshots: A mapping of station types to
+            :class:`~ichnaea.api.locate.snapshot.StationSnapshot` instances.
+        """
+        self.snapshots = snapshots
+        self.fallback = fallback
+
+    def get_many(self, station_type, keys):
+        snapshot = self.snapshots.get(station_type)
+        if snapshot is None:
+            if self.fallback is None:
+                return ({}, list(keys))
+            return self.fallback.get_many(station_type, keys)
+
+        found = {key: snapshot.get(key) for key in keys}
+        hits = sum(1 for value in found.values() if value is not None)
+        if hits:
+            METRICS.incr(
+                "locate.station_snapshot",
+                value=hits,
+                tags=["type:%s" % station_type, "status:hit"],
+            )
+        if len(found) > hits:
+            METRICS.incr(
+                "locate.station_snapshot",
+                value=len(found) - hits,
+                tags=["type:%s" % station_type, "status:miss"],
+            )
+        return (found, [])
+
+    def set_many(self, station_type, values):
+        if station_type not in self.snapshots and self.fallback is not None:
+            self.fallback.set_many(station_type, values)
+
+
+def configure_station_snapshots(row_types, fallback=None, snapshot_dir=None):
+    """
+    Configure and return a
+    :class:`~ichnaea.api.locate.snapshot.SnapshotStationCache` for all
+    station types with a snapshot file in the snapshot directory. If no
+    snapshot directory is configured, return the fallback station cache.
+
+    :param row_types: A mapping of station types to a two-tuple of
+                      the station row type and a function decoding
+                      the binary station key into the key field.
+    """
+    if snapshot_dir is None:
+        snapshot_dir = settings("station_snapshot_dir")
+    if not snapshot_dir:
+        return fallback
+
+    snapshots = {}
+    for station_type, (row_type, decode_key) in row_types.items():
+        filename = snapshot_filename(snapshot_dir, station_type)
+        if os.path.isfile(filename):
+            snapshots[station_type] = StationSnapshot(filename, row_type, decode_key)
+
+    if not snapshots:
+        return fallback
+    return SnapshotStationCache(snapshots, fallback=fallback)
@@ -0,0 +1,387 @@
+"""
+Caches of station rows, used in front of the database queries done
+by the internal position and region sources.
+
+Each web worker has its own in-process cache, which can be backed by
+a cache shared by all web workers in Redis.
+"""
+
+from calendar import timegm
+from collections import OrderedDict
+from datetime import date, datetime
+import struct
+import sys
+import threading
+import time
+
+import markus
+import pytz
+from redis.exceptions import RedisError
+
+from ichnaea.cache import (
+    redis_pipeline,
+    station_cache_key,
+    STATION_CACHE_INVALIDATED,
+)
+from ichnaea.conf import settings
+
+METRICS = markus.get_metrics()
+
+# Binary encoding of a station row without its key field: lat, lon,
+# radius, region, samples, created, modified, last_seen, block_last
+# and block_count. Missing integers and dates are stored as -1 and
+# missing timestamps as the smallest 64 bit integer.
+STATION_STRUCT = struct.Struct("<ddi2siqqiii")
+MISSING_TIMESTAMP = -(2 ** 63)
+
+# Approximate memory used by the cache bookkeeping for each entry,
+# the OrderedDict link and the (expires, value, size) tuple, in bytes.
+ENTRY_OVERHEAD = 200
+
+
+def configure_station_cache(max_size=None, ttl=None, negative_ttl=None):
+    """
+    Configure and return a :class:`~ichnaea.api.locate.stationcache.StationCache`
+    instance, or None if the cache is disabled by a maximum size of zero.
+    """
+    max_size = settings("station_cache_size") if max_size is None else max_size
+    ttl = settings("station_cache_ttl") if ttl is None else ttl
+    if negative_ttl is None:
+        negative_ttl = settings("station_cache_negative_ttl")
+
+    if max_size <= 0:
+        return None
+    return StationCache(max_size, ttl, negative_ttl)
+
+
+def entry_size(key, value):
+    """Estimate the memory used by a single cache entry, in bytes."""
+    size = ENTRY_OVERHEAD + sys.getsizeof(key[1])
+    if value is not None:
+        size += sys.getsizeof(value)
+        for field in value:
+            size += sys.getsizeof(field)
+    return size
+
+
+class StationCache(object):
+    """
+    A bounded least-recently-used cache of station rows.
+
+    Entries are keyed by station type and the compact binary station
+    key (mac or cellid) and expire after ``ttl`` seconds. Keys of
+    unknown stations are cached as None for ``negative_ttl`` seconds,
+    so repeated lookups of unknown networks don't reach the database.
+    The station updaters don't invalidate entries of this cache, so
+    a changed or blocked station is used until its entry expires.
+
+    The cache is limited by the estimated memory used by its entries,
+    rather than their number, as rows differ in size between station
+    types. All methods only do in-memory work while holding the lock
+    and never yield to another greenlet, so a single instance can be
+    shared by all requests handled by a gevent worker.
+    """
+
+    def __init__(self, max_size, ttl, negative_ttl, _clock=None):
+        """
+        :param max_size: Maximum size of all entries, in bytes.
+        :param ttl: Lifetime of cached station rows, in seconds.
+        :param negative_ttl: Lifetime of cached unknown keys, in seconds.
+        :param _clock: Test-only hook to provide a time function.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = 0
+        self._clock = time.monotonic if _clock is None else _clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def get_many(self, station_type, keys):
+        """
+        Look up the given station keys.
+
+        Returns a two-tuple of a dict mapping the cached keys to their
+        station rows and a list of keys which weren't found in the cache.
+        Keys cached as unknown stations are mapped to None.
+        """
+        found = {}
+        missing = []
+        now = self._clock()
+        with self._lock:
+            for key in keys:
+                cache_key = (station_type, key)
+                entry = self._data.get(cache_key)
+                if entry is None:
+                    missing.append(key)
+                    continue
+
+                expires, value, size = entry
+                if expires <= now:
+                    del self._data[cache_key]
+                    self.size -= size
+                    missing.append(key)
+                    continue
+
+                self._data.move_to_end(cache_key)
+                found[key] = value
+
+        hits = len(keys) - len(missing)
+        if hits:
+            METRICS.incr(
+                "locate.station_cache",
+                value=hits,
+                tags=["type:%s" % station_type, "status:hit"],
+            )
+        if missing:
+            METRICS.incr(
+                "locate.station_cache",
+                value=len(missing),
+                tags=["type:%s" % station_type, "status:miss"],
+            )
+        return (found, missing)
+
+    def set_many(self, station_type, values):
+        """
+        Store station rows in the cache.
+
+        :param values: A mapping of station keys to station rows,
+                       with a value of None for unknown stations.
+        """
+        now = self._clock()
+        with self._lock:
+            for key, value in values.items():
+                cache_key = (station_type, key)
+                old = self._data.pop(cache_key, None)
+                if old is not None:
+                    self.size -= old[2]
+
+                ttl = self.negative_ttl if value is None else self.ttl
+                size = entry_size(cache_key, value)
+                self._data[cache_key] = (now + ttl, value, size)
+                self.size += size
+
+            while self.size > self.max_size and self._data:
+                _, (_, _, size) = self._data.popitem(last=False)
+                self.size -= size
+
+
+def encode_station(row):
+    """Encode a station row without its key field into bytes."""
+    (
+        lat,
+        lon,
+        radius,
+        region,
+        samples,
+        created,
+        modified,
+        last_seen,
+        block_last,
+        block_count,
+    ) = row[1:]
+    return STATION_STRUCT.pack(
+        lat,
+        lon,
+        -1 if radius is None else radius,
+        b"" if region is None else region.encode("ascii"),
+        -1 if samples is None else samples,
+        MISSING_TIMESTAMP if created is None else timegm(created.utctimetuple()),
+        MISSING_TIMESTAMP if modified is None else timegm(modified.utctimetuple()),
+        -1 if last_seen is None else last_seen.toordinal(),
+        -1 if block_last is None else block_last.toordinal(),
+        -1 if block_count is None else block_count,
+    )
+
+
+def decode_station(value):
+    """
+    Decode bytes created by :func:`encode_station` into a tuple of
+    the station row fields following the key field.
+    """
+    (
+        lat,
+        lon,
+        radius,
+        region,
+        samples,
+        created,
+        modified,
+        last_seen,
+        block_last,
+        block_count,
+    ) = STATION_STRUCT.unpack(value)
+    return (
+        lat,
+        lon,
+        None if radius == -1 else radius,
+        region.rstrip(b"\x00").decode("ascii") or None,
+        None if samples == -1 else samples,
+        None
+        if created == MISSING_TIMESTAMP
+        else datetime.fromtimestamp(created, pytz.UTC),
+        None
+        if modified == MISSING_TIMESTAMP
+        else datetime.fromtimestamp(modified, pytz.UTC),
+        None if last_seen == -1 else date.fromordinal(last_seen),
+        None if block_last == -1 else date.fromordinal(block_last),
+        None if block_count == -1 else block_count,
+    )
+
+
+class RedisStationCache(object):
+    """
+    A cache of station rows shared by all web workers, stored in Redis.
+
+    Each station is stored under its own key, using a compact binary
+    encoding, with an empty value for unknown stations. The station
+    updaters in the data pipeline mark all stations they change as
+    invalidated, so the cache can use longer lifetimes than the
+    in-process cache. Rows are only stored for keys which aren't
+    in the cache, so a row read from the database before the change
+    was committed can't replace the mark.
+
+    Redis errors are treated as cache misses, so the database
+    remains the source of truth if Redis isn't available.
+    """
+
+    def __init__(self, redis_client, row_types, ttl, negative_ttl):
+        """
+        :param row_types: A mapping of station types to a two-tuple of
+                          the station row type and a function decoding
+                          the binary station key into the key field.
+        :param ttl: Lifetime of cached station rows, in seconds.
+        :param negative_ttl: Lifetime of cached unknown keys, in seconds.
+        """
+        self.redis_client = redis_client
+        self.row_types = row_types
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def _incr(self, station_type, status, value=1):
+        METRICS.incr(
+            "locate.station_cache.redis",
+            value=value,
+            tags=["type:%s" % station_type, "status:%s" % status],
+        )
+
+    def get_many(self, station_type, keys):
+        """
+        Look up the given station keys.
+
+        Returns a two-tuple of a dict mapping the cached keys to their
+        station rows and a list of keys which weren't found in the cache.
+        Keys cached as unknown stations are mapped to None.
+        """
+        if not keys:
+            return ({}, [])
+
+        try:
+            values = self.redis_client.mget(
+                [station_cache_key(station_type, key) for key in keys]
+            )
+        except RedisError:
+            self._incr(station_type, "failure")
+            return ({}, list(keys))
+
+        row_type, decode_key = self.row_types[station_type]
+        found = {}
+        missing = []
+        for key, value in zip(keys, values):
+            if value is None or value == STATION_CACHE_INVALIDATED:
+                missing.append(key)
+            elif not value:
+                found[key] = None
+            else:
+                found[key] = row_type(decode_key(key), *decode_station(value))
+
+        if found:
+            self._incr(station_type, "hit", len(found))
+        if missing:
+            self._incr(station_type, "miss", len(missing))
+        return (found, missing)
+
+    def set_many(self, station_type, values):
+        """
+        Store station rows in the cache.
+
+        :param values: A mapping of station keys to station rows,
+                       with a value of None for unknown stations.
+        """
+        try:
+            with redis_pipeline(self.redis_client) as pipe:
+                for key, value in values.items():
+                    if value is None:
+                        pipe.set(
+                            station_cache_key(station_type, key),
+                            b"",
+                            ex=self.negative_ttl,
+                            nx=True,
+                        )
+                    else:
+                        pipe.set(
+                            station_cache_key(station_type, key),
+                            encode_station(value),
+                            ex=self.ttl,
+                            nx=True,
+                        )
+        except RedisError:
+            self._incr(station_type, "failure")
+
+
+class TieredStationCache(object):
+    """
+    A cache consulting a first and, for keys missing from it,
+    a second cache. Rows found in the second cache are copied
+    into the first one.
+    """
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def get_many(self, station_type, keys):
+        found, missing = self.first.get_many(station_type, keys)
+        if missing:
+            second_found, missing = self.second.get_many(station_type, missing)
+            if second_found:
+                self.first.set_many(station_type, second_found)
+                found.update(second_found)
+        return (found, missing)
+
+    def set_many(self, station_type, values):
+        self.second.set_many(station_type, values)
+        self.first.set_many(station_type, values)
+
+
+def configure_shared_station_cache(
+    redis_client, row_types, local_cache=None, ttl=None, negative_ttl=None
+):
+    """
+    Configure and return a station cache backed by Redis, combined with
+    the given in-process cache. If the Redis cache is disabled by a
+    lifetime of zero, return the in-process cache instead.
+    """
+    ttl = settings("station_redis_cache_ttl") if ttl is None else ttl
+    if negative_ttl is None:
+        negative_ttl = settings("station_redis_cache_negative_ttl")
+
+    if ttl <= 0 or redis_client is None:
+        return local_cache
+
+    shared_cache = RedisStationCache(redis_client, row_types, ttl, negative_ttl)
+    if local_cache is None:
+        return shared_cache
+    return TieredStationCache(local_cache, shared_cache)
+
+
+# Module global holding the per-process station cache.
+STATION_CACHE = configure_station_cache()
@@ -0,0 +1,218 @@
+from collections import namedtuple
+from datetime import timedelta
+import random
+
+import numpy
+
+from geocalc import destination, distance, distances
+from ichnaea.api.locate.constants import MAX_WIFI_CLUSTER_METERS, WIFI_MIN_ACCURACY
+from ichnaea.api.locate.mac import (
+    aggregate_mac_position,
+    bbox_diameter,
+    cluster_networks,
+    grid_groups,
+    link_networks,
+    meters_per_degree,
+    NETWORK_DTYPE,
+)
+from ichnaea.models import decode_mac
+from ichnaea import util
+
+Lookup = namedtuple("Lookup", "mac age signalStrength")
+Station = namedtuple(
+    "Station", "mac lat lon radius samples created modified last_seen block_last"
+)
+
+
+def make_networks(positions):
+    now = util.utcnow()
+    lookups = []
+    stations = []
+    for i, (lat, lon) in enumerate(positions):
+        mac = (b"\xab\xcd" + i.to_bytes(4, "big"))[:6]
+        lookups.append(Lookup(mac=mac, age=2000, signalStrength=-80))
+        stations.append(
+            Station(
+                mac=decode_mac(mac),
+                lat=lat,
+                lon=lon,
+                radius=10,
+                samples=10,
+                created=now - timedelta(days=30),
+                modified=now,
+                last_seen=None,
+                block_last=None,
+            )
+        )
+    return stations, lookups
+
+
+def reference_clusters(positions, max_distance):
+    lats = numpy.array([pos[0] for pos in positions], dtype=numpy.double)
+    lons = numpy.array([pos[1] for pos in positions], dtype=numpy.double)
+    labels = link_networks(lats, lons, max_distance)
+    clusters = []
+    for label in sorted(set(labels), key=list(labels).index):
+        indices = numpy.flatnonzero(labels == label)
+        if len(indices) >= 2:
+            clusters.append(lats[indices].tolist())
+    return clusters
+
+
+def make_cluster(positions, signals, ages=None, scores=None):
+    networks = numpy.zeros(len(positions), dtype=NETWORK_DTYPE)
+    networks["lat"] = [pos[0] for pos in positions]
+    networks["lon"] = [pos[1] for pos in positions]
+    networks["signalStrength"] = signals
+    networks["age"] = ages if ages is not None else 1000
+    networks["score"] = scores if scores is not None else 1.0
+    return networks
+
+
+def weighted_error(networks, lat, lon):
+    weights = (
+        numpy.minimum(numpy.sqrt(2000.0 / networks["age"]), 1.0)
+        / networks["signalStrength"].astype(numpy.double) ** 2
+    )
+    dists = distances(networks["lat"].copy(), networks["lon"].copy(), lat, lon)
+    return ((dists * weights) ** 2).sum()
+
+
+class TestAggregateMacPosition(object):
+    def test_tiny_cluster(self):
+        networks = make_cluster(
+            [(51.5, -0.1), (51.5, -0.10001)], [-60, -80], scores=[2.0, 1.0]
+        )
+        lat, lon, accuracy = aggregate_mac_position(networks, WIFI_MIN_ACCURACY)
+        # The scores only matter for the initial estimate of the solver.
+        weights = numpy.array([1.0 / 3600, 1.0 / 6400]) ** 2
+        assert round(lat, 7) == 51.5
+        assert round(lon, 7) == round(
+            numpy.average(networks["lon"], weights=weights), 7
+        )
+        assert accuracy == WIFI_MIN_ACCURACY
+
+        # The solver finds the same position.
+        solved = aggregate_mac_position(networks, 0.0)
+        assert round(solved[0], 8) == round(lat, 8)
+        assert round(solved[1], 8) == round(lon, 8)
+
+    def test_two_networks(self):
+        one = (51.5, -0.1)
+        two = destination(51.5, -0.1, 45.0, 300.0)
+        networks = make_cluster([one, two], [-50, -100])
+        lat, lon, accuracy = aggregate_mac_position(networks, WIFI_MIN_ACCURACY)
+        # The squared weights are 16 to 1, so the position is at 1/17
+        # of the way from the stronger to the weaker network.
+        assert round(distance(one[0], one[1], lat, lon), 1) == round(300.0 / 17, 1)
+        assert round(distance(two[0], two[1], lat, lon), 1) == round(4800.0 / 17, 1)
+
+    def test_minimum(self):
+        for _ in range(20):
+            lat = random.uniform(-70.0, 70.0)
+            lon = random.uniform(-170.0, 170.0)
+            positions = [
+                destination(
+                    lat, lon, random.uniform(0.0, 360.0), random.uniform(0, 250)
+                )
+                for _ in range(random.randint(2, 10))
+            ]
+            networks = make_cluster(
+                positions,
+                [random.randint(-100, -30) for _ in positions],
+                ages=[random.randint(1000, 8000) for _ in positions],
+            )
+            lat, lon, accuracy = aggregate_mac_position(networks, 0.0)
+            error = weighted_error(networks, lat, lon)
+            for bearing in (0.0, 90.0, 180.0, 270.0):
+                other = destination(lat, lon, bearing, 0.1)
+                assert weighted_error(networks, *other) >= error
+
+    def test_meters_per_degree(self):
+        lat_scale, lon_scale = meters_per_degree(0.0)
+        assert round(lat_scale, 1) == 110574.3
+        assert round(lon_scale, 1) == 111319.5
+        lat_scale, lon_scale = meters_per_degree(60.0)
+        assert round(lat_scale, 1) == 111412.3
+        assert round(lon_scale, 1) == 55800.0
+
+
+class TestGridGroups(object):
+    def test_split(self):
+        lats = numpy.array([51.5, 51.5001, 51.6, 51.5002], dtype=numpy.double)
+        lons = numpy.array([-0.1, -0.1001, -0.1, -0.1002], dtype=numpy.double)
+        groups = grid_groups(lats, lons, MAX_WIFI_CLUSTER_METERS)
+        assert sorted(group.tolist() for group in groups) == [[0, 1, 3], [2]]
+
+    def test_antimeridian(self):
+        lats = numpy.array([0.0, 0.0, 0.0], dtype=numpy.double)
+        lons = numpy.array([179.9999, -179.9999, 10.0], dtype=numpy.double)
+        groups = grid_groups(lats, lons, MAX_WIFI_CLUSTER_METERS)
+        assert [group.tolist() for group in groups] == [[0, 1, 2]]
+
+    def test_neighbours(self):
+        # Networks in adjacent grid cells always end up in one group.
+        for _ in range(100):
+            lat = random.uniform(-80.0, 80.0)
+            lon = random.uniform(-170.0, 170.0)
+            other = destination(
+                lat, lon, random.uniform(0.0, 360.0), MAX_WIFI_CLUSTER_METERS
+            )
+            lats = numpy.array([lat, other[0]], dtype=numpy.double)
+            lons = numpy.array([lon, other[1]], dtype=numpy.double)
+            groups = grid_groups(lats, lons, MAX_WIFI_CLUSTER_METERS)
+            assert len(groups) == 1
+
+
+class TestBboxDiameter(object):
+    def test_diameter(self):
+        lats = numpy.array([51.5, 51.501, 51.5005], dtype=numpy.double)
+        lons = numpy.array([-0.1, -0.101, -0.1002], dtype=numpy.double)
+        assert 130.0 < bbox_diameter(lats, lons) < 140.0
+
+    def test_antimeridian(self):
+        lats = numpy.array([0.0, 0.0], dtype=numpy.double)
+        lons = numpy.array([179.9999, -179.9999], dtype=numpy.double)
+        assert bbox_diameter(lats, lons) == numpy.inf
+
+
+class TestClusterNetworks(object):
+    def check(self, positions):
+        stations, lookups = make_networks(positions)
+        clusters = cluster_networks(
+            stations,
+            lookups,
+            min_radius=10,
+            min_signal=-100,
+            max_distance=MAX_WIFI_CLUSTER_METERS,
+        )
+        expected = reference_clusters(positions, MAX_WIFI_CLUSTER_METERS)
+        assert [cluster["lat"].tolist() for cluster in clusters] == expected
+
+    def test_tight_group(self):
+        self.check(
+            [
+                (51.5 + random.gauss(0, 0.0005), -0.1 + random.gauss(0, 0.0005))
+                for _ in range(200)
+            ]
+        )
+
+    def test_ambiguous_groups(self):
+        for _ in range(20):
+            positions = [(51.5, -0.1)]
+            for _ in range(10):
+                lat, lon = random.choice(positions)
+                positions.append(
+                    destination(
+                        lat,
+                        lon,
+                        random.uniform(0.0, 360.0),
+                        random.choice([250.0, 499.9, 500.1]),
+                    )
+                )
+            self.check(positions)
+
+    def test_antimeridian(self):
+        self.check(
+            [(0.0, 179.9995), (0.0, 179.9999), (0.0, -179.9999), (0.0, -179.9995)]
+        )
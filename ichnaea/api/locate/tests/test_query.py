@@ -95,6 +95,33 @@ class TestQuery(QueryTest):
         assert query.expected_accuracy is DataAccuracy.low
         assert query.geoip_only is True
 
+    def test_geoip_lazy(self, geoip_db, monkeypatch):
+        calls = []
+
+        def lookup(addr):
+            calls.append(addr)
+            return {"region_code": "GB"}
+
+        monkeypatch.setattr(geoip_db, "lookup", lookup)
+        query = Query(ip=self.london_ip, geoip_db=geoip_db)
+        assert calls == []
+        assert query.geoip == {"region_code": "GB"}
+        assert query.geoip == {"region_code": "GB"}
+        assert query.region == "GB"
+        assert calls == [self.london_ip]
+
+    def test_region_lazy(self, geoip_db, monkeypatch):
+        calls = []
+
+        def lookup(addr):
+            calls.append(addr)
+            return None
+
+        monkeypatch.setattr(geoip_db, "lookup", lookup)
+        query = Query(ip=self.london_ip, geoip_db=geoip_db)
+        assert query.region == "GB"
+        assert calls == []
+
     def test_geoip_malformed(self, geoip_db):
         query = Query(ip="127.0.0.0.0.1", geoip_db=geoip_db)
         assert query.region is None
@@ -353,6 +380,20 @@ class TestQueryStats(QueryTest):
         self._make_query(geoip_db, api_key=api_key, api_type="locate")
         assert len(metricsmock.get_records()) == 0
 
+    def test_no_geoip_lookup(self, geoip_db, metricsmock, monkeypatch):
+        def lookup(addr):
+            raise AssertionError("Unexpected GeoIP lookup.")
+
+        monkeypatch.setattr(geoip_db, "lookup", lookup)
+        wifis = WifiShardFactory.build_batch(2)
+        self._make_query(geoip_db, wifi=wifis, ip=self.london_ip)
+        assert metricsmock.has_record(
+            "incr",
+            "locate.query",
+            value=1,
+            tags=["key:test", "region:GB", "blue:none", "cell:none", "wifi:many"],
+        )
+
     def test_empty(self, geoip_db, metricsmock):
         self._make_query(geoip_db, ip=self.london_ip)
         assert metricsmock.has_record(
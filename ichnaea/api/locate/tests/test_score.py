@@ -1,8 +1,22 @@
+from collections import namedtuple
 from datetime import timedelta
+import random
 
-from ichnaea.api.locate.score import area_score, station_score
+from ichnaea.api.locate.score import (
+    area_array,
+    area_score,
+    area_scores,
+    station_array,
+    station_score,
+    station_scores,
+)
 from ichnaea import util
 
+Area = namedtuple("Area", "lat lon radius num_cells created modified last_seen")
+Station = namedtuple(
+    "Station", "lat lon radius samples created modified last_seen block_last"
+)
+
 
 class Dummy(object):
     def __init__(
@@ -131,3 +145,64 @@ class TestScore(object):
         assert round(area_score(area, now), 2) == 0.2
         area = AreaDummy(created=now, modified=now, radius=0, num_cells=100)
         assert round(area_score(area, now), 2) == 0.1
+
+
+class TestStationScores(object):
+    def random_station(self, now):
+        modified = now - timedelta(days=random.uniform(0, 400))
+        created = modified - timedelta(days=random.uniform(0, 400))
+
+        def random_date():
+            if random.random() < 0.5:
+                return None
+            return (created + timedelta(days=random.uniform(0, 500))).date()
+
+        return Station(
+            lat=random.uniform(-80.0, 80.0),
+            lon=random.uniform(-170.0, 170.0),
+            radius=random.choice([None, 0, 10, 250]),
+            samples=random.choice([1, 2, 3, 64, 1023, 1024, 5000]),
+            created=created,
+            modified=modified,
+            last_seen=random_date(),
+            block_last=random_date(),
+        )
+
+    def test_station_array(self):
+        now = util.utcnow()
+        station = Station(1.0, 2.0, None, 5, now, now, None, now.date())
+        stations = station_array([station])
+        assert stations["lat"][0] == 1.0
+        assert stations["radius"][0] == 0
+        assert stations["modified"][0].item() == now.replace(tzinfo=None)
+        assert stations["block_last"][0].item() == now.date()
+        assert len(station_array([])) == 0
+
+    def test_scores(self):
+        now = util.utcnow()
+        stations = [self.random_station(now) for _ in range(500)]
+        scores = station_scores(station_array(stations), now)
+        assert scores.tolist() == [station_score(station, now) for station in stations]
+
+    def test_area_scores(self):
+        now = util.utcnow()
+        areas = []
+        for _ in range(100):
+            modified = now - timedelta(days=random.uniform(0, 400))
+            created = modified - timedelta(days=random.uniform(0, 400))
+            last_seen = None
+            if random.random() < 0.5:
+                last_seen = (modified + timedelta(days=random.uniform(0, 10))).date()
+            areas.append(
+                Area(
+                    lat=1.0,
+                    lon=2.0,
+                    radius=random.choice([None, 0, 5000]),
+                    num_cells=random.choice([1, 2, 50, 150]),
+                    created=created,
+                    modified=modified,
+                    last_seen=last_seen,
+                )
+            )
+        scores = area_scores(area_array(areas), now)
+        assert scores.tolist() == [area_score(area, now) for area in areas]
@@ -0,0 +1,99 @@
+from ichnaea.api.locate.mac import MAC_STATION_FIELDS
+from ichnaea.api.locate.shardquery import (
+    configure_shard_query,
+    shard_statement,
+    ShardQuery,
+)
+from ichnaea.models import WifiShard
+from ichnaea.tests.factories import WifiShardFactory
+
+
+def make_statements(wifis):
+    shards = {}
+    for wifi in wifis:
+        shards.setdefault(WifiShard.shard_model(wifi.mac), []).append(wifi.mac)
+    return {
+        shard: shard_statement(shard, MAC_STATION_FIELDS, "mac", macs)
+        for shard, macs in shards.items()
+    }
+
+
+class TestShardQuery(object):
+    def test_configure(self):
+        shard_query = configure_shard_query(mode="parallel", concurrency=8)
+        assert shard_query.mode == "parallel"
+        assert shard_query.concurrency == 8
+
+    def test_empty(self, session):
+        assert ShardQuery().execute(session, "wifi", {}) == []
+
+    def test_serial(self, session, metricsmock):
+        wifis = WifiShardFactory.create_batch(20)
+        WifiShardFactory(lat=None, lon=None)
+        session.flush()
+
+        statements = make_statements(wifis)
+        rows = ShardQuery(mode="serial").execute(session, "wifi", statements)
+        assert sorted(row.mac for row in rows) == sorted(wifi.mac for wifi in wifis)
+        assert metricsmock.has_record(
+            "timing", "locate.query.timing", tags=["type:wifi", "mode:serial"]
+        )
+        for shard in statements:
+            assert metricsmock.has_record(
+                "timing",
+                "locate.query.shard.timing",
+                tags=["type:wifi", "shard:%s" % shard.__tablename__],
+            )
+
+    def test_union(self, session, metricsmock):
+        wifis = WifiShardFactory.create_batch(20)
+        session.flush()
+
+        statements = make_statements(wifis)
+        assert len(statements) > 1
+        rows = ShardQuery(mode="union").execute(session, "wifi", statements)
+        assert sorted(row.mac for row in rows) == sorted(wifi.mac for wifi in wifis)
+        assert sorted(rows[0].keys()) == sorted(MAC_STATION_FIELDS)
+        assert metricsmock.has_record(
+            "timing", "locate.query.timing", tags=["type:wifi", "mode:union"]
+        )
+        assert not metricsmock.has_record("timing", "locate.query.shard.timing")
+
+    def test_parallel_connection(self, session, metricsmock):
+        # The test session is bound to a single connection, so the
+        # statements can't be executed concurrently.
+        wifis = WifiShardFactory.create_batch(20)
+        session.flush()
+
+        statements = make_statements(wifis)
+        rows = ShardQuery(mode="parallel", concurrency=4).execute(
+            session, "wifi", statements
+        )
+        assert sorted(row.mac for row in rows) == sorted(wifi.mac for wifi in wifis)
+        assert metricsmock.has_record(
+            "timing", "locate.query.timing", tags=["type:wifi", "mode:serial"]
+        )
+
+    def test_parallel(self, db, metricsmock):
+        # Each statement uses its own connection, outside of the test
+        # transaction, so only unknown stations can be queried.
+        wifis = WifiShardFactory.build_batch(20)
+        statements = make_statements(wifis)
+        session = db.session()
+        try:
+            rows = ShardQuery(mode="parallel", concurrency=4).execute(
+                session, "wifi", statements
+            )
+        finally:
+            db.release_session(session)
+
+        assert rows == []
+        assert metricsmock.has_record(
+            "timing", "locate.query.timing", tags=["type:wifi", "mode:parallel"]
+        )
+        for shard in statements:
+            assert metricsmock.has_record(
+                "timing",
+                "locate.query.shard.timing",
+                tags=["type:wifi", "shard:%s" % shard.__tablename__],
+            )
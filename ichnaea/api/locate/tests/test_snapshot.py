@@ -0,0 +1,125 @@
+import os.path
+
+import pytest
+
+from ichnaea.api.locate.snapshot import (
+    configure_station_snapshots,
+    snapshot_filename,
+    SnapshotStationCache,
+    StationSnapshot,
+    write_snapshot,
+)
+from ichnaea.api.locate.stationcache import StationCache
+from ichnaea.api.locate.tests.test_stationcache import CELL, ROW_TYPES, WIFI
+from ichnaea.models import encode_cellid, encode_mac
+from ichnaea import util
+
+
+def make_wifis(count):
+    return [
+        WIFI._replace(mac="aabbcc%06x" % (i * 3), lat=WIFI.lat + i * 0.001)
+        for i in range(count)
+    ]
+
+
+def write_file(temp_dir, station_type, rows, encode_key):
+    filename = snapshot_filename(temp_dir, station_type)
+    with open(filename, "wb") as fd:
+        write_snapshot(fd, station_type, [(encode_key(row[0]), row) for row in rows])
+    return filename
+
+
+class TestStationSnapshot(object):
+    def test_get(self):
+        wifis = make_wifis(100)
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = write_file(temp_dir, "wifi", wifis, encode_mac)
+            snapshot = StationSnapshot(filename, *ROW_TYPES["wifi"])
+            assert len(snapshot) == 100
+            assert snapshot.station_type == "wifi"
+            for wifi in wifis:
+                assert snapshot.get(encode_mac(wifi.mac)) == wifi
+            for i in (-1, 1, 2, 301):
+                assert snapshot.get(encode_mac("aabbcc%06x" % (i % 2 ** 24))) is None
+            snapshot.close()
+
+    def test_cell(self):
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = write_file(
+                temp_dir, "cell", [CELL], lambda cellid: encode_cellid(*cellid)
+            )
+            snapshot = StationSnapshot(filename, *ROW_TYPES["cell"])
+            assert snapshot.get(encode_cellid(*CELL.cellid)) == CELL
+            snapshot.close()
+
+    def test_empty(self):
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = write_file(temp_dir, "wifi", [], encode_mac)
+            snapshot = StationSnapshot(filename, *ROW_TYPES["wifi"])
+            assert len(snapshot) == 0
+            assert snapshot.get(encode_mac(WIFI.mac)) is None
+            snapshot.close()
+
+    def test_unsorted(self):
+        wifis = make_wifis(2)
+        with util.selfdestruct_tempdir() as temp_dir:
+            with pytest.raises(ValueError):
+                write_file(temp_dir, "wifi", wifis[::-1], encode_mac)
+
+    def test_invalid(self):
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = os.path.join(temp_dir, "wifi.snapshot")
+            with open(filename, "wb") as fd:
+                fd.write(b"\x00" * 100)
+            with pytest.raises(ValueError):
+                StationSnapshot(filename, *ROW_TYPES["wifi"])
+
+            filename = write_file(temp_dir, "wifi", make_wifis(2), encode_mac)
+            with open(filename, "ab") as fd:
+                fd.write(b"\x00")
+            with pytest.raises(ValueError):
+                StationSnapshot(filename, *ROW_TYPES["wifi"])
+
+
+class TestSnapshotStationCache(object):
+    def test_configure(self):
+        fallback = StationCache(2 ** 20, 300, 60)
+        assert configure_station_snapshots(ROW_TYPES, fallback, "") is fallback
+        with util.selfdestruct_tempdir() as temp_dir:
+            assert configure_station_snapshots(ROW_TYPES, fallback, temp_dir) is (
+                fallback
+            )
+            write_file(temp_dir, "wifi", make_wifis(2), encode_mac)
+            cache = configure_station_snapshots(ROW_TYPES, fallback, temp_dir)
+            assert set(cache.snapshots.keys()) == {"wifi"}
+            assert cache.fallback is fallback
+            cache.snapshots["wifi"].close()
+
+    def test_get_many(self, metricsmock):
+        wifis = make_wifis(2)
+        fallback = StationCache(2 ** 20, 300, 60)
+        with util.selfdestruct_tempdir() as temp_dir:
+            write_file(temp_dir, "wifi", wifis, encode_mac)
+            cache = configure_station_snapshots(ROW_TYPES, fallback, temp_dir)
+            keys = [encode_mac(wifi.mac) for wifi in wifis] + [b"\x00" * 6]
+            assert cache.get_many("wifi", keys) == (
+                {keys[0]: wifis[0], keys[1]: wifis[1], keys[2]: None},
+                [],
+            )
+            assert metricsmock.has_record(
+                "incr",
+                "locate.station_snapshot",
+                value=2,
+                tags=["type:wifi", "status:hit"],
+            )
+
+            # Other station types use the fallback cache.
+            cache.set_many("blue", {b"\x00" * 6: None})
+            cache.set_many("wifi", {b"\x00" * 6: WIFI})
+            assert cache.get_many("blue", [b"\x00" * 6]) == ({b"\x00" * 6: None}, [])
+            assert fallback.get_many("wifi", [b"\x00" * 6]) == ({}, [b"\x00" * 6])
+            cache.snapshots["wifi"].close()
+
+    def test_no_fallback(self):
+        cache = SnapshotStationCache({})
+        assert cache.get_many("cell", [b"a"]) == ({}, [b"a"])
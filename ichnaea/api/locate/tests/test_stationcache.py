@@ -0,0 +1,251 @@
+from collections import namedtuple
+from datetime import date, datetime
+
+from pytz import UTC
+from redis.exceptions import RedisError
+
+from ichnaea.api.locate.cell import CellStation
+from ichnaea.api.locate.mac import MacStation
+from ichnaea.api.locate.stationcache import (
+    configure_shared_station_cache,
+    configure_station_cache,
+    decode_station,
+    encode_station,
+    entry_size,
+    RedisStationCache,
+    StationCache,
+    TieredStationCache,
+)
+from ichnaea.cache import station_cache_key, STATION_CACHE_INVALIDATED
+from ichnaea.models import decode_cellid, decode_mac, encode_cellid, encode_mac, Radio
+
+Row = namedtuple("Row", "mac lat lon")
+
+ROW_TYPES = {"cell": (CellStation, decode_cellid), "wifi": (MacStation, decode_mac)}
+
+WIFI = MacStation(
+    mac="aabbccddeeff",
+    lat=51.5,
+    lon=-0.1,
+    radius=120,
+    region="GB",
+    samples=12,
+    created=datetime(2019, 1, 2, 3, 4, 5, tzinfo=UTC),
+    modified=datetime(2020, 2, 3, 4, 5, 6, tzinfo=UTC),
+    last_seen=date(2020, 2, 3),
+    block_last=date(2019, 5, 1),
+    block_count=1,
+)
+
+CELL = CellStation(
+    cellid=(Radio.lte, 234, 10, 1234, 56789),
+    lat=51.5,
+    lon=-0.1,
+    radius=2500,
+    region=None,
+    samples=None,
+    created=None,
+    modified=datetime(2020, 2, 3, 4, 5, 6, tzinfo=UTC),
+    last_seen=None,
+    block_last=None,
+    block_count=None,
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(max_size=2 ** 20, ttl=300, negative_ttl=60):
+    clock = FakeClock()
+    return (StationCache(max_size, ttl, negative_ttl, _clock=clock), clock)
+
+
+class TestStationCache(object):
+    def test_configure(self):
+        assert configure_station_cache(max_size=0) is None
+        cache = configure_station_cache(max_size=1000, ttl=10, negative_ttl=5)
+        assert cache.max_size == 1000
+        assert cache.ttl == 10
+        assert cache.negative_ttl == 5
+
+    def test_get_set(self, metricsmock):
+        cache, clock = make_cache()
+        row = Row(mac="aabbccddeeff", lat=1.0, lon=2.0)
+        assert cache.get_many("wifi", [b"a", b"b"]) == ({}, [b"a", b"b"])
+        assert metricsmock.has_record(
+            "incr", "locate.station_cache", value=2, tags=["type:wifi", "status:miss"]
+        )
+
+        cache.set_many("wifi", {b"a": row, b"b": None})
+        assert len(cache) == 2
+        metricsmock.clear_records()
+        assert cache.get_many("wifi", [b"a", b"b", b"c"]) == (
+            {b"a": row, b"b": None},
+            [b"c"],
+        )
+        assert metricsmock.has_record(
+            "incr", "locate.station_cache", value=2, tags=["type:wifi", "status:hit"]
+        )
+        assert metricsmock.has_record(
+            "incr", "locate.station_cache", value=1, tags=["type:wifi", "status:miss"]
+        )
+
+    def test_station_type(self):
+        cache, clock = make_cache()
+        row = Row(mac="aabbccddeeff", lat=1.0, lon=2.0)
+        cache.set_many("wifi", {b"a": row})
+        assert cache.get_many("blue", [b"a"]) == ({}, [b"a"])
+        assert cache.get_many("wifi", [b"a"]) == ({b"a": row}, [])
+
+    def test_expire(self):
+        cache, clock = make_cache(ttl=300, negative_ttl=60)
+        row = Row(mac="aabbccddeeff", lat=1.0, lon=2.0)
+        cache.set_many("wifi", {b"a": row, b"b": None})
+
+        clock.now += 59
+        assert cache.get_many("wifi", [b"a", b"b"]) == ({b"a": row, b"b": None}, [])
+        clock.now += 1
+        assert cache.get_many("wifi", [b"a", b"b"]) == ({b"a": row}, [b"b"])
+        clock.now += 240
+        assert cache.get_many("wifi", [b"a", b"b"]) == ({}, [b"a", b"b"])
+        assert len(cache) == 0
+        assert cache.size == 0
+
+    def test_size_limit(self):
+        rows = {
+            bytes([i]): Row(mac="aabbccddee%02x" % i, lat=1.0, lon=2.0)
+            for i in range(10)
+        }
+        size = entry_size(("wifi", b"a"), rows[b"\x00"])
+        cache, clock = make_cache(max_size=size * 4)
+
+        cache.set_many("wifi", dict(list(rows.items())[:4]))
+        assert len(cache) == 4
+        assert cache.size == size * 4
+
+        # Using a key marks it as recently used.
+        cache.get_many("wifi", [b"\x00"])
+        cache.set_many("wifi", {b"\x04": rows[b"\x04"]})
+        assert len(cache) == 4
+        assert cache.get_many("wifi", [b"\x00", b"\x01"]) == (
+            {b"\x00": rows[b"\x00"]},
+            [b"\x01"],
+        )
+
+    def test_replace(self):
+        cache, clock = make_cache()
+        row = Row(mac="aabbccddeeff", lat=1.0, lon=2.0)
+        cache.set_many("wifi", {b"a": None})
+        cache.set_many("wifi", {b"a": row})
+        assert len(cache) == 1
+        assert cache.size == entry_size(("wifi", b"a"), row)
+        assert cache.get_many("wifi", [b"a"]) == ({b"a": row}, [])
+
+    def test_clear(self):
+        cache, clock = make_cache()
+        cache.set_many("wifi", {b"a": None})
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.size == 0
+
+
+class TestEncoding(object):
+    def test_roundtrip(self):
+        for row in (WIFI, CELL):
+            value = encode_station(row)
+            assert len(value) == 54
+            assert decode_station(value) == tuple(row[1:])
+
+
+class TestTieredStationCache(object):
+    def test_get_set(self):
+        first, clock = make_cache()
+        second, clock = make_cache()
+        cache = TieredStationCache(first, second)
+        row = Row(mac="aabbccddeeff", lat=1.0, lon=2.0)
+        second.set_many("wifi", {b"a": row, b"b": None})
+        assert cache.get_many("wifi", [b"a", b"b", b"c"]) == (
+            {b"a": row, b"b": None},
+            [b"c"],
+        )
+        assert first.get_many("wifi", [b"a", b"b"]) == ({b"a": row, b"b": None}, [])
+
+        cache.set_many("wifi", {b"c": row})
+        assert first.get_many("wifi", [b"c"]) == ({b"c": row}, [])
+        assert second.get_many("wifi", [b"c"]) == ({b"c": row}, [])
+
+
+class TestRedisStationCache(object):
+    def test_configure(self, redis):
+        local, clock = make_cache()
+        assert configure_shared_station_cache(redis, ROW_TYPES, ttl=0) is None
+        assert (
+            configure_shared_station_cache(redis, ROW_TYPES, local_cache=local, ttl=0)
+            is local
+        )
+        cache = configure_shared_station_cache(
+            redis, ROW_TYPES, local_cache=local, ttl=100, negative_ttl=10
+        )
+        assert cache.first is local
+        assert cache.second.ttl == 100
+        assert cache.second.negative_ttl == 10
+
+    def test_get_set(self, redis, metricsmock):
+        cache = RedisStationCache(redis, ROW_TYPES, 100, 10)
+        wifi_key = encode_mac(WIFI.mac)
+        cell_key = encode_cellid(*CELL.cellid)
+        cache.set_many("wifi", {wifi_key: WIFI, b"\x00" * 6: None})
+        cache.set_many("cell", {cell_key: CELL})
+
+        assert 90 < redis.ttl(station_cache_key("wifi", wifi_key)) <= 100
+        assert redis.ttl(station_cache_key("wifi", b"\x00" * 6)) <= 10
+        assert cache.get_many("wifi", [wifi_key, b"\x00" * 6, b"\x01" * 6]) == (
+            {wifi_key: WIFI, b"\x00" * 6: None},
+            [b"\x01" * 6],
+        )
+        assert cache.get_many("cell", [cell_key]) == ({cell_key: CELL}, [])
+        assert metricsmock.has_record(
+            "incr",
+            "locate.station_cache.redis",
+            value=2,
+            tags=["type:wifi", "status:hit"],
+        )
+        assert metricsmock.has_record(
+            "incr",
+            "locate.station_cache.redis",
+            value=1,
+            tags=["type:wifi", "status:miss"],
+        )
+
+    def test_invalidated(self, redis):
+        cache = RedisStationCache(redis, ROW_TYPES, 100, 10)
+        wifi_key = encode_mac(WIFI.mac)
+        redis.set(station_cache_key("wifi", wifi_key), STATION_CACHE_INVALIDATED)
+        assert cache.get_many("wifi", [wifi_key]) == ({}, [wifi_key])
+
+        # A row read before the station was changed doesn't replace the mark.
+        cache.set_many("wifi", {wifi_key: WIFI})
+        assert cache.get_many("wifi", [wifi_key]) == ({}, [wifi_key])
+
+        redis.delete(station_cache_key("wifi", wifi_key))
+        cache.set_many("wifi", {wifi_key: WIFI})
+        assert cache.get_many("wifi", [wifi_key]) == ({wifi_key: WIFI}, [])
+
+    def test_failure(self, metricsmock):
+        class BrokenRedis(object):
+            def mget(self, keys):
+                raise RedisError()
+
+        cache = RedisStationCache(BrokenRedis(), ROW_TYPES, 100, 10)
+        assert cache.get_many("wifi", [b"a"]) == ({}, [b"a"])
+        assert metricsmock.has_record(
+            "incr",
+            "locate.station_cache.redis",
+            value=1,
+            tags=["type:wifi", "status:failure"],
+        )
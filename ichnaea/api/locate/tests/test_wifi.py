@@ -3,6 +3,7 @@ from datetime import timedelta
 from ichnaea.api.locate.constants import DataSource, MAX_WIFIS_IN_CLUSTER
 from ichnaea.api.locate.score import station_score
 from ichnaea.api.locate.source import PositionSource
+from ichnaea.api.locate.stationcache import StationCache
 from ichnaea.api.locate.tests.base import BaseSourceTest
 from ichnaea.api.locate.wifi import WifiPositionMixin
 from ichnaea.tests.factories import WifiShardFactory
@@ -279,6 +280,46 @@ class TestWifi(BaseSourceTest):
 
         results = source.search(query)
         result = results.best()
-        assert round(result.lat, 7) == wifi1.lat + 0.0000009
-        assert round(result.lon, 7) == wifi1.lon + 0.0000006
-        assert round(result.accuracy, 2) == 39.51
+        assert round(result.lat, 7) == wifi1.lat + 0.0000001
+        assert round(result.lon, 7) == wifi1.lon + 0.0000002
+        assert round(result.accuracy, 2) == 39.6
+
+    def test_station_cache(
+        self, geoip_db, http_session, session, source, metricsmock, monkeypatch
+    ):
+        monkeypatch.setattr(source, "station_cache", StationCache(2 ** 20, 300, 60))
+        wifi = WifiShardFactory(radius=5, samples=50)
+        wifi2 = WifiShardFactory(
+            lat=wifi.lat, lon=wifi.lon + 0.00001, radius=5, samples=100
+        )
+        wifi3 = WifiShardFactory.build()
+        session.flush()
+
+        query = self.model_query(
+            geoip_db, http_session, session, wifis=[wifi, wifi2, wifi3]
+        )
+        best = source.search(query).best()
+        assert round(best.lat, 7) == round(wifi.lat, 7)
+        assert len(source.station_cache) == 3
+        assert metricsmock.has_record(
+            "incr", "locate.station_cache", value=3, tags=["type:wifi", "status:miss"]
+        )
+
+        # Later queries are answered from the cache, including the
+        # unknown network.
+        session.delete(wifi)
+        session.delete(wifi2)
+        session.flush()
+        metricsmock.clear_records()
+        result = source.search(query).best()
+        assert (result.lat, result.lon, result.accuracy) == (
+            best.lat,
+            best.lon,
+            best.accuracy,
+        )
+        assert metricsmock.has_record(
+            "incr", "locate.station_cache", value=3, tags=["type:wifi", "status:hit"]
+        )
+        assert not metricsmock.has_record(
+            "incr", "locate.station_cache", tags=["type:wifi", "status:miss"]
+        )
@@ -19,7 +19,9 @@ from ichnaea.api.locate.result import (
     Region,
     RegionResultList,
 )
-from ichnaea.api.locate.score import station_score
+from ichnaea.api.locate.score import station_array, station_scores
+from ichnaea.api.locate.shardquery import SHARD_QUERY
+from ichnaea.api.locate.stationcache import STATION_CACHE
 from ichnaea.geocode import GEOCODER
 from ichnaea.models import WifiShard
 from ichnaea.models.constants import MIN_WIFI_SIGNAL
@@ -33,6 +35,8 @@ class WifiPositionMixin(object):
     """
 
     raven_client = None
+    station_cache = STATION_CACHE
+    shard_query = SHARD_QUERY
     result_list = PositionResultList
     result_type = Position
 
@@ -42,7 +46,14 @@ class WifiPositionMixin(object):
     def search_wifi(self, query):
         results = self.result_list()
 
-        wifis = query_macs(query, query.wifi, self.raven_client, WifiShard)
+        wifis = query_macs(
+            query,
+            query.wifi,
+            self.raven_client,
+            WifiShard,
+            self.station_cache,
+            self.shard_query,
+        )
         for cluster in cluster_networks(
             wifis,
             query.wifi,
@@ -69,6 +80,8 @@ class WifiRegionMixin(object):
     """
 
     raven_client = None
+    station_cache = STATION_CACHE
+    shard_query = SHARD_QUERY
     result_list = RegionResultList
     result_type = Region
 
@@ -80,9 +93,17 @@ class WifiRegionMixin(object):
 
         now = util.utcnow()
         regions = defaultdict(int)
-        wifis = query_macs(query, query.wifi, self.raven_client, WifiShard)
-        for wifi in wifis:
-            regions[wifi.region] += station_score(wifi, now)
+        wifis = query_macs(
+            query,
+            query.wifi,
+            self.raven_client,
+            WifiShard,
+            self.station_cache,
+            self.shard_query,
+        )
+        scores = station_scores(station_array(wifis), now)
+        for wifi, score in zip(wifis, scores.tolist()):
+            regions[wifi.region] += score
 
         for code, score in regions.items():
             region = GEOCODER.region_for_code(code)
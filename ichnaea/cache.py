@@ -11,6 +11,30 @@ from redis.exceptions import RedisError
 from ichnaea.conf import settings
 
 
+# Prefix for the keys of the shared station cache, followed by the
+# station type and the compact binary station key. The last part can
+# be incremented whenever the encoding of the cached rows changes.
+STATION_CACHE_PREFIX = b"cache:station:1:"
+
+# Value of stations in the shared station cache, which were changed by
+# the data pipeline. It's a cache miss, but other than a deleted key it
+# keeps locate requests, which read the station from the database before
+# the change was committed, from putting the old row back into the cache.
+# The TTL is longer than a request takes between its query and that write.
+STATION_CACHE_INVALIDATED = b"-"
+STATION_CACHE_INVALIDATED_TTL = 60
+
+
+def station_cache_key(station_type, key):
+    """
+    Return the Redis key of a station in the shared station cache.
+
+    :param station_type: One of blue, cell or wifi.
+    :param key: The compact binary mac or cellid of the station.
+    """
+    return STATION_CACHE_PREFIX + station_type.encode("ascii") + b":" + key
+
+
 def configure_redis(cache_url=None, _client=None):
     """
     Configure and return a :class:`~ichnaea.cache.RedisClient` instance.
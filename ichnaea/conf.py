@@ -20,6 +20,22 @@ def logging_level_parser(value):
     return value
 
 
+def station_query_mode_parser(value):
+    """Validates station query modes."""
+    valid_modes = ("serial", "union", "parallel")
+    if value not in valid_modes:
+        raise ValueError("%s is not a value in %r" % (value, valid_modes))
+    return value
+
+
+def queue_backend_parser(value):
+    """Validates data queue backends."""
+    valid_backends = ("list", "stream")
+    if value not in valid_backends:
+        raise ValueError("%s is not a value in %r" % (value, valid_backends))
+    return value
+
+
 class AppConfig(RequiredConfigMixin):
     required_config = ConfigOptions()
     required_config.add_option(
@@ -91,6 +107,27 @@ class AppConfig(RequiredConfigMixin):
         "redis_uri", doc="uri for Redis; ``redis://HOST:PORT/DB``"
     )
 
+    required_config.add_option(
+        "queue_backend",
+        default="list",
+        parser=queue_backend_parser,
+        doc=(
+            "how the data queues are stored in Redis; ``list`` uses Redis lists "
+            "and ``stream`` uses Redis streams with consumer groups, which "
+            "requires Redis 5.0 or later"
+        ),
+    )
+    required_config.add_option(
+        "queue_stream_maxlen",
+        default="1000000",
+        parser=int,
+        doc=(
+            "approximate maximum number of items in each data queue with the "
+            "``stream`` backend, beyond which the oldest items are dropped; "
+            "0 for no limit"
+        ),
+    )
+
     required_config.add_option(
         "celery_worker_concurrency",
         parser=int,
@@ -112,6 +149,120 @@ class AppConfig(RequiredConfigMixin):
         doc="absolute path to mmdb file for GeoIP lookups",
     )
 
+    required_config.add_option(
+        "geoip_cache_size",
+        default="10000",
+        parser=int,
+        doc=(
+            "maximum number of GeoIP lookup results each worker caches; "
+            "0 to disable the cache"
+        ),
+    )
+    required_config.add_option(
+        "geoip_cache_ttl",
+        default="3600",
+        parser=int,
+        doc="seconds a cached GeoIP lookup result is used",
+    )
+    required_config.add_option(
+        "geoip_reload_interval",
+        default="300",
+        parser=int,
+        doc=(
+            "seconds between checks for a new version of the GeoIP mmdb file, "
+            "which is then used without restarting the workers; 0 to disable"
+        ),
+    )
+
+    required_config.add_option(
+        "station_cache_size",
+        default="33554432",
+        parser=int,
+        doc=(
+            "maximum memory in bytes used by each web worker to cache station "
+            "rows for locate queries; 0 to disable the cache"
+        ),
+    )
+    required_config.add_option(
+        "station_cache_ttl",
+        default="60",
+        parser=int,
+        doc=(
+            "seconds a cached station row is used before reading it again; "
+            "the station updaters only invalidate the shared station cache, "
+            "so a changed or blocked station can be served from this cache "
+            "for up to this long"
+        ),
+    )
+    required_config.add_option(
+        "station_cache_negative_ttl",
+        default="60",
+        parser=int,
+        doc="seconds an unknown station is remembered as unknown",
+    )
+
+    required_config.add_option(
+        "station_redis_cache_ttl",
+        default="3600",
+        parser=int,
+        doc=(
+            "seconds a station row is kept in the station cache shared by all "
+            "web workers in Redis; 0 to disable the shared cache"
+        ),
+    )
+    required_config.add_option(
+        "station_redis_cache_negative_ttl",
+        default="600",
+        parser=int,
+        doc="seconds an unknown station is kept in the shared station cache",
+    )
+
+    required_config.add_option(
+        "station_snapshot_dir",
+        default="",
+        doc=(
+            "absolute path to a directory with station snapshot files created "
+            "by ``location_dump --format=snapshot``, named blue.snapshot, "
+            "cell.snapshot and wifi.snapshot; locate queries for station types "
+            "with a snapshot file are answered from it instead of the database"
+        ),
+    )
+
+    required_config.add_option(
+        "station_query_mode",
+        default="serial",
+        parser=station_query_mode_parser,
+        doc=(
+            "how locate queries read stations spread over several shard tables; "
+            "``serial`` runs one query per shard after another, ``union`` combines "
+            "them into one UNION ALL statement and ``parallel`` runs them "
+            "concurrently on separate pooled database connections"
+        ),
+    )
+
+    required_config.add_option(
+        "station_query_concurrency",
+        default="4",
+        parser=int,
+        doc="maximum number of concurrent shard queries in the ``parallel`` mode",
+    )
+
+    required_config.add_option(
+        "geocoder_cache_size",
+        default="20000",
+        parser=int,
+        doc=(
+            "maximum number of small cells near region borders, for which "
+            "each worker caches the region; 0 to disable the cache"
+        ),
+    )
+    required_config.add_option(
+        "geocoder_cache_precision",
+        default="3",
+        parser=int,
+        doc="number of decimal digits of the size of the cells in the region cache",
+    )
+
     def __init__(self, config):
         self.raw_config = config
         self.config = config.with_options(self)
@@ -11,3 +11,7 @@ def _cell_export_enabled():
 
 def _map_content_enabled():
     return bool(settings("mapbox_token"))
+
+
+def _station_cache_enabled():
+    return settings("station_redis_cache_ttl") > 0
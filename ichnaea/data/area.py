@@ -22,9 +22,9 @@ class CellAreaUpdater(object):
         self.utcnow = util.utcnow()
 
     def __call__(self):
-        areaids = self.queue.dequeue()
+        areaids, size, age = self.queue.dequeue_status()
         self.update_areas(areaids)
-        if self.queue.ready():
+        if self.queue.is_ready(size, age):
             self.task.apply_countdown()
 
     @retry_on_mysql_lock_fail(
@@ -42,41 +42,65 @@ class CellAreaUpdater(object):
             ).fetchall()
             existing_areas = set(row[0] for row in rows)
 
-            # Update each cellarea row from cell tables
+            # Derive each cellarea row from cell tables
+            areas = {}
             for areaid in areaid_set:
+                areas[areaid] = self.area_values(session, areaid)
+
+            # Break region ties for all areas at once
+            self.resolve_regions([values for values in areas.values() if values])
+
+            for areaid, values in areas.items():
                 area_is_new = decode_cellarea(areaid) not in existing_areas
-                self.update_area(session, areaid, area_is_new)
+                self.update_area(session, areaid, area_is_new, values)
 
-    def region(self, ctr_lat, ctr_lon, mcc, cells):
-        region = None
+    def region(self, cells):
+        """
+        Return the area region based on the majority of cells inside
+        each region, and whether there was a tie between regions.
+        """
         regions = [cell.region for cell in cells]
         unique_regions = set(regions)
         if len(unique_regions) == 1:
-            region = regions[0]
-        else:
-            # Choose the area region based on the majority of cells
-            # inside each region.
-            grouped_regions = defaultdict(int)
-            for reg in regions:
-                grouped_regions[reg] += 1
-            max_count = max(grouped_regions.values())
-            max_regions = sorted(
-                [k for k, v in grouped_regions.items() if v == max_count],
-                # Emulate Python 2.6, where None is sortable and first
-                key=lambda item: item or "",
-            )
-            # If we get a tie here, randomly choose the first.
-            region = max_regions[0]
-            if len(max_regions) > 1:
-                # Try to break the tie based on the center of the area,
-                # but keep the randomly chosen region if this fails.
-                area_region = GEOCODER.region_for_cell(ctr_lat, ctr_lon, mcc)
-                if area_region is not None:
-                    region = area_region
-
-        return region
-
-    def update_area(self, session, areaid, area_is_new):
+            return (regions[0], False)
+
+        # Choose the area region based on the majority of cells
+        # inside each region.
+        grouped_regions = defaultdict(int)
+        for reg in regions:
+            grouped_regions[reg] += 1
+        max_count = max(grouped_regions.values())
+        max_regions = sorted(
+            [k for k, v in grouped_regions.items() if v == max_count],
+            # Emulate Python 2.6, where None is sortable and first
+            key=lambda item: item or "",
+        )
+        # If we get a tie here, randomly choose the first.
+        return (max_regions[0], len(max_regions) > 1)
+
+    def resolve_regions(self, areas):
+        """
+        Try to break region ties based on the center of each area,
+        but keep the randomly chosen region if this fails.
+        """
+        tied = [values for values in areas if values["tied"]]
+        if not tied:
+            return
+
+        regions = GEOCODER.regions_for_cells(
+            [values["lat"] for values in tied],
+            [values["lon"] for values in tied],
+            [values["mcc"] for values in tied],
+        )
+        for values, area_region in zip(tied, regions):
+            if area_region is not None:
+                values["region"] = area_region
+
+    def area_values(self, session, areaid):
+        """
+        Return the values of the area derived from all cells in it,
+        or None if there are no cells.
+        """
         # Select all cells in this area and derive a bounding box for them
         radio, mcc, mnc, lac = decode_cellarea(areaid)
         load_fields = (
@@ -106,13 +130,8 @@ class CellAreaUpdater(object):
         ).fetchall()
 
         if len(cells) == 0:
-            # If there are no more underlying cells, delete the area entry
-            session.execute(
-                delete(self.area_table).where(self.area_table.c.areaid == areaid)
-            )
-            return
+            return None
 
-        # Otherwise update the area entry based on all the cells
         cell_extremes = numpy.array(
             [
                 (
@@ -148,7 +167,7 @@ class CellAreaUpdater(object):
         )
         avg_cell_radius = int(round(numpy.nanmean(cell_radii)))
         num_cells = len(cells)
-        region = self.region(ctr_lat, ctr_lon, mcc, cells)
+        region, tied = self.region(cells)
 
         last_seen = None
         cell_last_seen = set(
@@ -157,6 +176,28 @@ class CellAreaUpdater(object):
         if cell_last_seen:
             last_seen = max(cell_last_seen)
 
+        return {
+            "lat": ctr_lat,
+            "lon": ctr_lon,
+            "mcc": mcc,
+            "radius": radius,
+            "region": region,
+            "tied": tied,
+            "avg_cell_radius": avg_cell_radius,
+            "num_cells": num_cells,
+            "last_seen": last_seen,
+        }
+
+    def update_area(self, session, areaid, area_is_new, values):
+        if values is None:
+            # If there are no more underlying cells, delete the area entry
+            session.execute(
+                delete(self.area_table).where(self.area_table.c.areaid == areaid)
+            )
+            return
+
+        # Otherwise update the area entry based on all the cells
+        radio, mcc, mnc, lac = decode_cellarea(areaid)
         if area_is_new:
             session.execute(
                 self.area_table.insert().values(
@@ -167,13 +208,13 @@ class CellAreaUpdater(object):
                     lac=lac,
                     created=self.utcnow,
                     modified=self.utcnow,
-                    lat=ctr_lat,
-                    lon=ctr_lon,
-                    radius=radius,
-                    region=region,
-                    avg_cell_radius=avg_cell_radius,
-                    num_cells=num_cells,
-                    last_seen=last_seen,
+                    lat=values["lat"],
+                    lon=values["lon"],
+                    radius=values["radius"],
+                    region=values["region"],
+                    avg_cell_radius=values["avg_cell_radius"],
+                    num_cells=values["num_cells"],
+                    last_seen=values["last_seen"],
                 )
                 # If there was an unexpected insert, log warning instead of error
                 .prefix_with("IGNORE", dialect="mysql")
@@ -184,12 +225,12 @@ class CellAreaUpdater(object):
                 .where(self.area_table.c.areaid == areaid)
                 .values(
                     modified=self.utcnow,
-                    lat=ctr_lat,
-                    lon=ctr_lon,
-                    radius=radius,
-                    region=region,
-                    avg_cell_radius=avg_cell_radius,
-                    num_cells=num_cells,
-                    last_seen=last_seen,
+                    lat=values["lat"],
+                    lon=values["lon"],
+                    radius=values["radius"],
+                    region=values["region"],
+                    avg_cell_radius=values["avg_cell_radius"],
+                    num_cells=values["num_cells"],
+                    last_seen=values["last_seen"],
                 )
             )
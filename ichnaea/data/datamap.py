@@ -82,14 +82,14 @@ class DataMapUpdater(object):
 
     def __call__(self):
         queue = self.task.app.data_queues["update_datamap_" + self.shard_id]
-        grids = queue.dequeue()
+        grids, size, age = queue.dequeue_status()
         grids = list(set(grids))
         if not grids or not self.shard:
             return 0
 
         self._update_shards(grids)
 
-        if queue.ready():
+        if queue.is_ready(size, age):
             self.task.apply_countdown(kwargs={"shard_id": self.shard_id})
 
         return len(grids)
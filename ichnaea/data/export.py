@@ -32,6 +32,7 @@ from ichnaea.models import (
     WifiShard,
 )
 from ichnaea.models.content import encode_datamap_grid
+from ichnaea.queue import ready_many
 from ichnaea import util
 
 
@@ -58,7 +59,7 @@ class IncomingQueue(object):
     def __call__(self, export_task):
         redis_client = self.task.redis_client
         data_queue = self.task.app.data_queues["update_incoming"]
-        data = data_queue.dequeue()
+        data, size, age = data_queue.dequeue_status()
 
         grouped = defaultdict(list)
         for item in data:
@@ -77,15 +78,19 @@ class IncomingQueue(object):
                         queue = config.queue(queue_key, redis_client)
                         queue.enqueue(items, pipe=pipe)
 
-        for config in export_configs:
-            # Check all queues if they now contain enough data or
-            # old enough data to be ready for processing.
-            for queue_key in config.partitions(redis_client):
-                queue = config.queue(queue_key, redis_client)
-                if queue.ready():
-                    export_task.delay(config.name, queue_key)
-
-        if data_queue.ready():
+        # Check all queues if they now contain enough data or
+        # old enough data to be ready for processing.
+        queues = [
+            (config, config.queue(queue_key, redis_client))
+            for config in export_configs
+            for queue_key in config.partitions(redis_client)
+        ]
+        ready = ready_many(redis_client, [queue for _, queue in queues])
+        for (config, queue), queue_ready in zip(queues, ready):
+            if queue_ready:
+                export_task.delay(config.name, queue.key)
+
+        if data_queue.is_ready(size, age):
             self.task.apply_countdown()
 
 
@@ -118,7 +123,7 @@ class ReportExporter(object):
             exporter_type(task, config, queue_key)()
 
     def __call__(self):
-        queue_items = self.queue.dequeue()
+        queue_items, size, age = self.queue.dequeue_status()
         if not queue_items:
             return
 
@@ -137,7 +142,7 @@ class ReportExporter(object):
                 METRICS.incr("data.export.batch", tags=self.stats_tags)
                 break
 
-        if success and self.queue.ready():
+        if success and self.queue.is_ready(size, age):
             self.task.apply_countdown(args=[self.config.name, self.queue_key])
 
     def send(self, queue_items):
@@ -425,11 +430,15 @@ class InternalExporter(ReportExporter):
                 # group by sharded queue
                 shard_id = shard_model.shard_id(getattr(obs, shard_key))
                 queue_id = queue_prefix + shard_id
-                queued_obs[queue_id].append(obs.to_json())
+                queued_obs[queue_id].append(obs)
 
             for queue_id, values in queued_obs.items():
-                # enqueue values for each queue
+                # enqueue values for each queue, in the queue's encoding
                 queue = self.task.app.data_queues[queue_id]
+                if queue.json:
+                    values = [obs.to_json() for obs in values]
+                else:
+                    values = [obs.to_binary() for obs in values]
                 queue.enqueue(values, pipe=pipe)
 
     def emit_metrics(self, api_keys_known, metrics):
@@ -66,7 +66,8 @@ class QueueSize:
     """Generate gauge metrics for all queue sizes.
 
     This covers the export queues, the celery task queues, and the
-    data queues.
+    data queues. It also counts the items dropped by trimming the data
+    queues.
 
     """
 
@@ -76,6 +77,39 @@ class QueueSize:
     def __call__(self):
         keys = self.task.redis_client.scan_iter(match="export_queue_*", count=100)
         export_queues = set([key.decode("utf-8") for key in keys])
+        data_queues = {queue.key: queue for queue in self.task.app.data_queues.values()}
         for name in export_queues | self.task.app.all_queues:
-            value = self.task.redis_client.llen(name)
+            if name in data_queues:
+                # framed data queues hold several items per list element
+                value = data_queues[name].size()
+            else:
+                value = self.task.redis_client.llen(name)
             METRICS.gauge("queue", value, tags=["queue:" + name])
+
+        for queue in data_queues.values():
+            trimmed = queue.trimmed()
+            if trimmed:
+                METRICS.incr("data.queue.trim", trimmed, tags=["queue:" + queue.key])
+
+
+class QueueSweeper:
+    """
+    Requeue the expired in-flight batches of all reliable data queues,
+    and dead-letter the items which failed too often.
+    """
+
+    def __init__(self, task):
+        self.task = task
+
+    def __call__(self):
+        for queue in self.task.app.data_queues.values():
+            if queue.reliable:
+                count, dead = queue.requeue_expired()
+                if count:
+                    METRICS.incr(
+                        "data.queue.requeue", count, tags=["queue:" + queue.key]
+                    )
+                if dead:
+                    METRICS.incr(
+                        "data.queue.deadletter", dead, tags=["queue:" + queue.key]
+                    )
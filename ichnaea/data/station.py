@@ -1,15 +1,23 @@
 from collections import defaultdict
 from datetime import timedelta
+import json
 
 import markus
 import numpy
 
 from geocalc import circle_radius, distance
+from ichnaea.cache import (
+    station_cache_key,
+    STATION_CACHE_INVALIDATED,
+    STATION_CACHE_INVALIDATED_TTL,
+)
+from ichnaea.data import _station_cache_enabled
 from ichnaea.db import retry_on_mysql_lock_fail
 from ichnaea.geocode import GEOCODER
 from ichnaea.models import (
     decode_cellid,
     encode_cellarea,
+    encode_mac,
     BlueObservation,
     CellObservation,
     WifiObservation,
@@ -268,7 +276,9 @@ class StationState(object):
         lat = float(lat)
         lon = float(lon)
         radius = circle_radius(lat, lon, max_lat, max_lon, min_lat, min_lon)
-        region = GEOCODER.region(lat, lon)
+        # The region is looked up for all stations at once, in
+        # StationUpdater.resolve_regions.
+        region = None
 
         samples, weight = self.bounded_samples_weight(
             len(self.observations), float(weights.sum())
@@ -323,12 +333,9 @@ class StationState(object):
         ) / (obs_data["weight"] + old_weight)
 
         radius = circle_radius(lat, lon, max_lat, max_lon, min_lat, min_lon)
+        # Keep the current region as a hint, it's checked against the
+        # new position in StationUpdater.resolve_regions.
         region = station.region
-        if region and not GEOCODER.in_region(lat, lon, region):
-            # reset region if it no longer matches
-            region = None
-        if not region:
-            region = GEOCODER.region(lat, lon)
 
         samples, weight = self.bounded_samples_weight(
             (station.samples or 0) + obs_data["samples"],
@@ -422,6 +429,17 @@ class StationUpdater(object):
     def queue_area_updates(self, pipe, updated_areas):
         pass
 
+    def cache_key(self, station_key):
+        return station_key
+
+    def invalidate_stations(self, pipe, updated_stations):
+        for station_key in updated_stations:
+            pipe.set(
+                station_cache_key(self.station_type, self.cache_key(station_key)),
+                STATION_CACHE_INVALIDATED,
+                ex=STATION_CACHE_INVALIDATED_TTL,
+            )
+
     def stat_count(self, type_, action, count):
         if count > 0:
             METRICS.incr(
@@ -452,8 +470,28 @@ class StationUpdater(object):
 
         return (blocklist, stations)
 
+    def resolve_regions(self, values):
+        """
+        Set the region of all new or changed stations, keeping the
+        current region if the station position is still inside it.
+        """
+        if not values:
+            return
+
+        lats = [value["lat"] for value in values]
+        lons = [value["lon"] for value in values]
+        inside = GEOCODER.in_regions(lats, lons, [value["region"] for value in values])
+        missing = numpy.flatnonzero(~inside)
+        if len(missing):
+            regions = GEOCODER.regions(
+                [lats[i] for i in missing], [lons[i] for i in missing]
+            )
+            for i, region in zip(missing, regions):
+                values[i]["region"] = region
+
     def update_shard(self, session, shard, shard_values, stats_counter):
         updated_areas = set()
+        updated_stations = set()
         new_data = defaultdict(list)
         blocklist, stations = self.query_stations(session, shard, shard_values)
 
@@ -501,9 +539,12 @@ class StationUpdater(object):
             if status in ("block", "new_block"):
                 stats_counter["block"] += 1
 
-            # track potential updates to dependent areas
+            # track potential updates to dependent areas and cached stations
             if status != "confirm":
                 self.add_area_update(updated_areas, station_key)
+                updated_stations.add(station_key)
+
+        self.resolve_regions(new_data["new"] + new_data["change"] + new_data["replace"])
 
         if new_data["new"]:
             session.execute(
@@ -526,12 +567,21 @@ class StationUpdater(object):
         if new_data["confirm"]:
             session.bulk_update_mappings(shard, new_data["confirm"])
 
-        return updated_areas
+        return (updated_areas, updated_stations)
+
+    def decode_observation(self, value):
+        if isinstance(value, dict):
+            return self.obs_model.from_json(value)
+        if value[:1] == b"{":
+            # JSON encoded observation, queued before the queue
+            # was switched to the binary encoding.
+            return self.obs_model.from_json(json.loads(value.decode("utf-8")))
+        return self.obs_model.from_binary(value)
 
     def shard_observations(self, observations):
         sharded_obs = {}
         for obs in observations:
-            obs = self.obs_model.from_json(obs)
+            obs = self.decode_observation(obs)
             if obs is not None:
                 if not obs.weight:
                     # Filter out observations with too little weight.
@@ -543,36 +593,51 @@ class StationUpdater(object):
         return sharded_obs
 
     def __call__(self):
-        sharded_obs = self.shard_observations(self.data_queue.dequeue())
-        if not sharded_obs:
-            return
-
-        retry_wrapper = retry_on_mysql_lock_fail(
-            metric="data.station.dberror", metric_tags=[f"type:{self.station_type}"]
-        )(self.update_observations)
-        updated_areas, stats = retry_wrapper(sharded_obs)
-
-        with self.task.redis_pipeline() as pipe:
-            if updated_areas:
-                self.queue_area_updates(pipe, updated_areas)
-            self.emit_stats(pipe, stats)
-
-        if self.data_queue.ready():
+        # The observations are acknowledged once the station updates are
+        # committed and the area updates are queued and the cached
+        # stations invalidated, so a reliable queue requeues them if the
+        # worker dies or any of these fail. If the worker dies after the
+        # commit but before the acknowledgement, the requeued observations
+        # are applied to the stations a second time.
+        with self.data_queue.consume() as (observations, size, age):
+            sharded_obs = self.shard_observations(observations)
+            if not sharded_obs:
+                return
+
+            retry_wrapper = retry_on_mysql_lock_fail(
+                metric="data.station.dberror",
+                metric_tags=[f"type:{self.station_type}"],
+            )(self.update_observations)
+            updated_areas, updated_stations, stats = retry_wrapper(sharded_obs)
+
+            with self.task.redis_pipeline() as pipe:
+                if updated_areas:
+                    self.queue_area_updates(pipe, updated_areas)
+                if updated_stations and _station_cache_enabled():
+                    self.invalidate_stations(pipe, updated_stations)
+                self.emit_stats(pipe, stats)
+
+        if self.data_queue.is_ready(size, age):
             self.task.apply_countdown(kwargs={"shard_id": self.shard_id})
 
     def update_observations(self, sharded_observations):
         """Update the station data based on per-shard observations."""
         stats = defaultdict(int)
         updated_areas = set()
+        updated_stations = set()
 
         with self.task.db_session() as session:
             for shard, shard_values in sharded_observations.items():
-                areas = self.update_shard(session, shard, shard_values, stats)
+                areas, stations = self.update_shard(session, shard, shard_values, stats)
                 updated_areas.update(areas)
-        return updated_areas, stats
+                updated_stations.update(stations)
+        return updated_areas, updated_stations, stats
 
 
 class MacUpdater(StationUpdater):
+    def cache_key(self, station_key):
+        return encode_mac(station_key)
+
     def query_shard(self, session, shard, keys):
         return (
             (session.query(shard).filter(shard.mac.in_(keys))).with_for_update().all()
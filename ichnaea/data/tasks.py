@@ -82,6 +82,17 @@ def monitor_queue_size(self):
     monitor.QueueSize(self)()
 
 
+@celery_app.task(
+    base=BaseTask,
+    bind=True,
+    queue="celery_monitor",
+    expires=270,
+    _schedule=timedelta(seconds=300),
+)
+def sweep_queues(self):
+    monitor.QueueSweeper(self)()
+
+
 @celery_app.task(base=BaseTask, bind=True, queue="celery_monitor")
 def sentry_test(self, msg):
     self.app.raven_client.captureMessage(msg)
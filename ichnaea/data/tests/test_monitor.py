@@ -1,12 +1,16 @@
 from datetime import timedelta
 import random
 
+import pytest
+
 from ichnaea.data.tasks import (
     monitor_api_key_limits,
     monitor_api_users,
     monitor_queue_size,
     sentry_test,
+    sweep_queues,
 )
+from ichnaea.queue import StreamQueue
 from ichnaea import util
 
 
@@ -179,6 +183,65 @@ class TestMonitorQueueSize:
                 "gauge", "queue", value=val, tags=["queue:" + key]
             )
 
+    def test_trimmed(self, celery, redis, metricsmock, monkeypatch):
+        queue = StreamQueue("update_stream", redis, json=False, maxlen=100)
+        monkeypatch.setitem(celery.data_queues, "update_stream", queue)
+        queue.enqueue([b"%d" % i for i in range(1000)])
+        trimmed = 1000 - redis.xlen(queue.key)
+        assert trimmed > 0
+
+        monitor_queue_size.delay().get()
+        assert metricsmock.has_record(
+            "incr", "data.queue.trim", value=trimmed, tags=["queue:update_stream"]
+        )
+        assert queue.trimmed() == 0
+
+
+class TestQueueSweeper:
+    def test_empty(self, celery, metricsmock):
+        sweep_queues.delay().get()
+        assert not metricsmock.has_record("incr", "data.queue.requeue")
+
+    def test_requeue(self, celery, redis, metricsmock):
+        queue = celery.data_queues["update_wifi_0"]
+        assert queue.reliable
+        queue.enqueue([b"a", b"b"])
+        with pytest.raises(ValueError):
+            with queue.consume():
+                raise ValueError("worker failed")
+        assert queue.size() == 0
+
+        sweep_queues.delay().get()
+        assert queue.size() == 0
+
+        # expire the in-flight batch
+        (token,) = redis.zrange(queue.inflight_key, 0, -1)
+        redis.zadd(queue.inflight_key, {token: 0})
+        sweep_queues.delay().get()
+        assert queue.dequeue() == [b"a", b"b"]
+        assert metricsmock.has_record(
+            "incr", "data.queue.requeue", value=2, tags=["queue:update_wifi_0"]
+        )
+
+    def test_deadletter(self, celery, redis, metricsmock, monkeypatch):
+        queue = celery.data_queues["update_wifi_0"]
+        monkeypatch.setattr(queue, "max_attempts", 1)
+        queue.enqueue([b"a", b"b"])
+        with pytest.raises(ValueError):
+            with queue.consume():
+                raise ValueError("worker failed")
+
+        # expire the in-flight batch
+        (token,) = redis.zrange(queue.inflight_key, 0, -1)
+        redis.zadd(queue.inflight_key, {token: 0})
+        sweep_queues.delay().get()
+        assert queue.size() == 0
+        assert redis.lrange(queue.deadletter_key, 0, -1) == [b"a", b"b"]
+        assert metricsmock.has_record(
+            "incr", "data.queue.deadletter", value=2, tags=["queue:update_wifi_0"]
+        )
+        assert not metricsmock.has_record("incr", "data.queue.requeue")
+
 
 class TestSentryTest:
     def test_basic(self, celery, raven_client):
@@ -1,5 +1,7 @@
 from collections import defaultdict
 from datetime import datetime, timedelta
+import json
+import time
 from unittest import mock
 
 import pytest
@@ -8,11 +10,17 @@ from pytz import UTC
 from sqlalchemy.exc import InterfaceError
 
 from geocalc import destination
-from ichnaea.data.station import CellUpdater
+from ichnaea.cache import (
+    station_cache_key,
+    STATION_CACHE_INVALIDATED,
+    STATION_CACHE_INVALIDATED_TTL,
+)
+from ichnaea.data.station import CellUpdater, StationUpdater
 from ichnaea.data.tasks import update_blue, update_cell, update_wifi
 from ichnaea.models import (
     decode_cellid,
     encode_cellarea,
+    encode_mac,
     BlueShard,
     CellShard,
     Radio,
@@ -54,7 +62,10 @@ class BaseStationTest:
 
         for shard_id, values in sharded_obs.items():
             queue = celery.data_queues[self.queue_prefix + shard_id]
-            queue.enqueue([value.to_json() for value in values])
+            if queue.json:
+                queue.enqueue([value.to_json() for value in values])
+            else:
+                queue.enqueue([value.to_binary() for value in values])
             task.delay(shard_id=shard_id).get()
 
 
@@ -201,6 +212,9 @@ class StationTest(BaseStationTest):
     def check_areas(self, celery, obs):
         pass
 
+    def cache_key(self, obs):
+        return station_cache_key(self.type_tag.split(":")[1], obs.unique_key)
+
     def check_blocked(self, station, first=None, last=None, count=None):
         assert station.block_first == first
         assert station.block_last == last
@@ -403,6 +417,49 @@ class StationTest(BaseStationTest):
             station, self.ten_days.date(), self.ten_days.date(), self.today
         )
 
+    def test_station_cache(self, celery, redis, session):
+        obs1 = self.obs_factory.build(source=ReportSource.query)
+        self.station_factory(
+            created=self.now, modified=self.now, last_seen=self.today, **self.key(obs1)
+        )
+        obs2 = self.obs_factory.build()
+        session.commit()
+        redis.set(self.cache_key(obs1), b"cached")
+        redis.set(self.cache_key(obs2), b"")
+        self.queue_and_update(celery, [obs1, obs2])
+
+        # Only changed stations are invalidated in the shared station cache.
+        assert redis.get(self.cache_key(obs1)) == b"cached"
+        assert redis.get(self.cache_key(obs2)) == STATION_CACHE_INVALIDATED
+        assert 0 < redis.ttl(self.cache_key(obs2)) <= STATION_CACHE_INVALIDATED_TTL
+        assert self.get_station(session, obs2) is not None
+
+    def test_station_cache_disabled(self, celery, redis, session):
+        obs = self.obs_factory.build()
+        with mock.patch(
+            "ichnaea.data.station._station_cache_enabled", return_value=False
+        ):
+            self.queue_and_update(celery, [obs])
+
+        # Without the shared station cache nothing is invalidated.
+        assert redis.get(self.cache_key(obs)) is None
+        assert self.get_station(session, obs) is not None
+
+    def test_station_cache_failure(self, celery, redis, session):
+        obs = self.obs_factory.build()
+        queue = celery.data_queues[
+            self.queue_prefix + self.shard_model.shard_id(getattr(obs, self.unique_key))
+        ]
+        with mock.patch.object(
+            StationUpdater, "invalidate_stations", side_effect=ValueError
+        ):
+            with pytest.raises(ValueError):
+                self.queue_and_update(celery, [obs])
+
+        # The batch isn't acknowledged, so the observation is requeued.
+        assert queue.requeue_expired(now=time.time() + 3600) == (1, 0)
+        assert queue.size() == 1
+
     @pytest.mark.parametrize("obs_source", (ReportSource.gnss, ReportSource.query))
     @pytest.mark.parametrize("station_source", (ReportSource.gnss, ReportSource.query))
     def test_block_half_consistent_obs(
@@ -570,6 +627,11 @@ class StationMacTest(StationTest):
     def key(self, model):
         return {"mac": model.mac}
 
+    def cache_key(self, obs):
+        return station_cache_key(
+            self.type_tag.split(":")[1], encode_mac(obs.unique_key)
+        )
+
 
 class TestBlue(StationMacTest):
 
@@ -643,6 +705,18 @@ class TestWifi(StationMacTest):
     def queue_and_update(self, celery, obs):
         return super(TestWifi, self)._queue_and_update(celery, obs, update_wifi)
 
+    def test_json_queue(self, celery, session):
+        # JSON encoded observations, queued before the switch to the
+        # binary encoding, are still processed.
+        obs = self.obs_factory()
+        queue = celery.data_queues[self.queue_prefix + obs.shard_id]
+        queue.enqueue([json.dumps(obs.to_json()).encode("utf-8")])
+        update_wifi.delay(shard_id=obs.shard_id).get()
+
+        shard = self.shard_model.shard_model(obs.mac)
+        station = session.query(shard).filter(shard.mac == obs.mac).one()
+        assert station.samples == 1
+
     @pytest.mark.parametrize("source", (ReportSource.gnss, ReportSource.query))
     def test_change(self, celery, session, source):
         station = self.station_factory(samples=2, weight=3.0, source=source)
@@ -3,26 +3,46 @@ Contains a reverse geocoder to turn lat/lon and mcc data into region
 codes.
 """
 
+from array import array
 import atexit
-from collections import namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
+import gzip
+import hashlib
 import json
+import math
 import os
+import struct
+import sys
+import threading
 
 import genc
+import markus
 import mobile_codes
+import numpy
 from shapely import geometry
 from shapely import prepared
+from shapely import vectorized
+from shapely import wkb
 from rtree import index
 
 import geocalc
+from ichnaea.conf import settings
 from ichnaea import util
 
+METRICS = markus.get_metrics()
+
 REGIONS_FILE = os.path.join(
     os.path.abspath(os.path.dirname(__file__)), "regions.geojson.gz"
 )
 REGIONS_BUFFER_FILE = os.path.join(
     os.path.abspath(os.path.dirname(__file__)), "regions_buffer.geojson.gz"
 )
+REGIONS_GRID_FILE = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "regions_grid.bin.gz"
+)
+REGIONS_WKB_FILE = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "regions.wkb.gz"
+)
 
 DATELINE_EAST = geometry.box(180.0, -90.0, 270.0, 90.0)
 DATELINE_WEST = geometry.box(-270.0, -90.0, -180.0, 90.0)
@@ -32,6 +52,395 @@ MCC_TO_GENC_MAP = {"PS": "XW"}
 
 Region = namedtuple("Region", "code name radius")
 
+# Boundary vertices of a region, in degrees and radians.
+Boundary = namedtuple("Boundary", "lats lons rad_lats rad_lons cos_lats")
+
+# Haversine distances on a sphere differ from the Vincenty distances on
+# the ellipsoid by less than 0.6%. Boundary vertices within this margin
+# of the nearest or farthest vertex by haversine distance are candidates
+# for the exact distance calculation.
+BOUNDARY_MARGIN = 0.02
+
+# Header of a region grid file: magic bytes, digest of the region files
+# the grid was built from, grid depth, number of region codes and nodes.
+GRID_HEADER = struct.Struct("<8s20sBHI")
+GRID_MAGIC = b"ICHNGRD1"
+GRID_DEPTH = 12
+
+# Values of region grid cells, which aren't region code indices.
+GRID_OUTSIDE = -1  # cell is outside of all regions
+GRID_BORDER = -2  # cell needs to be resolved using the region shapes
+GRID_NODE = -3  # cells below this are nodes, split into four child cells
+
+# Header of a region WKB file: magic bytes, digest of the region files
+# the shapes were read from and number of regions. Each region has a
+# header with its code, radius and sizes of the precise and buffered
+# WKB encoded shapes, followed by the shapes.
+WKB_HEADER = struct.Struct("<8s20sH")
+WKB_MAGIC = b"ICHNWKB1"
+WKB_REGION = struct.Struct("<2sdII")
+
+# Geocoder attributes, which trigger loading the regions on first use.
+LOADED_ATTRIBUTES = frozenset(
+    [
+        "_boundaries",
+        "_buffered_shapes",
+        "_grid",
+        "_prepared_shapes",
+        "_radii",
+        "_shapes",
+        "_tree",
+        "_tree_ids",
+        "_valid_regions",
+    ]
+)
+
+# Expand grid cells slightly when building the grid, so the rounding
+# of positions into grid cells can't move them outside of a cell.
+GRID_EPSILON = 1e-9
+
+
+def regions_digest(regions_file=REGIONS_FILE, buffer_file=REGIONS_BUFFER_FILE):
+    """Return a digest of the content of the region files."""
+    digest = hashlib.sha1()
+    for filename in (regions_file, buffer_file):
+        with open(filename, "rb") as fd:
+            digest.update(fd.read())
+    return digest.digest()
+
+
+def read_regions_geojson(regions_file=REGIONS_FILE, buffer_file=REGIONS_BUFFER_FILE):
+    """
+    Read the regions from the GeoJSON files.
+
+    Returns a tuple of dicts, mapping region codes to the precise
+    shapes, the region radii and the buffered shapes.
+    """
+    genc_regions = frozenset([rec.alpha2 for rec in genc.REGIONS])
+    shapes = {}
+    radii = {}
+    buffered_shapes = {}
+
+    with util.gzip_open(regions_file, "r") as fd:
+        regions_data = json.load(fd)
+
+    for feature in regions_data["features"]:
+        code = feature["properties"]["alpha2"]
+        if code in genc_regions:
+            shapes[code] = geometry.shape(feature["geometry"])
+            radii[code] = feature["properties"]["radius"]
+
+    with util.gzip_open(buffer_file, "r") as fd:
+        buffer_data = json.load(fd)
+
+    for feature in buffer_data["features"]:
+        code = feature["properties"]["alpha2"]
+        if code in genc_regions:
+            buffered_shapes[code] = geometry.shape(feature["geometry"])
+
+    return (shapes, radii, buffered_shapes)
+
+
+def read_regions_wkb(filename, digest=None):
+    """
+    Read the regions from a file created by :func:`write_regions_wkb`.
+
+    Returns the same tuple as :func:`read_regions_geojson`, or None if
+    the file wasn't built from region files with the given digest.
+    """
+    with gzip.open(filename, "rb") as fd:
+        data = fd.read()
+
+    magic, file_digest, num_regions = WKB_HEADER.unpack_from(data)
+    if magic != WKB_MAGIC:
+        raise ValueError("Invalid region WKB file: %s" % filename)
+    if digest is not None and file_digest != digest:
+        return None
+
+    shapes = {}
+    radii = {}
+    buffered_shapes = {}
+    offset = WKB_HEADER.size
+    for _ in range(num_regions):
+        code, radius, shape_size, buffered_size = WKB_REGION.unpack_from(data, offset)
+        code = code.decode("ascii")
+        offset += WKB_REGION.size
+        if shape_size:
+            shapes[code] = wkb.loads(data[offset : offset + shape_size])
+            radii[code] = radius
+            offset += shape_size
+        if buffered_size:
+            buffered_shapes[code] = wkb.loads(data[offset : offset + buffered_size])
+            offset += buffered_size
+
+    return (shapes, radii, buffered_shapes)
+
+
+def write_regions_wkb(
+    filename, shapes, radii, buffered_shapes, digest=b"",
+):
+    """
+    Write the regions, as returned by :func:`read_regions_geojson`,
+    to a gzipped file of WKB encoded shapes.
+    """
+    codes = sorted(set(shapes.keys()) | set(buffered_shapes.keys()))
+    with gzip.open(filename, "wb", compresslevel=9) as fd:
+        fd.write(WKB_HEADER.pack(WKB_MAGIC, digest, len(codes)))
+        for code in codes:
+            shape = shapes[code].wkb if code in shapes else b""
+            buffered = buffered_shapes[code].wkb if code in buffered_shapes else b""
+            fd.write(
+                WKB_REGION.pack(
+                    code.encode("ascii"),
+                    radii.get(code) or 0.0,
+                    len(shape),
+                    len(buffered),
+                )
+            )
+            fd.write(shape)
+            fd.write(buffered)
+
+
+class RegionGrid(object):
+    """
+    A hierarchical grid index of the regions, to resolve most region
+    lookups with integer arithmetic instead of polygon tests.
+
+    The grid is a quadtree over the lat/lon space. Each cell is labelled
+    as being fully inside a region, outside all regions, or on a border.
+    Cells on a border are split into four child cells, down to the
+    maximum depth of the grid. Positions in border cells at the maximum
+    depth have to be resolved with the region shapes.
+
+    A cell is only labelled as inside a region, if all positions in it
+    resolve to that region using the region shapes, so the grid never
+    changes the result of a lookup.
+
+    The nodes are stored in a flat array of four cells per node,
+    ordered by their latitude and then longitude half. Cell values
+    are region code indices, ``GRID_OUTSIDE``, ``GRID_BORDER`` or a
+    reference to a child node, encoded as ``GRID_NODE - node_index``.
+    """
+
+    def __init__(self, depth, codes, nodes, digest=b""):
+        self.depth = depth
+        self.codes = codes
+        self.nodes = nodes
+        self.digest = digest
+        self._size = 1 << depth
+        self._lon_scale = self._size / 360.0
+        self._lat_scale = self._size / 180.0
+
+    @classmethod
+    def build(cls, geocoder, depth=GRID_DEPTH, digest=b""):
+        """
+        Build a grid from the region shapes of a geocoder.
+
+        This is slow and done offline by the ``location_region_json``
+        script, which stores the grid in a file next to the region files.
+        """
+        codes = sorted(geocoder._buffered_shapes.keys())
+        code_index = dict((code, i) for i, code in enumerate(codes))
+        nodes = array("i")
+
+        def classify(level, x, y, candidates):
+            width = 360.0 / (1 << level)
+            height = 180.0 / (1 << level)
+            box = geometry.box(
+                -180.0 + x * width - GRID_EPSILON,
+                -90.0 + y * height - GRID_EPSILON,
+                -180.0 + (x + 1) * width + GRID_EPSILON,
+                -90.0 + (y + 1) * height + GRID_EPSILON,
+            )
+            value, candidates = geocoder._classify_box(box, candidates)
+            if value == GRID_OUTSIDE:
+                return GRID_OUTSIDE
+            if value != GRID_BORDER:
+                return code_index[value]
+            if level == depth:
+                return GRID_BORDER
+            return split(level, x, y, candidates)
+
+        def split(level, x, y, candidates):
+            node = len(nodes) // 4
+            nodes.extend([0, 0, 0, 0])
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    nodes[node * 4 + dy * 2 + dx] = classify(
+                        level + 1, 2 * x + dx, 2 * y + dy, candidates
+                    )
+            return GRID_NODE - node
+
+        split(0, 0, 0, codes)
+        return cls(depth, codes, nodes, digest=digest)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a grid from a file created by :meth:`dump`."""
+        with gzip.open(filename, "rb") as fd:
+            data = fd.read()
+
+        magic, digest, depth, num_codes, num_nodes = GRID_HEADER.unpack_from(data)
+        if magic != GRID_MAGIC:
+            raise ValueError("Invalid region grid: %s" % filename)
+
+        offset = GRID_HEADER.size
+        codes_data = data[offset : offset + num_codes * 2].decode("ascii")
+        codes = [codes_data[i : i + 2] for i in range(0, len(codes_data), 2)]
+        offset += num_codes * 2
+
+        nodes = array("i")
+        nodes.frombytes(data[offset : offset + num_nodes * 4 * nodes.itemsize])
+        if sys.byteorder != "little":
+            nodes.byteswap()
+        if len(nodes) != num_nodes * 4:
+            raise ValueError("Truncated region grid: %s" % filename)
+        return cls(depth, codes, nodes, digest=digest)
+
+    def dump(self, filename):
+        """Write the grid to a gzipped file."""
+        nodes = array("i", self.nodes)
+        if sys.byteorder != "little":
+            nodes.byteswap()
+        with gzip.open(filename, "wb", compresslevel=9) as fd:
+            fd.write(
+                GRID_HEADER.pack(
+                    GRID_MAGIC,
+                    self.digest,
+                    self.depth,
+                    len(self.codes),
+                    len(self.nodes) // 4,
+                )
+            )
+            fd.write("".join(self.codes).encode("ascii"))
+            fd.write(nodes.tobytes())
+
+    def lookup(self, lat, lon):
+        """
+        Return the grid cell value of a position, either the index of
+        a region code, ``GRID_OUTSIDE`` or ``GRID_BORDER``.
+        """
+        if not (-90.0 <= lat < 90.0 and -180.0 <= lon < 180.0):
+            return GRID_BORDER
+
+        size = self._size
+        x = int((lon + 180.0) * self._lon_scale)
+        y = int((lat + 90.0) * self._lat_scale)
+        if x >= size or y >= size:
+            return GRID_BORDER
+
+        nodes = self.nodes
+        node = 0
+        shift = self.depth - 1
+        while True:
+            value = nodes[node * 4 + ((y >> shift) & 1) * 2 + ((x >> shift) & 1)]
+            if value > GRID_NODE:
+                return value
+            node = GRID_NODE - value
+            shift -= 1
+
+    def lookup_many(self, lats, lons):
+        """
+        Return an array of the grid cell values of arrays of positions,
+        walking down the grid for all positions at once.
+        """
+        lats = numpy.asarray(lats, dtype=numpy.double)
+        lons = numpy.asarray(lons, dtype=numpy.double)
+        values = numpy.full(len(lats), GRID_BORDER, dtype=numpy.int64)
+
+        with numpy.errstate(invalid="ignore"):
+            valid = (-90.0 <= lats) & (lats < 90.0) & (-180.0 <= lons) & (lons < 180.0)
+        indices = numpy.flatnonzero(valid)
+        x = ((lons[indices] + 180.0) * self._lon_scale).astype(numpy.int64)
+        y = ((lats[indices] + 90.0) * self._lat_scale).astype(numpy.int64)
+        inside = (x < self._size) & (y < self._size)
+        indices = indices[inside]
+        x = x[inside]
+        y = y[inside]
+
+        nodes = numpy.frombuffer(self.nodes, dtype=numpy.intc)
+        node = numpy.zeros(len(indices), dtype=numpy.int64)
+        shift = self.depth - 1
+        while len(indices):
+            value = nodes[node * 4 + ((y >> shift) & 1) * 2 + ((x >> shift) & 1)]
+            done = value > GRID_NODE
+            values[indices[done]] = value[done]
+            pending = ~done
+            indices = indices[pending]
+            x = x[pending]
+            y = y[pending]
+            node = GRID_NODE - value[pending]
+            shift -= 1
+        return values
+
+
+class RegionCache(object):
+    """
+    A bounded least-recently-used cache of the regions of small cells
+    of the lat/lon space, used in front of the region shapes.
+
+    Positions are quantized to ``precision`` decimal digits, so each
+    cache entry covers one cell of that size. Cells are classified the
+    same way as the grid cells of a :class:`RegionGrid`. Only cells
+    entirely inside a single region, or outside all regions, resolve
+    positions from the cache, so it never changes the result of a
+    lookup. Border cells are cached as such, so their positions skip
+    the classification and go straight to the region shapes.
+    """
+
+    def __init__(self, max_size, precision):
+        """
+        :param max_size: Maximum number of cached cells.
+        :param precision: Number of decimal digits of the cell size.
+        """
+        self.max_size = max_size
+        self.precision = precision
+        self._scale = 10.0 ** precision
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def key(self, lat, lon):
+        """Return the cell containing a position."""
+        return (math.floor(lat * self._scale), math.floor(lon * self._scale))
+
+    def box(self, key):
+        """Return the box of a cell, slightly expanded."""
+        scale = self._scale
+        return geometry.box(
+            key[1] / scale - GRID_EPSILON,
+            key[0] / scale - GRID_EPSILON,
+            (key[1] + 1) / scale + GRID_EPSILON,
+            (key[0] + 1) / scale + GRID_EPSILON,
+        )
+
+    def get(self, key):
+        """
+        Return the cached value of a cell, or None if it isn't cached.
+        """
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store the value of a cell, a region code, ``GRID_OUTSIDE``
+        or ``GRID_BORDER``.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
 
 class Geocoder(object):
     """
@@ -39,71 +448,135 @@ class Geocoder(object):
     into region codes.
     """
 
-    _buffered_shapes = None  # maps region code to a buffered prepared shape
-    _prepared_shapes = None  # maps region code to a precise prepared shape
-    _shapes = None  # maps region code to a precise shape
-    _tree = None  # RTree of buffered region envelopes
-    _tree_ids = None  # maps RTree entry id to region code
-    _valid_regions = None  # Set of known and valid region codes
-    _radii = None  # A cache of region radii
-
-    def __init__(self, regions_file=REGIONS_FILE, buffer_file=REGIONS_BUFFER_FILE):
-        self._buffered_shapes = {}
-        self._prepared_shapes = {}
-        self._shapes = {}
-        self._tree_ids = {}
-        self._radii = {}
-
-        with util.gzip_open(regions_file, "r") as fd:
-            regions_data = json.load(fd)
-
-        genc_regions = frozenset([rec.alpha2 for rec in genc.REGIONS])
-        for feature in regions_data["features"]:
-            code = feature["properties"]["alpha2"]
-            if code in genc_regions:
-                shape = geometry.shape(feature["geometry"])
-                self._shapes[code] = shape
-                self._prepared_shapes[code] = prepared.prep(shape)
-                self._radii[code] = feature["properties"]["radius"]
-
-        with util.gzip_open(buffer_file, "r") as fd:
-            buffer_data = json.load(fd)
+    # Attributes loaded from the region files on first use:
+    # _boundaries maps region code to its boundary vertices
+    # _buffered_shapes maps region code to a buffered prepared shape
+    # _grid RegionGrid index of the regions
+    # _prepared_shapes maps region code to a precise prepared shape
+    # _shapes maps region code to a precise shape
+    # _tree RTree of buffered region envelopes
+    # _tree_ids maps RTree entry id to region code
+    # _valid_regions Set of known and valid region codes
+    # _radii A cache of region radii
+
+    def __init__(
+        self,
+        regions_file=REGIONS_FILE,
+        buffer_file=REGIONS_BUFFER_FILE,
+        grid_file=REGIONS_GRID_FILE,
+        wkb_file=REGIONS_WKB_FILE,
+        cache_size=0,
+        cache_precision=3,
+    ):
+        """
+        :param cache_size: Maximum number of cells in the
+                           :class:`RegionCache`, 0 to disable the cache.
+        :param cache_precision: Number of decimal digits of the cell size
+                                of the :class:`RegionCache`.
+        """
+        self.cache = None
+        if cache_size > 0:
+            self.cache = RegionCache(cache_size, cache_precision)
+        self.regions_file = regions_file
+        self.buffer_file = buffer_file
+        self.grid_file = grid_file
+        self.wkb_file = wkb_file
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, so there's no overhead
+        # once the regions are loaded.
+        if name in LOADED_ATTRIBUTES:
+            self.load()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def load(self):
+        """
+        Load the regions, if they haven't been loaded yet.
+
+        The regions are loaded from the prebuilt WKB file if it was built
+        from the current region files, or else from the GeoJSON files.
+        """
+        with self._load_lock:
+            if self._loaded:
+                return
+
+            digest = regions_digest(self.regions_file, self.buffer_file)
+            regions = None
+            if self.wkb_file and os.path.isfile(self.wkb_file):
+                regions = read_regions_wkb(self.wkb_file, digest)
+            if regions is None:
+                regions = read_regions_geojson(self.regions_file, self.buffer_file)
+            attributes = self._build_regions(*regions)
+
+            # Only use a grid built from the same region files.
+            attributes["_grid"] = None
+            if self.grid_file and os.path.isfile(self.grid_file):
+                grid = RegionGrid.load(self.grid_file)
+                if grid.digest == digest:
+                    attributes["_grid"] = grid
+
+            # Other threads only take the lock for missing attributes,
+            # so they must never see partly built ones.
+            self.__dict__.update(attributes)
+            self._loaded = True
+
+    def _build_regions(self, shapes, radii, buffered_shapes):
+        """
+        Return a dictionary of the loaded attributes, built from the
+        precise and buffered region shapes.
+        """
+        boundaries = {}
+        buffered = {}
+        prepared_shapes = {}
+        tree_ids = {}
+
+        for code, shape in shapes.items():
+            prepared_shapes[code] = prepared.prep(shape)
+            boundaries[code] = self._boundary(shape)
 
         i = 0
         envelopes = []
-        for feature in buffer_data["features"]:
-            code = feature["properties"]["alpha2"]
-            if code in genc_regions:
-                shape = geometry.shape(feature["geometry"])
-                self._buffered_shapes[code] = prepared.prep(shape)
-                # Collect rtree index entries, and maintain a separate id to
-                # code mapping. We don't use index object support as it
-                # requires un/pickling the object entries on each lookup.
-                if isinstance(shape, geometry.base.BaseMultipartGeometry):
-                    # Index bounding box of individual polygons instead of
-                    # the multipolygon, to avoid issues with regions crossing
-                    # the -180.0/+180.0 longitude boundary.
-                    for geom in shape.geoms:
-                        envelopes.append((i, geom.envelope.bounds, None))
-                        self._tree_ids[i] = code
-                        i += 1
-                else:
-                    envelopes.append((i, shape.envelope.bounds, None))
-                    self._tree_ids[i] = code
+        for code, shape in buffered_shapes.items():
+            buffered[code] = prepared.prep(shape)
+            # Collect rtree index entries, and maintain a separate id to
+            # code mapping. We don't use index object support as it
+            # requires un/pickling the object entries on each lookup.
+            if isinstance(shape, geometry.base.BaseMultipartGeometry):
+                # Index bounding box of individual polygons instead of
+                # the multipolygon, to avoid issues with regions crossing
+                # the -180.0/+180.0 longitude boundary.
+                for geom in shape.geoms:
+                    envelopes.append((i, geom.bounds, None))
+                    tree_ids[i] = code
                     i += 1
+            else:
+                envelopes.append((i, shape.bounds, None))
+                tree_ids[i] = code
+                i += 1
 
         props = index.Property()
         props.fill_factor = 0.9
         props.leaf_capacity = 20
-        self._tree = index.Index(envelopes, interleaved=True, properties=props)
-        for envelope in envelopes:
-            self._tree.insert(*envelope)
-        self._valid_regions = frozenset(self._shapes.keys())
+        return {
+            "_boundaries": boundaries,
+            "_buffered_shapes": buffered,
+            "_prepared_shapes": prepared_shapes,
+            "_radii": radii,
+            "_shapes": shapes,
+            "_tree": index.Index(envelopes, interleaved=True, properties=props),
+            "_tree_ids": tree_ids,
+            "_valid_regions": frozenset(shapes.keys()),
+        }
 
     def close(self):
         """
         Close the Geocoder and its handles on ctypes pointers.
         """
+        if not self._loaded:
+            return
         self._tree.properties.handle.destroy()
         self._tree.close()
 
@@ -116,6 +589,88 @@ class Geocoder(object):
         Return a region code matching the provided position.
         If the position is not found inside any region return None.
         """
+        if self._grid is not None:
+            value = self._grid.lookup(lat, lon)
+            if value >= 0:
+                return self._grid.codes[value]
+            elif value == GRID_OUTSIDE:
+                return None
+        if self.cache is not None:
+            return self._cached_regions([lat], [lon])[0]
+        return self._region_shapes(lat, lon)
+
+    def regions(self, lats, lons):
+        """
+        Return a list of region codes matching the provided arrays of
+        positions, with None for positions not inside any region or
+        without a valid position.
+        """
+        lats = numpy.asarray(lats, dtype=numpy.double)
+        lons = numpy.asarray(lons, dtype=numpy.double)
+        if self._grid is None:
+            values = numpy.full(len(lats), GRID_BORDER, dtype=numpy.int64)
+        else:
+            values = self._grid.lookup_many(lats, lons)
+
+        codes = self._grid.codes if self._grid is not None else ()
+        result = [codes[value] if value >= 0 else None for value in values.tolist()]
+        border = (values == GRID_BORDER) & numpy.isfinite(lats) & numpy.isfinite(lons)
+        indices = numpy.flatnonzero(border).tolist()
+        if self.cache is not None:
+            regions = self._cached_regions(
+                [float(lats[i]) for i in indices], [float(lons[i]) for i in indices]
+            )
+        else:
+            regions = [
+                self._region_shapes(float(lats[i]), float(lons[i])) for i in indices
+            ]
+        for i, region in zip(indices, regions):
+            result[i] = region
+        return result
+
+    def _cached_regions(self, lats, lons):
+        """
+        Return a list of region codes matching the provided positions,
+        using the region cache for positions in cells entirely inside a
+        single region or outside all regions.
+        """
+        cache = self.cache
+        stats = defaultdict(int)
+        result = []
+        for lat, lon in zip(lats, lons):
+            key = cache.key(lat, lon)
+            value = cache.get(key)
+            if value is None:
+                stats["miss"] += 1
+                box = cache.box(key)
+                candidates = set(
+                    [self._tree_ids[id_] for id_ in self._tree.intersection(box.bounds)]
+                )
+                value, _ = self._classify_box(box, candidates)
+                cache.set(key, value)
+            elif value == GRID_BORDER:
+                stats["border"] += 1
+            else:
+                stats["hit"] += 1
+
+            if value == GRID_BORDER:
+                result.append(self._region_shapes(lat, lon))
+            elif value == GRID_OUTSIDE:
+                result.append(None)
+            else:
+                result.append(value)
+
+        for status, count in stats.items():
+            METRICS.incr(
+                "geocoder.region_cache", value=count, tags=["status:" + status]
+            )
+        return result
+
+    def _region_shapes(self, lat, lon):
+        """
+        Return a region code matching the provided position, using the
+        region shapes.
+        """
         # Look up point in RTree of buffered region envelopes.
         # This is a coarse-grained but very fast match.
         point = geometry.Point(lon, lat)
@@ -152,32 +707,113 @@ class Geocoder(object):
         # regions is it closest to?
         if not precise_codes:
             for code in buffered_codes:
-                coords = []
-                if isinstance(
-                    self._shapes[code].boundary, geometry.base.BaseMultipartGeometry
-                ):
-                    for geom in self._shapes[code].boundary.geoms:
-                        coords.extend([coord for coord in geom.coords])
-                else:
-                    coords = self._shapes[code].boundary.coords
-                for coord in coords:
-                    distances[geocalc.distance(coord[1], coord[0], lat, lon)] = code
-            return distances[min(distances.keys())]
+                distances[code] = self._boundary_distance(code, lat, lon)
+            return self._tie_break(distances)
 
         # point was in multiple overlapping regions, take the one where it
         # is farthest away from the border / the most inside a region
         for code in precise_codes:
-            coords = []
-            if isinstance(
-                self._shapes[code].boundary, geometry.base.BaseMultipartGeometry
+            distances[code] = self._boundary_distance(code, lat, lon, farthest=True)
+        return self._tie_break(distances, farthest=True)
+
+    @staticmethod
+    def _tie_break(distances, farthest=False):
+        """
+        Return the region code with the smallest, or largest, distance.
+
+        Of several codes with the same distance the one added last to
+        the distances mapping wins.
+        """
+        codes = list(distances)[::-1]
+        if farthest:
+            return max(codes, key=distances.get)
+        return min(codes, key=distances.get)
+
+    def _classify_box(self, box, candidates):
+        """
+        Classify a box by the regions it's in.
+
+        Returns a two-tuple of the region code, if all positions in the
+        box resolve to the same region, ``GRID_OUTSIDE`` if the box is
+        outside all regions or else ``GRID_BORDER``, and the candidate
+        region codes which intersect the box.
+        """
+        buffered_shapes = self._buffered_shapes
+        prepared_shapes = self._prepared_shapes
+        candidates = [
+            code for code in candidates if buffered_shapes[code].intersects(box)
+        ]
+        if not candidates:
+            return (GRID_OUTSIDE, candidates)
+
+        if all(buffered_shapes[code].contains_properly(box) for code in candidates):
+            if len(candidates) == 1:
+                return (candidates[0], candidates)
+
+            # The box is inside multiple buffered regions, it can
+            # still be labelled if it's inside one precise region
+            # and doesn't touch any of the others.
+            inside = [
+                code
+                for code in candidates
+                if prepared_shapes[code].contains_properly(box)
+            ]
+            if len(inside) == 1 and not any(
+                prepared_shapes[code].intersects(box)
+                for code in candidates
+                if code != inside[0]
             ):
-                for geom in self._shapes[code].boundary.geoms:
-                    coords.extend([coord for coord in geom.coords])
-            else:
-                coords = self._shapes[code].boundary.coords
-            for coord in coords:
-                distances[geocalc.distance(coord[1], coord[0], lat, lon)] = code
-        return distances[max(distances.keys())]
+                return (inside[0], candidates)
+
+        return (GRID_BORDER, candidates)
+
+    @staticmethod
+    def _boundary(shape):
+        """
+        Return the vertices on the boundary of the shape.
+        """
+        boundary = shape.boundary
+        if isinstance(boundary, geometry.base.BaseMultipartGeometry):
+            coords = numpy.concatenate(
+                [numpy.asarray(geom.coords) for geom in boundary.geoms]
+            )
+        else:
+            coords = numpy.asarray(boundary.coords)
+        lats = numpy.ascontiguousarray(coords[:, 1], dtype=numpy.double)
+        lons = numpy.ascontiguousarray(coords[:, 0], dtype=numpy.double)
+        rad_lats = numpy.radians(lats)
+        return Boundary(lats, lons, rad_lats, numpy.radians(lons), numpy.cos(rad_lats))
+
+    def _boundary_distance(self, code, lat, lon, farthest=False):
+        """
+        Return the distance from the position to the nearest, or farthest,
+        vertex on the boundary of the region associated with the given code.
+
+        The haversine distances to all vertices narrow down the candidates,
+        so the exact distance only needs to be calculated for a few of them.
+        """
+        boundary = self._boundaries[code]
+        rad_lat = numpy.radians(lat)
+        half_dlat = numpy.sin((boundary.rad_lats - rad_lat) * 0.5)
+        half_dlon = numpy.sin((boundary.rad_lons - numpy.radians(lon)) * 0.5)
+        approx = numpy.arcsin(
+            numpy.sqrt(
+                numpy.minimum(
+                    half_dlat * half_dlat
+                    + boundary.cos_lats * numpy.cos(rad_lat) * half_dlon * half_dlon,
+                    1.0,
+                )
+            )
+        )
+        if farthest:
+            candidates = approx >= approx.max() * (1.0 - BOUNDARY_MARGIN)
+        else:
+            candidates = approx <= approx.min() * (1.0 + BOUNDARY_MARGIN)
+
+        distances = geocalc.distances(
+            boundary.lats[candidates], boundary.lons[candidates], lat, lon
+        )
+        return distances.max() if farthest else distances.min()
 
     def any_region(self, lat, lon):
         """
@@ -185,6 +821,11 @@ class Geocoder(object):
 
         Returns False if the position is outside of all known regions.
         """
+        if self._grid is not None:
+            value = self._grid.lookup(lat, lon)
+            if value != GRID_BORDER:
+                return value >= 0
+
         point = geometry.Point(lon, lat)
         codes = [self._tree_ids[id_] for id_ in self._tree.intersection(point.bounds)]
 
@@ -207,6 +848,41 @@ class Geocoder(object):
             return True
         return False
 
+    def in_regions(self, lats, lons, codes):
+        """
+        Return a boolean array, telling if each of the provided positions
+        is inside the region associated with the region code at the same
+        position in the list of codes.
+        """
+        lats = numpy.asarray(lats, dtype=numpy.double)
+        lons = numpy.asarray(lons, dtype=numpy.double)
+        result = numpy.zeros(len(lats), dtype=numpy.bool_)
+        if self._grid is None:
+            values = [GRID_BORDER] * len(lats)
+            grid_codes = ()
+        else:
+            values = self._grid.lookup_many(lats, lons).tolist()
+            grid_codes = self._grid.codes
+
+        # Positions in grid cells inside a region are inside its buffered
+        # shape. Other positions are tested against the shapes of each
+        # region in one go.
+        pending = defaultdict(list)
+        for i, (code, value) in enumerate(zip(codes, values)):
+            if code not in self._valid_regions or value == GRID_OUTSIDE:
+                continue
+            if value >= 0 and grid_codes[value] == code:
+                result[i] = True
+            else:
+                pending[code].append(i)
+
+        for code, indices in pending.items():
+            indices = numpy.array(indices, dtype=numpy.intp)
+            result[indices] = vectorized.contains(
+                self._buffered_shapes[code], lons[indices], lats[indices]
+            )
+        return result
+
     def in_region_mcc(self, lat, lon, mcc):
         """
         Is the provided lat/lon position inside one of the regions
@@ -282,6 +958,44 @@ class Geocoder(object):
         # fall back to lookup without the mcc/region code hint
         return self.region(lat, lon)
 
+    def regions_for_cells(self, lats, lons, mccs):
+        """
+        Return a list of region codes matching the provided arrays of
+        positions and mobile country codes, like
+        :meth:`~ichnaea.geocode.Geocoder.region_for_cell`.
+        """
+        lats = numpy.asarray(lats, dtype=numpy.double)
+        lons = numpy.asarray(lons, dtype=numpy.double)
+        indices = []
+        codes = []
+        for i, mcc in enumerate(mccs):
+            for code in self.regions_for_mcc(mcc):
+                indices.append(i)
+                codes.append(code)
+
+        matches = defaultdict(list)
+        if indices:
+            candidates = numpy.array(indices, dtype=numpy.intp)
+            inside = self.in_regions(lats[candidates], lons[candidates], codes)
+            for i, code, match in zip(indices, codes, inside.tolist()):
+                if match:
+                    matches[i].append(code)
+
+        result = [None] * len(lats)
+        ambiguous = []
+        for i, found in matches.items():
+            if len(found) == 1:
+                result[i] = found[0]
+            else:
+                ambiguous.append(i)
+
+        # fall back to lookup without the mcc/region code hint
+        if ambiguous:
+            regions = self.regions(lats[ambiguous], lons[ambiguous])
+            for i, region in zip(ambiguous, regions):
+                result[i] = region
+        return result
+
     def region_max_radius(self, code):
         """
         Return the maximum radius of a circle encompassing the largest
@@ -295,4 +1009,14 @@ def geocode_exit():
     GEOCODER.close()
 
 
-GEOCODER = Geocoder()
+def configure_geocoder(cache_size=None, cache_precision=None):
+    """
+    Configure and return a :class:`~ichnaea.geocode.Geocoder` instance.
+    """
+    cache_size = settings("geocoder_cache_size") if cache_size is None else cache_size
+    if cache_precision is None:
+        cache_precision = settings("geocoder_cache_precision")
+    return Geocoder(cache_size=cache_size, cache_precision=cache_precision)
+
+
+GEOCODER = configure_geocoder()
@@ -6,13 +6,17 @@ Helper functions and classes around GeoIP lookups, based on Maxmind's
 
 import datetime
 import logging
+import os
+import threading
 import time
 
 import genc
 from geoip2.database import Reader
 from geoip2.errors import AddressNotFoundError, GeoIP2Error
+import markus
 from maxminddb import InvalidDatabaseError
 from maxminddb.const import MODE_AUTO
+from repoze import lru
 
 from ichnaea.conf import settings
 from ichnaea.constants import DEGREE_DECIMAL_PLACES
@@ -20,6 +24,9 @@ from ichnaea.geocode import GEOCODER
 
 
 LOGGER = logging.getLogger(__name__)
+METRICS = markus.get_metrics()
+
+_MARKER = object()
 
 
 # The region codes present in the GeoIP data files, extracted from
@@ -372,7 +379,15 @@ GEOIP_GENC_MAP = {
 }
 
 
-def configure_geoip(filename=None, mode=MODE_AUTO, raven_client=None, _client=None):
+def configure_geoip(
+    filename=None,
+    mode=MODE_AUTO,
+    raven_client=None,
+    cache_size=None,
+    cache_ttl=None,
+    reload_interval=None,
+    _client=None,
+):
     """
     Configure and return a :class:`~ichnaea.geoip.GeoIPWrapper` instance.
 
@@ -382,9 +397,18 @@ def configure_geoip(filename=None, mode=MODE_AUTO, raven_client=None, _client=No
     :param raven_client: A configured raven/sentry client.
     :type raven_client: :class:`raven.base.Client`
 
+    :param cache_size: Maximum number of cached lookup results.
+    :param cache_ttl: Lifetime of cached lookup results, in seconds.
+    :param reload_interval: Seconds between checks for a changed
+                            database file, 0 to never reload it.
+
     :param _client: Test-only hook to provide a pre-configured client.
     """
     filename = settings("geoip_path") if filename is None else filename
+    cache_size = settings("geoip_cache_size") if cache_size is None else cache_size
+    cache_ttl = settings("geoip_cache_ttl") if cache_ttl is None else cache_ttl
+    if reload_interval is None:
+        reload_interval = settings("geoip_reload_interval")
 
     if _client is not None:
         return _client
@@ -400,7 +424,9 @@ def configure_geoip(filename=None, mode=MODE_AUTO, raven_client=None, _client=No
         return GeoIPNull()
 
     try:
-        db = GeoIPWrapper(filename, mode=mode)
+        db = GeoIPWrapper(
+            filename, mode=mode, cache_size=cache_size, cache_ttl=cache_ttl
+        )
         if not db.check_extension() and raven_client is not None:
             try:
                 raise RuntimeError("Maxmind C extension not installed.")
@@ -415,6 +441,17 @@ def configure_geoip(filename=None, mode=MODE_AUTO, raven_client=None, _client=No
         LOGGER.info("Returning GeoIPNull.")
         return GeoIPNull()
 
+    if reload_interval > 0:
+        db = GeoIPReloader(
+            db,
+            filename,
+            mode=mode,
+            cache_size=cache_size,
+            cache_ttl=cache_ttl,
+            interval=reload_interval,
+            raven_client=raven_client,
+        )
+
     LOGGER.info("GeoIP configured.")
     return db
 
@@ -428,6 +465,11 @@ class GeoIPWrapper(Reader):
     and an additional mode, which defaults to
     :data:`maxminddb.const.MODE_AUTO`.
 
+    Lookup results are kept in a bounded least-recently-used cache for
+    ``cache_ttl`` seconds, as many queries come from the same IP
+    addresses. The cache belongs to the opened database file and starts
+    out empty whenever a database file is opened.
+
     :raises: :exc:`maxminddb.InvalidDatabaseError`
     """
 
@@ -438,7 +480,7 @@ class GeoIPWrapper(Reader):
         ValueError,
     )
 
-    def __init__(self, filename, mode=MODE_AUTO):
+    def __init__(self, filename, mode=MODE_AUTO, cache_size=0, cache_ttl=0):
         super(GeoIPWrapper, self).__init__(filename, mode=mode)
 
         database_type = self.metadata().database_type
@@ -446,6 +488,15 @@ class GeoIPWrapper(Reader):
             message = "Invalid database type, expected City"
             raise InvalidDatabaseError(message)
 
+        self._cache = None
+        if cache_size > 0 and cache_ttl > 0:
+            self._cache = lru.ExpiringLRUCache(cache_size, default_timeout=cache_ttl)
+
+    def clear_cache(self):
+        """Remove all cached lookup results."""
+        if self._cache is not None:
+            self._cache.clear()
+
     @property
     def age(self):
         """
@@ -491,6 +542,69 @@ class GeoIPWrapper(Reader):
         :returns: A dictionary with city, region data and location data.
         :rtype: dict
         """
+        if self._cache is None:
+            return self._lookup(addr)
+
+        result = self._cache.get(addr, _MARKER)
+        if result is _MARKER:
+            METRICS.incr("geoip.cache", tags=["status:miss"])
+            result = self._lookup(addr)
+            self._cache.put(addr, result)
+        else:
+            METRICS.incr("geoip.cache", tags=["status:hit"])
+
+        if result is not None:
+            # Callers get their own copy of the cached result.
+            result = dict(result)
+        return result
+
+    def lookup_region(self, addr):
+        """
+        Look up only the region code for the given IP address.
+
+        This skips building the full GeoIP record and the radius
+        calculations done by :meth:`lookup`, but returns the same
+        region code.
+
+        :param addr: IP address (e.g. '203.0.113.30')
+        :type addr: str
+
+        :returns: A two-letter region code or None.
+        :rtype: str
+        """
+        if self._cache is None:
+            return self._lookup_region(addr)
+
+        result = self._cache.get(addr, _MARKER)
+        if result is not _MARKER:
+            return result["region_code"] if result else None
+
+        # The region code is cached on its own, under a key which
+        # can't be mistaken for a full lookup result.
+        region_key = ("region", addr)
+        code = self._cache.get(region_key, _MARKER)
+        if code is _MARKER:
+            code = self._lookup_region(addr)
+            self._cache.put(region_key, code)
+        return code
+
+    def _lookup_region(self, addr):
+        try:
+            record = self._db_reader.get(addr)
+        except self.lookup_exceptions:
+            # The GeoIP database has no data for this IP or is broken.
+            record = None
+
+        if not record:
+            return None
+
+        code = (record.get("country") or {}).get("iso_code")
+        location = record.get("location") or {}
+        if not (location.get("latitude") and location.get("longitude") and code):
+            return None
+        return GEOIP_GENC_MAP.get(code, code).upper()
+
+    def _lookup(self, addr):
         try:
             record = self.city(addr)
         except self.lookup_exceptions:
@@ -566,6 +680,190 @@ class GeoIPWrapper(Reader):
         return (radius, region_radius)
 
 
+class GeoIPReloader(object):
+    """
+    A :class:`~ichnaea.geoip.GeoIPWrapper` which picks up a new version
+    of its database file without restarting the process.
+
+    At most every ``interval`` seconds a lookup checks whether the
+    database file has changed. If it has, a new
+    :class:`~ichnaea.geoip.GeoIPWrapper` with a fresh lookup cache is
+    opened and swapped in for all following lookups. Lookups still
+    running on the old database finish on it, and the old database is
+    closed once the last of them is done. If the new file can't be
+    opened, the old database stays in use until the file changes again.
+
+    The database file should be replaced by renaming a new file over
+    it, rather than overwritten in place, as open databases memory map
+    the file they were opened with.
+    """
+
+    def __init__(
+        self,
+        db,
+        filename,
+        mode=MODE_AUTO,
+        cache_size=0,
+        cache_ttl=0,
+        interval=300,
+        raven_client=None,
+    ):
+        """
+        :param db: The already opened database.
+        :type db: :class:`~ichnaea.geoip.GeoIPWrapper`
+        :param interval: Seconds between checks for a changed file.
+        """
+        self.filename = filename
+        self.mode = mode
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.interval = interval
+        self.raven_client = raven_client
+
+        self.reloads = 0
+        self.reloaded = None
+
+        self._lock = threading.Lock()
+        self._db = db
+        self._users = {}
+        self._retired = set()
+        self._reloading = False
+        self._stat = self._file_stat()
+        self._next_check = time.time() + interval
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def check_reload(self):
+        """
+        Swap in a new database if the database file has changed since
+        it was last opened.
+
+        :returns: True if a new database was swapped in.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._reloading:
+                return False
+            stat = self._file_stat()
+            if stat is None or stat == self._stat:
+                return False
+            self._reloading = True
+            self._stat = stat
+
+        try:
+            try:
+                db = GeoIPWrapper(
+                    self.filename,
+                    mode=self.mode,
+                    cache_size=self.cache_size,
+                    cache_ttl=self.cache_ttl,
+                )
+            except (InvalidDatabaseError, IOError, OSError, ValueError):
+                # Probably a partially written file, try again once
+                # the file changes again.
+                if self.raven_client is not None:
+                    self.raven_client.captureException()
+                METRICS.incr("geoip.reload", tags=["status:failure"])
+                return False
+
+            with self._lock:
+                old_db = self._db
+                self._db = db
+                self.reloads += 1
+                self.reloaded = datetime.datetime.utcnow().strftime(
+                    "%Y-%m-%dT%H:%M:%SZ"
+                )
+                if self._users.get(old_db):
+                    self._retired.add(old_db)
+                    old_db = None
+        finally:
+            with self._lock:
+                self._reloading = False
+
+        if old_db is not None:
+            old_db.close()
+        METRICS.incr("geoip.reload", tags=["status:success"])
+        LOGGER.info("GeoIP database reloaded, version %s.", db.version)
+        return True
+
+    def _acquire(self):
+        now = time.time()
+        if now >= self._next_check:
+            self._next_check = now + self.interval
+            self.check_reload()
+
+        with self._lock:
+            db = self._db
+            self._users[db] = self._users.get(db, 0) + 1
+        return db
+
+    def _release(self, db):
+        with self._lock:
+            self._users[db] -= 1
+            if self._users[db]:
+                return
+            del self._users[db]
+            if db not in self._retired:
+                return
+            self._retired.discard(db)
+        db.close()
+
+    def _call(self, name, *args):
+        db = self._acquire()
+        try:
+            return getattr(db, name)(*args)
+        finally:
+            self._release(db)
+
+    def lookup(self, addr):
+        """See :meth:`ichnaea.geoip.GeoIPWrapper.lookup`."""
+        return self._call("lookup", addr)
+
+    def lookup_region(self, addr):
+        """See :meth:`ichnaea.geoip.GeoIPWrapper.lookup_region`."""
+        return self._call("lookup_region", addr)
+
+    def ping(self):
+        """See :meth:`ichnaea.geoip.GeoIPWrapper.ping`."""
+        return self._call("ping")
+
+    @property
+    def age(self):
+        """See :attr:`ichnaea.geoip.GeoIPWrapper.age`."""
+        return self._db.age
+
+    @property
+    def version(self):
+        """See :attr:`ichnaea.geoip.GeoIPWrapper.version`."""
+        return self._db.version
+
+    def __getattr__(self, name):
+        # Everything else is looked up on the current database.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._db, name)
+
+    def close(self):
+        """Close the current and all retired databases."""
+        with self._lock:
+            dbs = [self._db] + list(self._retired)
+            self._retired.clear()
+            self._users.clear()
+        for db in dbs:
+            db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 class GeoIPNull(object):
     """
     A dummy implementation of the :class:`~ichnaea.geoip.GeoIPWrapper` API.
@@ -577,6 +875,12 @@ class GeoIPNull(object):
         """
         return None
 
+    def lookup_region(self, addr):
+        """
+        :returns: None
+        """
+        return None
+
     @property
     def age(self):
         """
@@ -13,6 +13,7 @@ class BlueShard(MacStationMixin):
 
     _shards = BLUE_SHARDS
     _valid_schema = ValidBlueShardSchema()
+    station_type = "blue"
 
 
 class BlueShard0(BlueShard, _Model):
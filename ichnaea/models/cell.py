@@ -531,6 +531,7 @@ class CellShard(StationMixin):
 
     _shards = CELL_SHARDS
     _valid_schema = ValidCellShardSchema()
+    station_type = "cell"
 
     cellid = Column(CellIdColumn(11))
     radio = Column(TinyIntEnum(Radio), nullable=False)
@@ -7,7 +7,7 @@ from sqlalchemy.dialects.mysql import INTEGER as Integer
 
 from ichnaea.models.base import _Model
 from ichnaea.models.sa_types import SetColumn
-from ichnaea.queue import DataQueue
+from ichnaea.queue import configure_queue
 
 
 class ExportConfig(_Model):
@@ -63,6 +63,6 @@ class ExportConfig(_Model):
         return "queue_export_" + self.name
 
     def queue(self, queue_key, redis_client):
-        return DataQueue(
+        return configure_queue(
             queue_key, redis_client, batch=self.batch, compress=False, json=True
         )
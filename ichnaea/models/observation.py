@@ -1,5 +1,6 @@
 import math
 import operator
+import struct
 
 import colander
 
@@ -7,10 +8,15 @@ from ichnaea.geocode import GEOCODER
 from ichnaea.models import Radio, ReportSource
 from ichnaea.models.base import CreationMixin, ValidationMixin
 from ichnaea.models.blue import BlueShard
-from ichnaea.models.cell import CellShard, encode_cellid, ValidCellKeySchema
+from ichnaea.models.cell import (
+    CellShard,
+    decode_cellid,
+    encode_cellid,
+    ValidCellKeySchema,
+)
 from ichnaea.models import constants
 from ichnaea.models.base import HashableDict
-from ichnaea.models.mac import channel_frequency, MacNode
+from ichnaea.models.mac import channel_frequency, decode_mac, encode_mac, MacNode
 from ichnaea.models.schema import (
     DefaultNode,
     ReportSourceNode,
@@ -19,6 +25,44 @@ from ichnaea.models.schema import (
 )
 from ichnaea.models.wifi import WifiShard
 
+# Struct formats of the observation fields in the binary encoding.
+BINARY_FORMATS = {
+    "accuracy": "d",
+    "age": "i",
+    "altitude": "d",
+    "altitude_accuracy": "d",
+    "asu": "h",
+    "channel": "H",
+    "frequency": "H",
+    "heading": "d",
+    "lat": "d",
+    "lon": "d",
+    "pressure": "d",
+    "psc": "h",
+    "signal": "h",
+    "snr": "h",
+    "source": "B",
+    "speed": "d",
+    "ta": "h",
+    "timestamp": "q",
+}
+
+
+def binary_layout(fields, key_fields, key_format):
+    """
+    Return the struct and the value fields of the fixed binary layout
+    of an observation: a bitmask of the value fields which are set,
+    the encoded station key and the values of all other fields.
+    """
+    fields = tuple(field for field in fields if field not in key_fields)
+    layout = ">I" + key_format + "".join(BINARY_FORMATS[field] for field in fields)
+    return (struct.Struct(layout), fields)
+
+
+def decode_mac_key(value):
+    """Decode the binary station key of a MAC based observation."""
+    return (decode_mac(value),)
+
 
 class BaseReport(HashableDict, CreationMixin, ValidationMixin):
     """A base class for reports."""
@@ -67,6 +111,43 @@ class BaseObservation(object):
     def to_json(self):
         return self._to_json_value()
 
+    # The binary encoding stores the station key fields as one value,
+    # encoded from the field values and decoded into a tuple of them.
+    _binary_key_fields = ()
+    _binary_key_encode = None
+    _binary_key_decode = None
+    _binary_struct = None
+    _binary_fields = ()
+
+    @classmethod
+    def from_binary(cls, data):
+        mask, key, *values = cls._binary_struct.unpack(data)
+        dct = dict(zip(cls._binary_key_fields, cls._binary_key_decode(key)))
+        for i, (field, value) in enumerate(zip(cls._binary_fields, values)):
+            dct[field] = value if mask & (1 << i) else None
+        if dct["source"] is not None:
+            dct["source"] = ReportSource(dct["source"])
+        # The values were validated before they were encoded, so
+        # skip the constructor and set all fields at once.
+        obs = cls.__new__(cls)
+        obs.__dict__.update(dct)
+        return obs
+
+    def to_binary(self):
+        mask = 0
+        values = []
+        for i, field in enumerate(self._binary_fields):
+            value = getattr(self, field, None)
+            if value is None:
+                value = 0
+            else:
+                mask |= 1 << i
+            values.append(value)
+        key = self._binary_key_encode(
+            *[getattr(self, field) for field in self._binary_key_fields]
+        )
+        return self._binary_struct.pack(mask, key, *values)
+
 
 class ValidReportSchema(colander.MappingSchema, ValidatorNode):
     """A schema which validates the fields present in a report."""
@@ -240,6 +321,10 @@ class BlueObservation(BlueReport, Report, BaseObservation):
 
     _valid_schema = ValidBlueObservationSchema()
     _fields = BlueReport._fields + Report._fields
+    _binary_key_fields = ("mac",)
+    _binary_key_encode = staticmethod(encode_mac)
+    _binary_key_decode = staticmethod(decode_mac_key)
+    _binary_struct, _binary_fields = binary_layout(_fields, _binary_key_fields, "6s")
 
     @property
     def weight(self):
@@ -400,6 +485,10 @@ class CellObservation(CellReport, Report, BaseObservation):
 
     _valid_schema = ValidCellObservationSchema()
     _fields = CellReport._fields + Report._fields
+    _binary_key_fields = ("radio", "mcc", "mnc", "lac", "cid")
+    _binary_key_encode = staticmethod(encode_cellid)
+    _binary_key_decode = staticmethod(decode_cellid)
+    _binary_struct, _binary_fields = binary_layout(_fields, _binary_key_fields, "11s")
 
     @classmethod
     def _from_json_value(cls, dct):
@@ -524,6 +613,10 @@ class WifiObservation(WifiReport, Report, BaseObservation):
 
     _valid_schema = ValidWifiObservationSchema()
     _fields = WifiReport._fields + Report._fields
+    _binary_key_fields = ("mac",)
+    _binary_key_encode = staticmethod(encode_mac)
+    _binary_key_decode = staticmethod(decode_mac_key)
+    _binary_struct, _binary_fields = binary_layout(_fields, _binary_key_fields, "6s")
 
     @property
     def weight(self):
@@ -131,6 +131,17 @@ class TestBlueObservation(BaseTest):
         assert result.source is ReportSource.gnss
         assert type(result.source) is ReportSource
 
+    def test_binary(self):
+        obs = BlueObservationFactory.build(
+            accuracy=None, signal=-45, source=ReportSource.gnss
+        )
+        result = BlueObservation.from_binary(obs.to_binary())
+        assert type(result) is BlueObservation
+        assert result == obs
+        assert result.accuracy is None
+        assert result.signal == -45
+        assert result.source is ReportSource.gnss
+
     def test_weight(self):
         obs_factory = BlueObservationFactory.build
         assert round(obs_factory(accuracy=None).weight, 2) == 1.0
@@ -234,6 +245,20 @@ class TestCellObservation(BaseTest):
         assert result.source is ReportSource.fixed
         assert type(result.source) is ReportSource
 
+    def test_binary(self):
+        obs = CellObservationFactory.build(
+            radio=Radio.gsm, accuracy=None, psc=5, ta=2, source=ReportSource.fixed
+        )
+        result = CellObservation.from_binary(obs.to_binary())
+        assert type(result) is CellObservation
+        assert result == obs
+        assert result.accuracy is None
+        assert type(result.radio) is Radio
+        assert result.cellid == obs.cellid
+        assert result.psc == 5
+        assert result.ta == 2
+        assert result.source is ReportSource.fixed
+
     def test_weight(self):
         obs_factory = CellObservationFactory.build
 
@@ -487,6 +512,27 @@ class TestWifiObservation(BaseTest):
         assert result.source == ReportSource.query
         assert type(result.source) is ReportSource
 
+    def test_binary(self):
+        obs = WifiObservationFactory.build(
+            accuracy=None,
+            altitude=-10.5,
+            channel=11,
+            frequency=2462,
+            signal=-80,
+            source=ReportSource.query,
+            timestamp=1405602028568,
+        )
+        data = obs.to_binary()
+        assert len(data) < len(json.dumps(obs.to_json()))
+        result = WifiObservation.from_binary(data)
+        assert type(result) is WifiObservation
+        assert result == obs
+        assert hash(result) == hash(obs)
+        assert result.accuracy is None
+        assert result.altitude == -10.5
+        assert result.source is ReportSource.query
+        assert result.weight == obs.weight
+
     def test_weight(self):
         obs_factory = WifiObservationFactory.build
         assert round(obs_factory(accuracy=None, signal=-80).weight, 2) == 1.0
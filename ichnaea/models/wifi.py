@@ -13,6 +13,7 @@ class WifiShard(MacStationMixin):
 
     _shards = WIFI_SHARDS
     _valid_schema = ValidWifiShardSchema()
+    station_type = "wifi"
 
 
 class WifiShard0(WifiShard, _Model):
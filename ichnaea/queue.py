@@ -2,11 +2,442 @@
 Functionality related to custom Redis based queues.
 """
 
+from contextlib import contextmanager
 import json
+import os
+import socket
+import struct
+import time
+import uuid
+import zlib
+
+from redis.exceptions import ResponseError
 
 from ichnaea.cache import redis_pipeline
+from ichnaea.conf import settings
 from ichnaea import util
 
+# A frame starts with a fixed header, holding a magic marker, the format
+# version, flags and the number of items in the frame. The marker can't
+# be the start of a gzip stream or of UTF-8 encoded JSON, so frames can
+# be told apart from the individually encoded items written by earlier
+# versions of the queue.
+FRAME_MAGIC = b"\xffIQ"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct(">3sBBI")
+FRAME_COMPRESSED = 1
+FRAME_ITEM = struct.Struct(">I")
+
+# Preset dictionary for the compression of frames. It primes zlib with
+# the field names of typical incoming reports, which matters most for
+# frames holding only a handful of items. Any change to it requires a
+# new FRAME_VERSION, as readers need the exact same dictionary.
+FRAME_DICTIONARY = (
+    b'"bluetoothBeacons": [{"macAddress": "", "name": "", "age": '
+    b'"cellTowers": [{"radioType": "gsm", "radioType": "wcdma", '
+    b'"radioType": "lte", "mobileCountryCode": , "mobileNetworkCode": '
+    b'"locationAreaCode": , "cellId": , "primaryScramblingCode": , '
+    b'"asu": , "serving": 1, "timingAdvance": , "signalStrength": -'
+    b'"position": {"accuracy": , "altitude": , "altitudeAccuracy": , '
+    b'"heading": , "pressure": , "speed": , "source": "fused"}, '
+    b'"source": "query", "source": "gnss", '
+    b'"latitude": , "longitude": , "timestamp": 1, '
+    b'"wifiAccessPoints": [{"macAddress": "", "ssid": "", "channel": , '
+    b'"frequency": 24, "frequency": 5, "signalToNoiseRatio": , "age": , '
+    b'"signalStrength": -}, {"macAddress": "'
+    b'{"api_key": null, "api_key": "", "report": {'
+)
+
+
+# Lua function returning the number of items in a queue element, read
+# from the frame header, given the FRAME_MAGIC marker.
+FRAME_SIZE_FUNCTION = """
+local function frame_size(element, magic)
+    if string.sub(element, 1, 3) == magic then
+        local b1, b2, b3, b4 = string.byte(element, 6, 9)
+        return ((b1 * 256 + b2) * 256 + b3) * 256 + b4
+    end
+    return 1
+end
+"""
+
+# Lua functions returning the number of items of a list queue, in the
+# list and in the batches put back by requeue_expired, and the TTL of the
+# queue, which is that of the requeued batches once the list is gone.
+QUEUE_STATUS_FUNCTIONS = """
+local function queue_size(key, count_key, retry_key)
+    local size = redis.call("LLEN", key)
+    size = math.max(size, tonumber(redis.call("GET", count_key)) or 0)
+    for _, count in ipairs(redis.call("HVALS", retry_key)) do
+        size = size + tonumber(count)
+    end
+    return size
+end
+
+local function queue_ttl(key, retry_key)
+    local ttl = redis.call("TTL", key)
+    if ttl == -2 then
+        ttl = redis.call("TTL", retry_key)
+    end
+    return ttl
+end
+"""
+
+# Dequeue a batch of items and return them with the remaining size, the
+# TTL of the queue and the token of the batch. For a framed queue whole
+# frames are taken until the batch size is reached and the item counter
+# is updated.
+#
+# A batch put back by requeue_expired is taken first, as a whole. Given
+# a token, the batch is taken as an in-flight batch: the taken elements
+# are copied to the in-flight list of the token and the batch is added
+# to the sorted set of in-flight batches, with its deadline as the score.
+# A requeued batch keeps its own token and in-flight list instead.
+DEQUEUE_SCRIPT = (
+    FRAME_SIZE_FUNCTION
+    + QUEUE_STATUS_FUNCTIONS
+    + """
+local token = ARGV[6]
+local retried = redis.call("HKEYS", KEYS[3])
+if #retried > 0 then
+    local batch_key = KEYS[4] .. ":" .. retried[1]
+    local elements = redis.call("LRANGE", batch_key, 0, -1)
+    redis.call("HDEL", KEYS[3], retried[1])
+    if token ~= "" then
+        token = retried[1]
+        redis.call("ZADD", KEYS[4], ARGV[5], token)
+        redis.call("EXPIRE", KEYS[4], ARGV[4])
+        redis.call("EXPIRE", batch_key, ARGV[4])
+    else
+        redis.call("DEL", batch_key)
+        redis.call("HDEL", KEYS[5], retried[1])
+    end
+    return {
+        elements,
+        queue_size(KEYS[1], KEYS[2], KEYS[3]),
+        queue_ttl(KEYS[1], KEYS[3]),
+        token,
+    }
+end
+
+local batch = tonumber(ARGV[1])
+local framed = ARGV[2] == "1"
+local stop = batch - 1
+if batch == 0 then
+    stop = -1
+end
+local elements = redis.call("LRANGE", KEYS[1], 0, stop)
+local taken = #elements
+local count = taken
+if framed then
+    count = 0
+    taken = 0
+    for _, element in ipairs(elements) do
+        if batch > 0 and count >= batch then
+            break
+        end
+        count = count + frame_size(element, ARGV[3])
+        taken = taken + 1
+    end
+    for i = #elements, taken + 1, -1 do
+        elements[i] = nil
+    end
+end
+local size = redis.call("LLEN", KEYS[1]) - taken
+if size > 0 then
+    redis.call("LTRIM", KEYS[1], taken, -1)
+else
+    redis.call("DEL", KEYS[1])
+end
+if framed then
+    if size > 0 then
+        redis.call("DECRBY", KEYS[2], count)
+    else
+        redis.call("DEL", KEYS[2])
+    end
+end
+if token ~= "" and taken > 0 then
+    for i = 1, taken, 1000 do
+        redis.call("RPUSH", KEYS[6], unpack(elements, i, math.min(i + 999, taken)))
+    end
+    redis.call("EXPIRE", KEYS[6], ARGV[4])
+    redis.call("ZADD", KEYS[4], ARGV[5], token)
+    redis.call("EXPIRE", KEYS[4], ARGV[4])
+end
+return {
+    elements,
+    queue_size(KEYS[1], KEYS[2], KEYS[3]),
+    queue_ttl(KEYS[1], KEYS[3]),
+    token,
+}
+"""
+)
+
+# Put an in-flight batch back into the queue, unless it was acknowledged
+# in the meantime, and count its failed attempt. The batch keeps its token
+# and in-flight list and is recorded with its number of items in the hash
+# of requeued batches, which are taken first by the next dequeue. A batch
+# which failed the maximum number of attempts is moved to the dead-letter
+# list instead, as a whole. Return the number of requeued and of
+# dead-lettered items.
+REQUEUE_SCRIPT = (
+    FRAME_SIZE_FUNCTION
+    + """
+if redis.call("ZREM", KEYS[1], ARGV[1]) == 0 then
+    return {0, 0}
+end
+local elements = redis.call("LRANGE", KEYS[2], 0, -1)
+local count = 0
+for _, element in ipairs(elements) do
+    count = count + frame_size(element, ARGV[2])
+end
+if count == 0 then
+    redis.call("HDEL", KEYS[3], ARGV[1])
+    return {0, 0}
+end
+if redis.call("HINCRBY", KEYS[3], ARGV[1], 1) >= tonumber(ARGV[4]) then
+    for i = 1, #elements, 1000 do
+        redis.call("RPUSH", KEYS[4], unpack(elements, i, math.min(i + 999, #elements)))
+    end
+    redis.call("EXPIRE", KEYS[4], ARGV[5])
+    redis.call("DEL", KEYS[2])
+    redis.call("HDEL", KEYS[3], ARGV[1])
+    return {0, count}
+end
+redis.call("HSET", KEYS[5], ARGV[1], count)
+redis.call("EXPIRE", KEYS[5], ARGV[3])
+redis.call("EXPIRE", KEYS[3], ARGV[3])
+redis.call("EXPIRE", KEYS[2], ARGV[3])
+return {count, 0}
+"""
+)
+
+# Lua function returning the number of entries in a stream, which
+# weren't yet delivered to the consumer group.
+STREAM_SIZE_FUNCTION = """
+local function stream_size(key, group)
+    if redis.call("EXISTS", key) == 0 then
+        return 0
+    end
+    local size = redis.call("XLEN", key)
+    local ok, pending = pcall(redis.call, "XPENDING", key, group)
+    if ok then
+        size = size - pending[1]
+    end
+    return math.max(size, 0)
+end
+"""
+
+# Return the size and the TTL of each of the queues, given the triples
+# of their list, item counter and requeued batches keys. For stream
+# queues the consumer group is given as the argument at the position
+# of the triple.
+STATUS_SCRIPT = (
+    STREAM_SIZE_FUNCTION
+    + QUEUE_STATUS_FUNCTIONS
+    + """
+local result = {}
+for i = 1, #KEYS, 3 do
+    local group = ARGV[(i + 2) / 3]
+    if group ~= "" then
+        result[#result + 1] = stream_size(KEYS[i], group)
+        result[#result + 1] = redis.call("TTL", KEYS[i])
+    else
+        result[#result + 1] = queue_size(KEYS[i], KEYS[i + 1], KEYS[i + 2])
+        result[#result + 1] = queue_ttl(KEYS[i], KEYS[i + 2])
+    end
+end
+return result
+"""
+)
+
+# Add the items to a stream, trimming it to about the maximum length,
+# and refresh its TTL. The number of entries dropped by the trimming is
+# added to the trimmed counter.
+STREAM_ENQUEUE_SCRIPT = """
+local maxlen = tonumber(ARGV[1])
+local before = redis.call("XLEN", KEYS[1])
+for i = 3, #ARGV do
+    if maxlen > 0 then
+        redis.call("XADD", KEYS[1], "MAXLEN", "~", maxlen, "*", "d", ARGV[i])
+    else
+        redis.call("XADD", KEYS[1], "*", "d", ARGV[i])
+    end
+end
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+local trimmed = before + #ARGV - 2 - redis.call("XLEN", KEYS[1])
+if trimmed > 0 then
+    redis.call("INCRBY", KEYS[2], trimmed)
+    redis.call("EXPIRE", KEYS[2], ARGV[2])
+end
+return trimmed
+"""
+
+# Add the entries, which were pending in the consumer group for at
+# least the given idle time, to the end of the stream again. The number
+# of failed attempts is kept in the "a" field of the entry. Entries which
+# failed the maximum number of attempts are moved to the dead-letter list
+# instead. Return the number of requeued and of dead-lettered entries.
+# Entries dropped by trimming the stream are added to the trimmed counter.
+# Up to 10000 pending entries are looked at per call.
+STREAM_REQUEUE_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return {0, 0}
+end
+local ok, pending = pcall(redis.call, "XPENDING", KEYS[1], ARGV[1], "-", "+", 10000)
+if not ok then
+    return {0, 0}
+end
+local min_idle = tonumber(ARGV[3])
+local max_attempts = tonumber(ARGV[6])
+local length = redis.call("XLEN", KEYS[1])
+local count = 0
+local dead = 0
+for _, info in ipairs(pending) do
+    if info[3] >= min_idle then
+        local claimed = redis.call("XCLAIM", KEYS[1], ARGV[1], ARGV[2], 0, info[1])
+        -- entries trimmed from the stream can't be claimed anymore
+        if claimed[1] then
+            local fields = claimed[1][2]
+            local value = fields[2]
+            local attempts = 1
+            for i = 1, #fields, 2 do
+                if fields[i] == "a" then
+                    attempts = tonumber(fields[i + 1]) + 1
+                end
+            end
+            if attempts >= max_attempts then
+                redis.call("RPUSH", KEYS[2], value)
+                redis.call("EXPIRE", KEYS[2], ARGV[7])
+                dead = dead + 1
+            elseif tonumber(ARGV[4]) > 0 then
+                redis.call("XADD", KEYS[1], "MAXLEN", "~", ARGV[4], "*",
+                           "d", value, "a", attempts)
+                count = count + 1
+            else
+                redis.call("XADD", KEYS[1], "*", "d", value, "a", attempts)
+                count = count + 1
+            end
+        end
+        redis.call("XACK", KEYS[1], ARGV[1], info[1])
+        length = length - redis.call("XDEL", KEYS[1], info[1])
+    end
+end
+if count > 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[5])
+    local trimmed = length + count - redis.call("XLEN", KEYS[1])
+    if trimmed > 0 then
+        redis.call("INCRBY", KEYS[3], trimmed)
+        redis.call("EXPIRE", KEYS[3], ARGV[5])
+    end
+end
+return {count, dead}
+"""
+
+
+def encode_frame(items, compress=True):
+    """
+    Pack a list of byte strings into a single length-prefixed frame,
+    optionally compressing the frame as a whole.
+    """
+    payload = b"".join(FRAME_ITEM.pack(len(item)) + item for item in items)
+    flags = 0
+    if compress:
+        compressor = zlib.compressobj(zdict=FRAME_DICTIONARY)
+        payload = compressor.compress(payload) + compressor.flush()
+        flags |= FRAME_COMPRESSED
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, len(items))
+    return header + payload
+
+
+def decode_frame(data):
+    """
+    Return the list of byte strings packed into a frame.
+    """
+    magic, version, flags, count = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("Unsupported frame version: %r" % data[:4])
+
+    payload = data[FRAME_HEADER.size :]
+    if flags & FRAME_COMPRESSED:
+        decompressor = zlib.decompressobj(zdict=FRAME_DICTIONARY)
+        payload = decompressor.decompress(payload) + decompressor.flush()
+
+    items = []
+    offset = 0
+    for _ in range(count):
+        (length,) = FRAME_ITEM.unpack_from(payload, offset)
+        offset += FRAME_ITEM.size
+        items.append(payload[offset : offset + length])
+        offset += length
+    return items
+
+
+def is_frame(data):
+    """Return True if the queue element is a frame of several items."""
+    return data[: len(FRAME_MAGIC)] == FRAME_MAGIC
+
+
+def frame_size(data):
+    """Return the number of items in a queue element."""
+    if is_frame(data):
+        return FRAME_HEADER.unpack_from(data)[3]
+    return 1
+
+
+def configure_queue(key, redis_client, backend=None, **kw):
+    """
+    Configure and return a data queue, either a
+    :class:`~ichnaea.queue.DataQueue` or a
+    :class:`~ichnaea.queue.StreamQueue` depending on the backend.
+
+    :param backend: One of ``list`` or ``stream``, defaults to the
+                    ``queue_backend`` setting.
+    """
+    if backend is None:
+        backend = settings("queue_backend")
+    if backend == "stream":
+        return StreamQueue(
+            key, redis_client, maxlen=settings("queue_stream_maxlen"), **kw
+        )
+    return DataQueue(key, redis_client, **kw)
+
+
+def queue_status(redis_client, queues):
+    """
+    Returns a list of tuples of the size and the age of each of the
+    queues, which can be lists or streams. All queues are checked in
+    a single call to Redis.
+    """
+    if not queues:
+        return []
+
+    keys = []
+    args = []
+    for queue in queues:
+        keys.extend([queue.key, queue.count_key, queue.retry_key])
+        args.append(queue.group or "")
+    script = redis_client.register_script(STATUS_SCRIPT)
+    result = script(keys=keys, args=args)
+
+    return [
+        (result[2 * i], queue._age(result[2 * i + 1])) for i, queue in enumerate(queues)
+    ]
+
+
+def ready_many(redis_client, queues, batch=None):
+    """
+    Returns a list telling for each of the queues if it is ready for
+    processing, see :meth:`DataQueue.ready`. All queues are checked
+    in a single call to Redis.
+
+    :param batch: The batch size, defaults to that of each queue.
+    """
+    return [
+        queue.is_ready(size, age, batch=batch)
+        for queue, (size, age) in zip(queues, queue_status(redis_client, queues))
+    ]
+
 
 class DataQueue(object):
     """
@@ -15,45 +446,206 @@ class DataQueue(object):
 
     The lists maintain a TTL value corresponding to the time data has
     been last put into the queue.
+
+    A framed queue packs all the items of one push into a single frame
+    and list element, compressed as a whole. It keeps the number of
+    items in a separate counter key, so the batch sizes still refer
+    to items. Elements holding a single item, as written by a queue
+    without framing, can still be read from a framed queue.
+
+    A reliable queue keeps the batches taken by :meth:`consume` in
+    in-flight lists, until they are acknowledged. Batches which aren't
+    acknowledged in time, for example because the worker died, are put
+    back into the queue by :meth:`requeue_expired`. They keep their token,
+    are taken again as a whole before any other items, and count their
+    failed attempts. A batch which wasn't acknowledged in ``max_attempts``
+    attempts is moved to a dead-letter list instead, so it doesn't block
+    the queue forever. This dead-letters all items of the batch, not only
+    the one which made it fail.
     """
 
     queue_ttl = 86400  # Maximum TTL value for the Redis list.
     queue_max_age = 3600  # Maximum age that data can sit in the queue.
+    inflight_timeout = 600  # Maximum time to acknowledge a batch.
+    max_attempts = 5  # Maximum attempts before an item is dead-lettered.
+    deadletter_ttl = 7 * 86400  # Time to keep dead-lettered items.
+    group = None  # Consumer group of stream based queues.
 
-    def __init__(self, key, redis_client, batch=0, compress=False, json=True):
+    def __init__(
+        self,
+        key,
+        redis_client,
+        batch=0,
+        compress=False,
+        json=True,
+        framed=False,
+        reliable=False,
+    ):
         self.key = key
         self.redis_client = redis_client
         self.batch = batch
         self.compress = compress
         self.json = json
+        self.framed = framed
+        self.reliable = reliable
+        self.count_key = "count:" + key
+        self.inflight_key = "inflight:" + key
+        self.retry_key = "retry:" + key
+        self.attempts_key = "attempts:" + key
+        self.deadletter_key = "deadletter:" + key
 
-    def dequeue(self, batch=None):
+    def _inflight_batch_key(self, token):
+        return "%s:%s" % (self.inflight_key, token)
+
+    def _decode(self, elements):
+        result = []
+        for element in elements:
+            if is_frame(element):
+                result.extend(decode_frame(element))
+            elif self.compress:
+                result.append(util.decode_gzip(element))
+            else:
+                result.append(element)
+
+        if self.json:
+            result = [json.loads(item.decode("utf-8")) for item in result]
+        return result
+
+    def _age(self, ttl):
+        if ttl < 0:
+            return -1
+        return max(self.queue_ttl - ttl, 0)
+
+    def is_ready(self, size, age, batch=None):
         """
-        Get batch number of items from the queue.
+        Returns True if the given queue size and age make the queue
+        ready for processing, see :meth:`ready`.
         """
         if batch is None:
             batch = self.batch
+        return bool(size > 0 and (size >= batch or age >= self.queue_max_age))
+
+    def dequeue_status(self, batch=None):
+        """
+        Get batch number of items from the queue, together with the
+        remaining size and the age of the queue, in a single atomic call.
 
+        A framed queue returns whole frames, so it can return a
+        couple more items than the batch size.
+
+        :returns: A tuple of the list of items, the size and the age.
+        """
+        return self._dequeue(batch)[:3]
+
+    def _dequeue(self, batch, token=None):
+        if batch is None:
+            batch = self.batch
+
+        keys = [
+            self.key,
+            self.count_key,
+            self.retry_key,
+            self.inflight_key,
+            self.attempts_key,
+        ]
+        deadline = int(time.time()) + self.inflight_timeout
+        args = [batch, int(self.framed), FRAME_MAGIC, self.queue_ttl, deadline, ""]
+        if token is not None:
+            keys.append(self._inflight_batch_key(token))
+            args[-1] = token
+
+        script = self.redis_client.register_script(DEQUEUE_SCRIPT)
+        elements, size, ttl, token = script(keys=keys, args=args)
+        return (self._decode(elements), size, self._age(ttl), token.decode("ascii"))
+
+    @contextmanager
+    def consume(self, batch=None):
+        """
+        Get batch number of items from the queue and yield a tuple of
+        the items, the remaining size and the age of the queue, like
+        :meth:`dequeue_status`.
+
+        For a reliable queue the items are acknowledged, once the block
+        finished without an exception. Otherwise they are put back into
+        the queue after the ``inflight_timeout``, as a batch of their own.
+        """
+        token = uuid.uuid4().hex if self.reliable else None
+        items, size, age, token = self._dequeue(batch, token=token)
+        yield (items, size, age)
+        if self.reliable and items:
+            self.ack(token)
+
+    def ack(self, token):
+        """Acknowledge an in-flight batch, given its token."""
         with self.redis_client.pipeline() as pipe:
-            pipe.multi()
-            pipe.lrange(self.key, 0, batch - 1)
-            if batch != 0:
-                pipe.ltrim(self.key, batch, -1)
-            else:
-                # special case for deleting everything
-                pipe.ltrim(self.key, 1, 0)
-            result = pipe.execute()[0]
+            pipe.zrem(self.inflight_key, token)
+            pipe.delete(self._inflight_batch_key(token))
+            pipe.hdel(self.attempts_key, token)
+            pipe.execute()
 
-            if self.compress:
-                result = [util.decode_gzip(item) for item in result]
-            if self.json:
-                result = [json.loads(item.decode("utf-8")) for item in result]
+    def requeue_expired(self, now=None):
+        """
+        Put all in-flight batches, which weren't acknowledged in time,
+        back into the queue, to be taken again first. Batches which failed
+        ``max_attempts`` times are moved to the dead-letter list instead.
 
-        return result
+        :returns: A tuple of the number of requeued and of dead-lettered
+                  items.
+        """
+        if now is None:
+            now = time.time()
+        tokens = self.redis_client.zrangebyscore(self.inflight_key, "-inf", now)
+
+        script = self.redis_client.register_script(REQUEUE_SCRIPT)
+        count = dead = 0
+        for token in tokens:
+            token = token.decode("ascii")
+            requeued, deadlettered = script(
+                keys=[
+                    self.inflight_key,
+                    self._inflight_batch_key(token),
+                    self.attempts_key,
+                    self.deadletter_key,
+                    self.retry_key,
+                ],
+                args=[
+                    token,
+                    FRAME_MAGIC,
+                    self.queue_ttl,
+                    self.max_attempts,
+                    self.deadletter_ttl,
+                ],
+            )
+            count += requeued
+            dead += deadlettered
+        return (count, dead)
+
+    def dequeue(self, batch=None):
+        """
+        Get batch number of items from the queue.
+        """
+        return self.dequeue_status(batch=batch)[0]
+
+    def trimmed(self):
+        """
+        Return the number of items dropped by trimming the queue, since
+        the last call. Lists are never trimmed.
+        """
+        return 0
 
     def _push(self, pipe, items, batch):
-        for i in range(0, len(items), batch):
-            pipe.rpush(self.key, *items[i : i + batch])
+        if self.framed:
+            if items:
+                frames = [
+                    encode_frame(items[i : i + batch], compress=self.compress)
+                    for i in range(0, len(items), batch)
+                ]
+                pipe.rpush(self.key, *frames)
+                pipe.incrby(self.count_key, len(items))
+                pipe.expire(self.count_key, self.queue_ttl)
+        else:
+            for i in range(0, len(items), batch):
+                pipe.rpush(self.key, *items[i : i + batch])
 
         # expire key after it was created by rpush
         pipe.expire(self.key, self.queue_ttl)
@@ -64,6 +656,7 @@ class DataQueue(object):
 
         The items will be pushed into Redis as part of a single (given)
         pipe in batches corresponding to the given batch argument.
+        A framed queue packs each of these batches into one frame.
         """
         if batch is None:
             batch = self.batch
@@ -74,7 +667,7 @@ class DataQueue(object):
         if self.json:
             items = [json.dumps(item).encode("utf-8") for item in items]
 
-        if self.compress:
+        if self.compress and not self.framed:
             items = [util.encode_gzip(item) for item in items]
 
         if pipe is not None:
@@ -89,19 +682,205 @@ class DataQueue(object):
         batch number of items in it, or if the last time it has seen
         new data was more than an hour ago (queue_max_age).
         """
+        return ready_many(self.redis_client, [self], batch=batch)[0]
+
+    def size(self):
+        """Return the size of the queue."""
+        # Items written without framing aren't counted, but each
+        # element holds at least one item.
+        return queue_status(self.redis_client, [self])[0][0]
+
+
+class StreamQueue(DataQueue):
+    """
+    A Redis based queue like :class:`DataQueue`, which stores the items
+    as entries of a Redis stream and reads them via a consumer group.
+    It requires Redis 5.0 or later.
+
+    Every worker reads as a consumer of its own, so several workers can
+    take batches from the same queue at the same time. Each item is a
+    separate entry. A framed queue packs each item into a frame of its
+    own, which is still compressed with the preset dictionary. The stream
+    is trimmed to about ``maxlen`` items, dropping the oldest ones, so a
+    backlog can't exhaust the memory of Redis. The dropped items are
+    counted, see :meth:`trimmed`.
+
+    The consumer group is created when the queue is first read from, and
+    again after the stream expired. The stream is read from outside of
+    Lua scripts, as Redis 5 doesn't allow XREADGROUP in them.
+
+    A reliable queue leaves the entries taken by :meth:`consume` pending
+    in the consumer group, until they are acknowledged. Entries which
+    were pending for longer than the ``inflight_timeout`` are added to
+    the end of the stream again by :meth:`requeue_expired`.
+    """
+
+    group = "ichnaea"
+
+    def __init__(self, key, redis_client, maxlen=0, **kw):
+        super(StreamQueue, self).__init__(key, redis_client, **kw)
+        self.maxlen = maxlen
+        self.trimmed_key = "trimmed:" + key
+
+    @property
+    def consumer(self):
+        # Worker processes are forked, so determine the name on each use.
+        return "%s:%s" % (socket.gethostname(), os.getpid())
+
+    def _read(self, batch, ack):
         if batch is None:
             batch = self.batch
 
+        try:
+            result = self._read_group(batch, ack)
+        except ResponseError as exc:
+            if "NOGROUP" not in str(exc) and self.redis_client.exists(self.key):
+                raise
+            # The consumer group is created on first use and again
+            # after the stream expired.
+            result = self._read_group(batch, ack) if self._create_group() else []
+
+        ids = []
+        elements = []
+        if result:
+            for entry_id, fields in result[0][1]:
+                ids.append(entry_id)
+                elements.append(fields[b"d"])
+
+        script = self.redis_client.register_script(STATUS_SCRIPT)
         with self.redis_client.pipeline() as pipe:
-            pipe.ttl(self.key)
-            pipe.llen(self.key)
-            ttl, size = pipe.execute()
-        if ttl < 0:
-            age = -1
-        else:
-            age = max(self.queue_ttl - ttl, 0)
-        return bool(size > 0 and (size >= batch or age >= self.queue_max_age))
+            if ack and ids:
+                # The entries were read without adding them to the
+                # pending entries, so they only need to be deleted.
+                pipe.xdel(self.key, *ids)
+            script(
+                keys=[self.key, self.count_key, self.retry_key],
+                args=[self.group],
+                client=pipe,
+            )
+            size, ttl = pipe.execute()[-1]
+        return (self._decode(elements), ids, size, self._age(ttl))
+
+    def _read_group(self, batch, ack):
+        return self.redis_client.xreadgroup(
+            self.group, self.consumer, {self.key: ">"}, count=batch or None, noack=ack,
+        )
+
+    def _create_group(self):
+        """
+        Create the consumer group, unless it exists already.
+
+        :returns: False if the stream doesn't exist.
+        """
+        try:
+            self.redis_client.xgroup_create(self.key, self.group, id="0")
+        except ResponseError as exc:
+            if "BUSYGROUP" in str(exc):
+                return True
+            if not self.redis_client.exists(self.key):
+                return False
+            raise
+        return True
+
+    def dequeue_status(self, batch=None):
+        """
+        Get batch number of items from the queue, together with the
+        remaining size and the age of the queue.
+
+        :returns: A tuple of the list of items, the size and the age.
+        """
+        items, _, size, age = self._read(batch, ack=True)
+        return (items, size, age)
+
+    @contextmanager
+    def consume(self, batch=None):
+        """
+        Get batch number of items from the queue and yield a tuple of
+        the items, the remaining size and the age of the queue, like
+        :meth:`dequeue_status`.
+
+        For a reliable queue the items are acknowledged, once the block
+        finished without an exception. Otherwise they are added to the
+        queue again after the ``inflight_timeout``.
+        """
+        items, ids, size, age = self._read(batch, ack=not self.reliable)
+        yield (items, size, age)
+        if self.reliable and ids:
+            self.ack(ids)
+
+    def ack(self, ids):
+        """Acknowledge and delete pending entries, given their ids."""
+        with self.redis_client.pipeline() as pipe:
+            pipe.xack(self.key, self.group, *ids)
+            pipe.xdel(self.key, *ids)
+            pipe.execute()
+
+    def requeue_expired(self, now=None):
+        """
+        Add the items, which were pending for longer than the
+        ``inflight_timeout``, to the end of the queue again. Items which
+        failed ``max_attempts`` times are moved to the dead-letter list
+        instead.
+
+        :returns: A tuple of the number of requeued and of dead-lettered
+                  items.
+        """
+        min_idle = self.inflight_timeout
+        if now is not None:
+            min_idle -= now - time.time()
+
+        min_idle = int(max(min_idle, 0) * 1000)
+
+        script = self.redis_client.register_script(STREAM_REQUEUE_SCRIPT)
+        count, dead = script(
+            keys=[self.key, self.deadletter_key, self.trimmed_key],
+            args=[
+                self.group,
+                self.consumer,
+                min_idle,
+                self.maxlen,
+                self.queue_ttl,
+                self.max_attempts,
+                self.deadletter_ttl,
+            ],
+        )
+
+        # Forget consumers without pending entries, which were idle
+        # for as long, like those of worker processes which are gone.
+        try:
+            consumers = self.redis_client.xinfo_consumers(self.key, self.group)
+        except ResponseError:
+            # The stream or the consumer group doesn't exist.
+            return (count, dead)
+        for consumer in consumers:
+            if consumer["pending"] == 0 and consumer["idle"] >= min_idle:
+                self.redis_client.xgroup_delconsumer(
+                    self.key, self.group, consumer["name"]
+                )
+        return (count, dead)
+
+    def _push(self, pipe, items, batch):
+        if self.framed:
+            items = [encode_frame([item], compress=self.compress) for item in items]
+        if items:
+            script = self.redis_client.register_script(STREAM_ENQUEUE_SCRIPT)
+            script(
+                keys=[self.key, self.trimmed_key],
+                args=[self.maxlen, self.queue_ttl] + items,
+                client=pipe,
+            )
+
+    def trimmed(self):
+        """
+        Return the number of items dropped by trimming the stream, since
+        the last call, and reset the count.
+        """
+        with self.redis_client.pipeline() as pipe:
+            pipe.get(self.trimmed_key)
+            pipe.delete(self.trimmed_key)
+            count, _ = pipe.execute()
+        return int(count or 0)
 
     def size(self):
-        """Return the size of the queue."""
-        return self.redis_client.llen(self.key)
+        """Return the number of items not yet taken from the queue."""
+        return queue_status(self.redis_client, [self])[0][0]
@@ -0,0 +1,1011 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of performance sensitive code paths.
+"""
+
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+import json
+import platform
+import random
+import time
+import timeit
+from urllib.parse import urlparse
+
+import click
+from sqlalchemy import event
+
+from ichnaea.api.key import Key
+from ichnaea.api.locate.cell import CellStation
+from ichnaea.api.locate.constants import (
+    MAX_WIFI_CLUSTER_METERS,
+    MAX_WIFIS_IN_CLUSTER,
+    WIFI_MAX_ACCURACY,
+    WIFI_MIN_ACCURACY,
+)
+from ichnaea.api.locate.mac import (
+    aggregate_cluster_position,
+    cluster_networks,
+    MacStation,
+    query_macs,
+)
+from ichnaea.api.locate.query import Query
+from ichnaea.api.locate.result import Position
+from ichnaea.api.locate.schema_v1 import LOCATE_V1_SCHEMA
+from ichnaea.api.locate.score import station_array, station_score, station_scores
+from ichnaea.api.locate.searcher import PositionSearcher
+from ichnaea.api.locate.shardquery import ShardQuery
+from ichnaea.api.locate.stationcache import StationCache
+from ichnaea.cache import configure_redis, redis_pipeline
+from ichnaea.conf import settings
+from ichnaea.data.export import IncomingQueue, InternalExporter, InternalTransform
+from ichnaea.data.station import BlueUpdater, CellUpdater, WifiUpdater
+from ichnaea.db import configure_db, db_worker_session
+from ichnaea.geocode import Geocoder
+from ichnaea.geoip import GeoIPNull
+from ichnaea.log import configure_raven
+from ichnaea.models import (
+    BlueShard,
+    CellShard,
+    encode_cellid,
+    encode_mac,
+    ExportConfig,
+    Radio,
+    WifiShard,
+)
+from ichnaea.models.constants import MIN_WIFI_SIGNAL
+from ichnaea.queue import decode_frame, encode_frame
+from ichnaea.taskapp.config import configure_data
+from ichnaea import util
+
+Station = namedtuple(
+    "Station", "lat lon radius samples created modified last_seen block_last"
+)
+
+
+def random_stations(count, now):
+    """Return a list of stations with random dates and samples."""
+    stations = []
+    for _ in range(count):
+        modified = now - timedelta(days=random.uniform(0, 400))
+        created = modified - timedelta(days=random.uniform(0, 400))
+        last_seen = None
+        if random.random() < 0.5:
+            last_seen = (modified + timedelta(days=random.uniform(0, 10))).date()
+        stations.append(
+            Station(
+                lat=random.uniform(-80.0, 80.0),
+                lon=random.uniform(-170.0, 170.0),
+                radius=random.choice([None, 0, 10, 250]),
+                samples=random.randint(1, 2000),
+                created=created,
+                modified=modified,
+                last_seen=last_seen,
+                block_last=None,
+            )
+        )
+    return stations
+
+
+def best_time(func, repeat, number):
+    """Return the best time of a single call to func, in microseconds."""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1e6
+
+
+def bench_score(sizes=(10, 100, 1000), repeat=5, number=20):
+    """
+    Compare scoring stations one by one with station_score against
+    scoring them with the array variant, both given the station arrays
+    and including the time taken to build them from the station rows.
+
+    Returns a list of dicts with the timings in microseconds.
+    """
+    now = util.utcnow()
+    results = []
+    for size in sizes:
+        stations = random_stations(size, now)
+        array = station_array(stations)
+
+        def scalar():
+            return [station_score(station, now) for station in stations]
+
+        def vectorized():
+            return station_scores(array, now)
+
+        def vectorized_build():
+            return station_scores(station_array(stations), now)
+
+        scalar_time = best_time(scalar, repeat, number)
+        vectorized_time = best_time(vectorized, repeat, number)
+        build_time = best_time(vectorized_build, repeat, number)
+        results.append(
+            {
+                "stations": size,
+                "scalar_us": scalar_time,
+                "vectorized_us": vectorized_time,
+                "vectorized_build_us": build_time,
+                "speedup": scalar_time / vectorized_time,
+            }
+        )
+    return results
+
+
+def bench_geocoder(repeat=3):
+    """
+    Compare the startup time of a geocoder loading the regions from the
+    prebuilt WKB file against one parsing the GeoJSON files.
+
+    Returns a dict with the timings in milliseconds.
+    """
+
+    def load(**kw):
+        geocoder = Geocoder(**kw)
+        geocoder.load()
+        geocoder.close()
+
+    def create():
+        Geocoder().close()
+
+    create_time = best_time(create, repeat, 1) / 1000.0
+    wkb_time = best_time(load, repeat, 1) / 1000.0
+    geojson_time = best_time(lambda: load(wkb_file=None), repeat, 1) / 1000.0
+    return {
+        "create_ms": create_time,
+        "wkb_ms": wkb_time,
+        "geojson_ms": geojson_time,
+        "speedup": geojson_time / wkb_time,
+    }
+
+
+# The API key used by the synthetic locate queries, which never uses
+# the fallback source or stores the queries.
+BENCHMARK_KEY = Key(valid_key="benchmark", store_sample_locate=0)
+
+
+def random_mac():
+    """Return a random, valid mac address."""
+    return "%012x" % random.randint(0x010000000000, 0xFEFFFFFFFFFF)
+
+
+def random_locate_data(size, now):
+    """
+    Return the station rows and the request body of a synthetic
+    locate query with size WiFi networks, half as many Bluetooth
+    networks and a cell for every ten WiFi networks.
+
+    Most networks are placed close to a random position, but some
+    are outliers a few kilometers away and some are unknown, without
+    a station row.
+
+    :returns: A two-tuple of a dict mapping station types to lists of
+              station rows and the request body.
+    """
+    lat = random.uniform(50.0, 53.0)
+    lon = random.uniform(-2.0, 1.0)
+
+    def station(key, spread, radius):
+        outlier = random.random() < 0.1
+        offset = 0.05 if outlier else spread
+        modified = now - timedelta(days=random.uniform(0, 100))
+        return (
+            key,
+            lat + random.uniform(-offset, offset),
+            lon + random.uniform(-offset, offset),
+            radius,
+            "GB",
+            random.randint(1, 100),
+            modified - timedelta(days=random.uniform(0, 400)),
+            modified,
+            modified.date(),
+            None,
+            0,
+        )
+
+    stations = {"blue": [], "cell": [], "wifi": []}
+    body = {
+        "bluetoothBeacons": [],
+        "cellTowers": [],
+        "wifiAccessPoints": [],
+        "considerIp": False,
+    }
+    for station_type, field, count, spread, radius in (
+        ("blue", "bluetoothBeacons", max(size // 2, 2), 0.0002, 10),
+        ("wifi", "wifiAccessPoints", size, 0.0005, 50),
+    ):
+        for _ in range(count):
+            mac = random_mac()
+            body[field].append(
+                {"macAddress": mac, "signalStrength": random.randint(-95, -40)}
+            )
+            if random.random() >= 0.1:
+                stations[station_type].append(MacStation(*station(mac, spread, radius)))
+
+    for _ in range(max(size // 10, 1)):
+        cellid = (
+            Radio.lte,
+            234,
+            10,
+            random.randint(1, 65533),
+            random.randint(1, 2 ** 28 - 1),
+        )
+        body["cellTowers"].append(
+            {
+                "radioType": "lte",
+                "mobileCountryCode": cellid[1],
+                "mobileNetworkCode": cellid[2],
+                "locationAreaCode": cellid[3],
+                "cellId": cellid[4],
+                "signalStrength": random.randint(-110, -60),
+            }
+        )
+        stations["cell"].append(CellStation(*station(cellid, 0.01, 2000)))
+
+    return (stations, body)
+
+
+def memory_station_cache(bodies, stations):
+    """
+    Return a station cache holding all stations and all unknown networks
+    of the given queries, as an in-memory stand-in for the database.
+    """
+    cache = StationCache(2 ** 40, ttl=86400, negative_ttl=86400)
+    for body in bodies:
+        cache.set_many(
+            "blue",
+            {encode_mac(blue["macAddress"]): None for blue in body["bluetoothBeacons"]},
+        )
+        cache.set_many(
+            "wifi",
+            {encode_mac(wifi["macAddress"]): None for wifi in body["wifiAccessPoints"]},
+        )
+    for station_type in ("blue", "wifi"):
+        cache.set_many(
+            station_type, {encode_mac(row.mac): row for row in stations[station_type]},
+        )
+    cache.set_many(
+        "cell", {encode_cellid(*row.cellid): row for row in stations["cell"]}
+    )
+    return cache
+
+
+def insert_stations(session, stations):
+    """Add all stations to the station tables, in the given session."""
+    for station_type, model in (("blue", BlueShard), ("wifi", WifiShard)):
+        for row in stations[station_type]:
+            values = row._asdict()
+            session.add(
+                model.shard_model(row.mac).create(_raise_invalid=True, **values)
+            )
+    for row in stations["cell"]:
+        values = row._asdict()
+        radio, mcc, mnc, lac, cid = values.pop("cellid")
+        session.add(
+            CellShard.shard_model(radio).create(
+                _raise_invalid=True,
+                radio=radio,
+                mcc=mcc,
+                mnc=mnc,
+                lac=lac,
+                cid=cid,
+                **values,
+            )
+        )
+    session.flush()
+
+
+def bench_locate(sizes=(5, 20, 50), queries=20, repeat=3, session=None):
+    """
+    Time the position search of synthetic locate queries end to end,
+    and each stage of the WiFi search separately.
+
+    Without a database session, the stations are looked up in an
+    in-memory station cache. Otherwise they are added to the database
+    in the given session, which the caller should roll back, and looked
+    up without any station cache.
+
+    Returns a list of dicts with the timings per query in microseconds.
+    """
+    now = util.utcnow()
+    raven_client = configure_raven(transport="sync")
+    results = []
+    for size in sizes:
+        stations = {"blue": [], "cell": [], "wifi": []}
+        bodies = []
+        for _ in range(queries):
+            query_stations, body = random_locate_data(size, now)
+            for station_type, rows in query_stations.items():
+                stations[station_type].extend(rows)
+            bodies.append(body)
+
+        if session is None:
+            station_cache = memory_station_cache(bodies, stations)
+        else:
+            insert_stations(session, stations)
+            station_cache = None
+        shard_query = ShardQuery()
+
+        geoip_db = GeoIPNull()
+        searcher = PositionSearcher(
+            geoip_db=geoip_db,
+            raven_client=raven_client,
+            redis_client=None,
+            data_queues={},
+        )
+        for name, source in searcher.sources:
+            if name == "internal":
+                source.station_cache = station_cache
+                source.shard_query = shard_query
+
+        def make_query(body):
+            data = LOCATE_V1_SCHEMA.deserialize(body)
+            return Query(
+                fallback=data.get("fallbacks"),
+                blue=data.get("bluetoothBeacons"),
+                cell=data.get("cellTowers"),
+                wifi=data.get("wifiAccessPoints"),
+                api_key=BENCHMARK_KEY,
+                api_type="locate",
+                session=session,
+                geoip_db=geoip_db,
+            )
+
+        def search():
+            return [searcher.search(make_query(body)) for body in bodies]
+
+        def validate():
+            return [make_query(body) for body in bodies]
+
+        parsed = validate()
+
+        def lookup():
+            return [
+                query_macs(
+                    query,
+                    query.wifi,
+                    raven_client,
+                    WifiShard,
+                    station_cache,
+                    shard_query,
+                )
+                for query in parsed
+            ]
+
+        wifis = lookup()
+
+        def cluster():
+            return [
+                cluster_networks(
+                    query_wifis,
+                    query.wifi,
+                    min_radius=WIFI_MIN_ACCURACY,
+                    min_signal=MIN_WIFI_SIGNAL,
+                    max_distance=MAX_WIFI_CLUSTER_METERS,
+                )
+                for query_wifis, query in zip(wifis, parsed)
+            ]
+
+        clusters = cluster()
+
+        def aggregate():
+            return [
+                aggregate_cluster_position(
+                    query_cluster,
+                    Position,
+                    "wifi",
+                    max_networks=MAX_WIFIS_IN_CLUSTER,
+                    min_accuracy=WIFI_MIN_ACCURACY,
+                    max_accuracy=WIFI_MAX_ACCURACY,
+                )
+                for query_clusters in clusters
+                for query_cluster in query_clusters
+            ]
+
+        best = [searcher._search(query) for query in parsed]
+
+        def format_results():
+            return [
+                json.dumps(searcher.format_result(result))
+                for result in best
+                if result is not None
+            ]
+
+        timings = {
+            "search": search,
+            "validate": validate,
+            "query_macs": lookup,
+            "cluster_networks": cluster,
+            "aggregate_cluster_position": aggregate,
+            "format": format_results,
+        }
+        result = {
+            "wifis": size,
+            "queries": queries,
+            "found": sum(1 for result in best if result is not None),
+        }
+        for name, func in timings.items():
+            result[name + "_us"] = best_time(func, repeat, 1) / queries
+        results.append(result)
+
+        if raven_client.msgs:
+            messages = [msg["message"] for msg in raven_client.msgs]
+            raise RuntimeError("Errors during the locate benchmark: %r" % messages)
+
+    return results
+
+
+def benchmark_report(benchmark, results, **info):
+    """Return a machine-readable report of benchmark results."""
+    report = {
+        "benchmark": benchmark,
+        "created": util.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    report.update(info)
+    return report
+
+
+def compare_reports(baseline, report, tolerance=1.25):
+    """
+    Compare the timings of two benchmark reports.
+
+    Returns a list of dicts describing all timings which are more than
+    tolerance times slower than in the baseline report, for query
+    sizes included in both reports.
+    """
+    baseline_results = {result["wifis"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = baseline_results.get(result["wifis"])
+        if old is None:
+            continue
+        for name, value in sorted(result.items()):
+            if not name.endswith("_us") or name not in old:
+                continue
+            if value > old[name] * tolerance:
+                regressions.append(
+                    {
+                        "wifis": result["wifis"],
+                        "timing": name,
+                        "baseline": old[name],
+                        "value": value,
+                    }
+                )
+    return regressions
+
+
+# Station types processed by the data pipeline, with their updater
+# and station model.
+PIPELINE_TYPES = (
+    ("blue", BlueUpdater, BlueShard),
+    ("cell", CellUpdater, CellShard),
+    ("wifi", WifiUpdater, WifiShard),
+)
+
+
+def random_submit_data(count, networks, now):
+    """
+    Return a list of synthetic geosubmit reports, as queued by the
+    submit APIs, each with the given number of WiFi networks, half as
+    many Bluetooth networks and a cell for every ten WiFi networks.
+
+    The networks are picked from pools a quarter the size of all
+    network observations, so most networks are observed a couple of
+    times and the later reports update existing stations.
+    """
+    timestamp = int(time.mktime(now.timetuple()) * 1000)
+    counts = {
+        "blue": max(networks // 2, 1),
+        "cell": max(networks // 10, 1),
+        "wifi": networks,
+    }
+    pools = {}
+    for name, size in counts.items():
+        pool = []
+        for _ in range(max(count * size // 4, size)):
+            lat = random.uniform(50.0, 53.0)
+            lon = random.uniform(-2.0, 1.0)
+            if name == "cell":
+                key = {
+                    "radioType": "lte",
+                    "mobileCountryCode": 234,
+                    "mobileNetworkCode": 10,
+                    "locationAreaCode": random.randint(1, 65533),
+                    "cellId": random.randint(1, 2 ** 28 - 1),
+                }
+            else:
+                key = {"macAddress": random_mac()}
+            pool.append((lat, lon, key))
+        pools[name] = pool
+
+    items = []
+    for _ in range(count):
+        lat, lon, _ = random.choice(pools["wifi"])
+        report = {
+            "timestamp": timestamp,
+            "position": {
+                "latitude": lat + random.uniform(-0.0005, 0.0005),
+                "longitude": lon + random.uniform(-0.0005, 0.0005),
+                "accuracy": random.uniform(5.0, 50.0),
+            },
+        }
+        for name, field, low, high in (
+            ("blue", "bluetoothBeacons", -100, -50),
+            ("cell", "cellTowers", -110, -60),
+            ("wifi", "wifiAccessPoints", -95, -40),
+        ):
+            report[field] = [
+                dict(key, signalStrength=random.randint(low, high))
+                for _, _, key in random.sample(pools[name], counts[name])
+            ]
+        items.append({"api_key": "benchmark", "source": "gnss", "report": report})
+    return items
+
+
+class PipelineTask(object):
+    """
+    A stand-in for the celery tasks of the data pipeline, running
+    all database work in a single session and never scheduling
+    any further tasks.
+    """
+
+    def __init__(self, session, redis_client, data_queues):
+        self.session = session
+        self.redis_client = redis_client
+        self.app = namedtuple("App", "data_queues")(data_queues)
+
+    @contextmanager
+    def db_session(self, commit=True):
+        yield self.session
+        if commit:
+            self.session.flush()
+
+    def redis_pipeline(self, execute=True):
+        return redis_pipeline(self.redis_client, execute=execute)
+
+    def apply_countdown(self, args=None, kwargs=None):
+        pass
+
+    def delay(self, *args, **kw):
+        pass
+
+
+class StatementTimer(object):
+    """
+    Collects the number and duration of the database statements,
+    grouped into locking selects, other selects and writes.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.durations = defaultdict(float)
+        self._start = []
+
+    def _kind(self, statement):
+        statement = statement.lstrip().upper()
+        if statement.startswith("SELECT"):
+            if "FOR UPDATE" in statement:
+                return "select_for_update"
+            return "select"
+        return "write"
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        self._start.append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        kind = self._kind(statement)
+        self.counts[kind] += 1
+        self.durations[kind] += time.perf_counter() - self._start.pop()
+
+    @contextmanager
+    def listen(self, bind):
+        event.listen(bind, "before_cursor_execute", self.before)
+        event.listen(bind, "after_cursor_execute", self.after)
+        try:
+            yield self
+        finally:
+            event.remove(bind, "before_cursor_execute", self.before)
+            event.remove(bind, "after_cursor_execute", self.after)
+
+
+def bench_pipeline_cpu(task, config, items):
+    """
+    Time the CPU bound steps of the data pipeline for the given
+    queue items, each step once for all items.
+
+    Returns a dict with the timings in milliseconds.
+    """
+    timings = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        result = func()
+        timings[name + "_ms"] = (time.perf_counter() - start) * 1000.0
+        return result
+
+    def encode_json():
+        encoded = [json.dumps(item).encode("utf-8") for item in items]
+        return (encoded, [json.loads(value) for value in encoded])
+
+    encoded, decoded = timed("json", encode_json)
+
+    def frame():
+        # Pack the items into frames of the web frontend's batch size.
+        frames = [
+            encode_frame(encoded[i : i + 100]) for i in range(0, len(encoded), 100)
+        ]
+        return [decode_frame(value) for value in frames]
+
+    timed("frame", frame)
+
+    exporter = InternalExporter(task, config, config.queue_key("benchmark"))
+    transform = InternalTransform()
+    reports = timed(
+        "validation",
+        lambda: [
+            exporter.process_report(transform(item["report"]))[0] for item in decoded
+        ],
+    )
+    observations = {name: [] for name, _, _ in PIPELINE_TYPES}
+    for report in reports:
+        for name, values in report.items():
+            observations[name].extend(values)
+
+    def shard():
+        # Group the observations into the per shard queues, without
+        # sending them to Redis, and parse them again as the station
+        # updaters do.
+        with task.redis_pipeline(execute=False) as pipe:
+            exporter.queue_observations(pipe, observations)
+        for name, updater_type, shard_model in PIPELINE_TYPES:
+            updater = updater_type(task, shard_id=next(iter(shard_model.shards())))
+            updater.shard_observations(
+                [
+                    obs.to_json() if updater.data_queue.json else obs.to_binary()
+                    for obs in observations[name]
+                ]
+            )
+
+    timed("sharding", shard)
+    return timings
+
+
+def bench_pipeline(session, redis_client, reports=1000, networks=10):
+    """
+    Feed synthetic geosubmit reports through the data pipeline, from
+    the incoming queue over the internal exporter to the station
+    updaters, using the given database session and Redis client.
+
+    All database work happens in the session, which the caller should
+    roll back. The pipeline uses the real queue keys, so the Redis
+    database has to be a dedicated one for the benchmark. It has to be
+    empty, or a ValueError is raised, and is emptied afterwards.
+
+    Returns a dict with the throughput and the timings of each part of
+    the pipeline, the CPU bound steps and the database statements.
+    """
+    if redis_client.dbsize():
+        raise ValueError("The Redis database for the benchmark isn't empty.")
+
+    now = util.utcnow()
+    items = random_submit_data(reports, networks, now)
+    data_queues = configure_data(redis_client)
+    task = PipelineTask(session, redis_client, data_queues)
+
+    # Only export to the internal exporter.
+    session.query(ExportConfig).delete()
+    session.add(ExportConfig(name="internal", schema="internal", batch=100))
+    session.flush()
+    config = ExportConfig.get(session, "internal")
+
+    timings = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        func()
+        timings[name + "_ms"] = (time.perf_counter() - start) * 1000.0
+
+    def incoming():
+        while data_queues["update_incoming"].size():
+            IncomingQueue(task)(task)
+
+    def export():
+        for queue_key in config.partitions(redis_client):
+            exporter = InternalExporter(task, config, queue_key)
+            while exporter.queue.size():
+                exporter()
+
+    def update(updater_type, shard_model):
+        def func():
+            for shard_id in shard_model.shards():
+                updater = updater_type(task, shard_id=shard_id)
+                while updater.data_queue.size():
+                    updater()
+
+        return func
+
+    def queued(name):
+        prefix = "update_%s_" % name
+        return sum(
+            queue.size() for key, queue in data_queues.items() if key.startswith(prefix)
+        )
+
+    statements = StatementTimer()
+    start = time.perf_counter()
+    try:
+        with statements.listen(session.get_bind()):
+            timed("submit", lambda: data_queues["update_incoming"].enqueue(items))
+            timed("incoming", incoming)
+            timed("export", export)
+            num_obs = sum(queued(name) for name, _, _ in PIPELINE_TYPES)
+            for name, updater_type, shard_model in PIPELINE_TYPES:
+                timed("update_" + name, update(updater_type, shard_model))
+        total = time.perf_counter() - start
+    finally:
+        redis_client.flushdb()
+
+    return {
+        "reports": reports,
+        "observations": num_obs,
+        "total_ms": total * 1000.0,
+        "reports_per_second": reports / total,
+        "observations_per_second": num_obs / total,
+        "stages": timings,
+        "cpu": bench_pipeline_cpu(task, config, items),
+        "database": {
+            kind: {
+                "statements": statements.counts[kind],
+                "total_ms": statements.durations[kind] * 1000.0,
+            }
+            for kind in ("select", "select_for_update", "write")
+        },
+    }
+
+
+def bench_queue(frames=(1, 10, 100), items=1000, networks=10, repeat=3):
+    """
+    Compare the encoding of the incoming queue items, each one gzipped
+    on its own, against framing several of them and compressing the
+    frames as a whole.
+
+    Returns a list of dicts with the encoded bytes and the time taken
+    to encode and decode the items, per item.
+    """
+    data = random_submit_data(items, networks, util.utcnow())
+
+    def gzip_encode():
+        return [util.encode_gzip(json.dumps(item).encode("utf-8")) for item in data]
+
+    def gzip_decode(elements):
+        return [
+            json.loads(util.decode_gzip(element).decode("utf-8"))
+            for element in elements
+        ]
+
+    def frame_encode(size):
+        encoded = [json.dumps(item).encode("utf-8") for item in data]
+        return [
+            encode_frame(encoded[i : i + size]) for i in range(0, len(encoded), size)
+        ]
+
+    def frame_decode(elements):
+        return [
+            json.loads(item.decode("utf-8"))
+            for element in elements
+            for item in decode_frame(element)
+        ]
+
+    codecs = [("gzip", 1, gzip_encode, gzip_decode)]
+    for size in frames:
+        codecs.append(
+            ("frame", size, lambda size=size: frame_encode(size), frame_decode)
+        )
+
+    results = []
+    for encoding, size, encode, decode in codecs:
+        elements = encode()
+        assert decode(elements) == data
+        results.append(
+            {
+                "encoding": encoding,
+                "frame": size,
+                "bytes_per_item": sum(len(element) for element in elements) / items,
+                "encode_us": best_time(encode, repeat, 1) / items,
+                "decode_us": best_time(lambda: decode(elements), repeat, 1) / items,
+            }
+        )
+    return results
+
+
+@click.group()
+def benchmark_group():
+    pass
+
+
+@benchmark_group.command("score")
+@click.option("--repeat", default=5, help="Number of timing runs.")
+@click.option("--number", default=20, help="Number of calls per timing run.")
+@click.pass_context
+def cmd_score(ctx, repeat, number):
+    """Benchmark scalar and vectorized station scores."""
+    click.echo(
+        "%8s %12s %12s %12s %8s"
+        % ("stations", "scalar us", "array us", "+build us", "speedup")
+    )
+    for result in bench_score(repeat=repeat, number=number):
+        click.echo(
+            "%(stations)8d %(scalar_us)12.1f %(vectorized_us)12.1f "
+            "%(vectorized_build_us)12.1f %(speedup)7.1fx" % result
+        )
+
+
+@benchmark_group.command("geocoder")
+@click.option("--repeat", default=3, help="Number of timing runs.")
+@click.pass_context
+def cmd_geocoder(ctx, repeat):
+    """Benchmark the geocoder startup time."""
+    result = bench_geocoder(repeat=repeat)
+    click.echo("create (lazy): %(create_ms)10.3f ms" % result)
+    click.echo("load WKB:      %(wkb_ms)10.3f ms" % result)
+    click.echo("load GeoJSON:  %(geojson_ms)10.3f ms" % result)
+    click.echo("speedup:       %(speedup)10.1fx" % result)
+
+
+@benchmark_group.command("locate")
+@click.option(
+    "--sizes", default="5,20,50", help="Comma separated numbers of WiFi networks."
+)
+@click.option("--queries", default=20, help="Number of queries per size.")
+@click.option("--repeat", default=3, help="Number of timing runs.")
+@click.option(
+    "--database",
+    is_flag=True,
+    help="Query stations in the database instead of an in-memory cache.",
+)
+@click.option("--output", type=click.Path(), help="Write a JSON report to a file.")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True),
+    help="Compare the timings to a JSON report and fail on regressions.",
+)
+@click.option(
+    "--tolerance", default=1.25, help="Allowed slowdown compared to the baseline."
+)
+@click.pass_context
+def cmd_locate(ctx, sizes, queries, repeat, database, output, baseline, tolerance):
+    """Benchmark the position search and its stages."""
+    sizes = [int(size) for size in sizes.split(",")]
+    if database:
+        db = configure_db("rw")
+        try:
+            with db_worker_session(db, commit=False) as session:
+                results = bench_locate(sizes, queries, repeat, session=session)
+                session.rollback()
+        finally:
+            db.close()
+    else:
+        results = bench_locate(sizes, queries, repeat)
+    report = benchmark_report(
+        "locate", results, backend="database" if database else "memory"
+    )
+
+    click.echo(
+        "%6s %10s %10s %10s %10s %10s %10s"
+        % ("wifis", "search us", "validate", "query", "cluster", "aggregate", "format")
+    )
+    for result in results:
+        click.echo(
+            "%(wifis)6d %(search_us)10.1f %(validate_us)10.1f %(query_macs_us)10.1f "
+            "%(cluster_networks_us)10.1f %(aggregate_cluster_position_us)10.1f "
+            "%(format_us)10.1f" % result
+        )
+
+    if output:
+        with open(output, "w") as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as fd:
+            regressions = compare_reports(json.load(fd), report, tolerance)
+        for regression in regressions:
+            click.echo(
+                "regression: %(timing)s with %(wifis)d wifis, "
+                "%(baseline).1f us -> %(value).1f us" % regression
+            )
+        if regressions:
+            ctx.exit(1)
+
+
+@benchmark_group.command("pipeline")
+@click.option("--reports", default=1000, help="Number of submitted reports.")
+@click.option("--networks", default=10, help="Number of WiFi networks per report.")
+@click.option("--seed", default=None, type=int, help="Seed for the synthetic data.")
+@click.option("--output", type=click.Path(), help="Write a JSON report to a file.")
+@click.option(
+    "--redis-db",
+    default=15,
+    help="Empty Redis database to use instead of the configured one.",
+)
+@click.pass_context
+def cmd_pipeline(ctx, reports, networks, seed, output, redis_db):
+    """
+    Benchmark the data pipeline throughput.
+
+    Uses the configured database and a separate, empty database on the
+    configured Redis server. All database changes are rolled back and
+    the Redis database is emptied again.
+    """
+    url = urlparse(settings("redis_uri"))
+    if redis_db == int(url.path[1:] or 0):
+        raise click.BadParameter(
+            "must differ from the configured Redis database", param_hint="--redis-db"
+        )
+    if seed is not None:
+        random.seed(seed)
+    db = configure_db("rw")
+    redis_client = configure_redis(url._replace(path="/%d" % redis_db).geturl())
+    try:
+        with db_worker_session(db, commit=False) as session:
+            result = bench_pipeline(session, redis_client, reports, networks)
+            session.rollback()
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    finally:
+        redis_client.close()
+        db.close()
+
+    click.echo("reports:       %(reports)10d" % result)
+    click.echo("observations:  %(observations)10d" % result)
+    click.echo("reports/s:     %(reports_per_second)10.1f" % result)
+    click.echo("observations/s:%(observations_per_second)10.1f" % result)
+    for group in ("stages", "cpu"):
+        for name, value in sorted(result[group].items()):
+            click.echo("%-15s%10.1f ms" % (name[:-3] + ":", value))
+    for kind, value in sorted(result["database"].items()):
+        click.echo(
+            "%-15s%10.1f ms in %d statements"
+            % (kind + ":", value["total_ms"], value["statements"])
+        )
+
+    if output:
+        with open(output, "w") as fd:
+            json.dump(
+                benchmark_report("pipeline", result, networks=networks, seed=seed),
+                fd,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+@benchmark_group.command("queue")
+@click.option("--items", default=1000, help="Number of queued reports.")
+@click.option("--networks", default=10, help="Number of WiFi networks per report.")
+@click.option("--repeat", default=3, help="Number of timing runs.")
+@click.option("--output", type=click.Path(), help="Write a JSON report to a file.")
+@click.pass_context
+def cmd_queue(ctx, items, networks, repeat, output):
+    """Benchmark the encodings of the incoming queue."""
+    results = bench_queue(items=items, networks=networks, repeat=repeat)
+    click.echo(
+        "%8s %6s %10s %10s %10s"
+        % ("encoding", "frame", "bytes", "encode us", "decode us")
+    )
+    for result in results:
+        click.echo(
+            "%(encoding)8s %(frame)6d %(bytes_per_item)10.1f "
+            "%(encode_us)10.1f %(decode_us)10.1f" % result
+        )
+
+    if output:
+        with open(output, "w") as fd:
+            json.dump(
+                benchmark_report("queue", results, items=items, networks=networks),
+                fd,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+if __name__ == "__main__":
+    benchmark_group()
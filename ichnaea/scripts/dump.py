@@ -5,17 +5,23 @@ Script is installed as `location_dump`.
 """
 
 import argparse
+import heapq
 import logging
+from operator import itemgetter
 import os
 import os.path
 import sys
+import tempfile
 
-from sqlalchemy import text
+from sqlalchemy import select, text
 
+from ichnaea.api.locate.cell import CELL_STATION_FIELDS
+from ichnaea.api.locate.mac import MAC_STATION_FIELDS
+from ichnaea.api.locate.snapshot import write_snapshot
 from ichnaea.db import configure_db, db_worker_session
 from geocalc import bbox
 from ichnaea.log import configure_logging
-from ichnaea.models import BlueShard, CellShard, WifiShard
+from ichnaea.models import BlueShard, CellShard, encode_cellid, encode_mac, WifiShard
 from ichnaea import util
 
 
@@ -69,13 +75,91 @@ def dump_file(datatype, session, filename, lat=None, lon=None, radius=None):
     return 0
 
 
-def main(argv, _db=None, _dump_file=dump_file):
+def snapshot_rows(shard, session, where=None, limit=25000):
+    """
+    Yield two-tuples of the binary station key and station row
+    for all stations with a position in one shard, sorted by key.
+    """
+    columns = shard.__table__.c
+    if shard.station_type == "cell":
+        fields = CELL_STATION_FIELDS
+        key_column = columns.cellid
+
+        def encode_key(value):
+            return encode_cellid(*value)
+
+    else:
+        fields = MAC_STATION_FIELDS
+        key_column = columns.mac
+        encode_key = encode_mac
+
+    stmt = (
+        select([getattr(columns, field) for field in fields])
+        .where(columns.lat.isnot(None))
+        .where(columns.lon.isnot(None))
+    )
+    if where:
+        stmt = stmt.where(text(where))
+
+    min_key = None
+    while True:
+        page = stmt
+        if min_key is not None:
+            page = page.where(key_column > min_key)
+        rows = session.execute(page.order_by(key_column).limit(limit)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            min_key = encode_key(row[0])
+            yield (min_key, row)
+
+
+def dump_snapshot(datatype, session, filename, lat=None, lon=None, radius=None):
+    model = {"blue": BlueShard, "cell": CellShard, "wifi": WifiShard}
+    where = where_area(lat, lon, radius)
+    # Each shard is read in key order, merging them results in
+    # one sorted stream of all stations.
+    records = heapq.merge(
+        *[
+            snapshot_rows(shard, session, where=where)
+            for shard in model[datatype].shards().values()
+        ],
+        key=itemgetter(0),
+    )
+    # Write a new file and rename it over the old one, as web workers
+    # might have the old file memory-mapped.
+    fd = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(filename), prefix=".snapshot-", delete=False
+    )
+    try:
+        with fd:
+            count = write_snapshot(fd, datatype, records)
+            fd.flush()
+            os.fsync(fd.fileno())
+        # Temporary files are only readable by their owner.
+        os.chmod(fd.name, 0o644)
+        os.replace(fd.name, filename)
+    except BaseException:
+        os.unlink(fd.name)
+        raise
+    LOGGER.info("Wrote %s stations to snapshot: %s", count, filename)
+    return 0
+
+
+def main(argv, _db=None, _dump_file=dump_file, _dump_snapshot=dump_snapshot):
     parser = argparse.ArgumentParser(prog=argv[0], description="Dump/export data.")
     parser.add_argument(
         "--datatype", required=True, help="Type of the data file, blue, cell or wifi"
     )
+    parser.add_argument("--filename", required=True, help="Path to the export file.")
     parser.add_argument(
-        "--filename", required=True, help="Path to the csv.gz export file."
+        "--format",
+        default="csv",
+        choices=("csv", "snapshot"),
+        help=(
+            "Format of the export file, a csv.gz file or a binary "
+            "station snapshot for the locate API."
+        ),
     )
     parser.add_argument(
         "--lat", default=None, help="The center latitude of the desired area."
@@ -93,7 +177,8 @@ def main(argv, _db=None, _dump_file=dump_file):
         return 1
 
     filename = os.path.abspath(os.path.expanduser(args.filename))
-    if os.path.isfile(filename):
+    if os.path.isfile(filename) and args.format != "snapshot":
+        # Snapshots are replaced atomically, so they can be refreshed.
         print("File already exists.")
         return 1
 
@@ -111,10 +196,9 @@ def main(argv, _db=None, _dump_file=dump_file):
     configure_logging()
 
     db = configure_db("ro", _db=_db, pool=False)
+    dump = _dump_snapshot if args.format == "snapshot" else _dump_file
     with db_worker_session(db, commit=False) as session:
-        exit_code = _dump_file(
-            datatype, session, filename, lat=lat, lon=lon, radius=radius
-        )
+        exit_code = dump(datatype, session, filename, lat=lat, lon=lon, radius=radius)
     return exit_code
 
 
@@ -1,6 +1,8 @@
 """
 Parse naturalearth 50m admin subunits dataset and generate minimal
-GeoJSON files for regions and buffered regions.
+GeoJSON files for regions and buffered regions, a WKB file of the
+same shapes for a faster start of the geocoder and a grid index
+of the regions.
 
 Script is installed as `location_region_json`.
 
@@ -342,13 +344,45 @@ def to_geojson(regions):
     return (_to_collection(features), _to_collection(features_buffered))
 
 
+def write_index(
+    regions_file=geocode.REGIONS_FILE,
+    buffer_file=geocode.REGIONS_BUFFER_FILE,
+    grid_file=geocode.REGIONS_GRID_FILE,
+    wkb_file=geocode.REGIONS_WKB_FILE,
+    depth=geocode.GRID_DEPTH,
+):
+    """Build the region WKB file and grid index from the region files."""
+    digest = geocode.regions_digest(regions_file, buffer_file)
+    shapes, radii, buffered_shapes = geocode.read_regions_geojson(
+        regions_file, buffer_file
+    )
+    geocode.write_regions_wkb(wkb_file, shapes, radii, buffered_shapes, digest=digest)
+
+    geocoder = geocode.Geocoder(regions_file, buffer_file, grid_file=None)
+    try:
+        grid = geocode.RegionGrid.build(geocoder, depth=depth, digest=digest)
+    finally:
+        geocoder.close()
+    grid.dump(grid_file)
+
+
 def main(argv):
     parser = argparse.ArgumentParser(
-        prog=argv[0], description="Create region GeoJSON files."
+        prog=argv[0], description="Create region GeoJSON, WKB and grid files."
+    )
+    parser.add_argument(
+        "--index-only",
+        action="store_true",
+        help=(
+            "Only rebuild the region WKB file and grid from the existing "
+            "GeoJSON files."
+        ),
     )
 
-    # implicitly parse and react to -h/--help
-    parser.parse_args(argv[1:])
+    args = parser.parse_args(argv[1:])
+    if args.index_only:
+        write_index()
+        return 0
 
     os.system(
         "ogr2ogr -f GeoJSON "
@@ -368,6 +402,9 @@ def main(argv):
     with util.gzip_open(geocode.REGIONS_BUFFER_FILE, "w", compresslevel=7) as fd:
         fd.write(buffer_collection)
 
+    write_index()
+    return 0
+
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
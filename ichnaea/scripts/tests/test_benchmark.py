@@ -0,0 +1,212 @@
+import json
+
+from click.testing import CliRunner
+import pytest
+
+from ichnaea.models import WifiShard
+from ichnaea.scripts.benchmark import (
+    bench_geocoder,
+    bench_locate,
+    bench_pipeline,
+    bench_queue,
+    bench_score,
+    benchmark_group,
+    compare_reports,
+    benchmark_report,
+)
+
+
+def test_basic():
+    """Test that the command imports and runs at all."""
+    runner = CliRunner()
+    result = runner.invoke(benchmark_group)
+    assert result.exit_code == 0
+
+
+class TestScore(object):
+    def test_bench(self):
+        results = bench_score(sizes=(10, 100), repeat=1, number=1)
+        assert [result["stations"] for result in results] == [10, 100]
+        for result in results:
+            assert result["scalar_us"] > 0
+            assert result["vectorized_us"] > 0
+
+    def test_command(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            benchmark_group, ["score", "--repeat", "1", "--number", "1"]
+        )
+        assert result.exit_code == 0
+        assert len(result.output.splitlines()) == 4
+
+
+class TestGeocoder(object):
+    def test_bench(self):
+        result = bench_geocoder(repeat=1)
+        assert result["wkb_ms"] > 0
+        assert result["geojson_ms"] > 0
+
+    def test_command(self):
+        runner = CliRunner()
+        result = runner.invoke(benchmark_group, ["geocoder", "--repeat", "1"])
+        assert result.exit_code == 0
+        assert len(result.output.splitlines()) == 4
+
+
+class TestLocate(object):
+    def check_results(self, results):
+        assert [result["wifis"] for result in results] == [5, 20]
+        for result in results:
+            assert result["found"] == 2
+            for name in (
+                "search_us",
+                "validate_us",
+                "query_macs_us",
+                "cluster_networks_us",
+                "aggregate_cluster_position_us",
+                "format_us",
+            ):
+                assert result[name] > 0
+
+    def test_bench(self):
+        self.check_results(bench_locate(sizes=(5, 20), queries=2, repeat=1))
+
+    def test_bench_database(self, session):
+        self.check_results(
+            bench_locate(sizes=(5, 20), queries=2, repeat=1, session=session)
+        )
+
+    def test_compare(self):
+        baseline = benchmark_report(
+            "locate", [{"wifis": 5, "search_us": 100.0, "format_us": 10.0}]
+        )
+        report = benchmark_report(
+            "locate",
+            [
+                {"wifis": 5, "search_us": 110.0, "format_us": 20.0},
+                {"wifis": 20, "search_us": 500.0, "format_us": 20.0},
+            ],
+        )
+        assert compare_reports(baseline, report, tolerance=1.25) == [
+            {"wifis": 5, "timing": "format_us", "baseline": 10.0, "value": 20.0}
+        ]
+        assert compare_reports(baseline, report, tolerance=2.5) == []
+
+    def test_command(self, tmpdir):
+        output = str(tmpdir / "report.json")
+        runner = CliRunner()
+        result = runner.invoke(
+            benchmark_group,
+            ["locate", "--sizes", "5", "--queries", "1", "--repeat", "1"]
+            + ["--output", output],
+        )
+        assert result.exit_code == 0
+        assert len(result.output.splitlines()) == 2
+        with open(output) as fd:
+            report = json.load(fd)
+        assert report["benchmark"] == "locate"
+        assert report["backend"] == "memory"
+        assert [result["wifis"] for result in report["results"]] == [5]
+
+    def test_command_regression(self, tmpdir):
+        baseline = str(tmpdir / "baseline.json")
+        with open(baseline, "w") as fd:
+            json.dump(
+                benchmark_report("locate", [{"wifis": 5, "search_us": 0.001}]), fd
+            )
+        runner = CliRunner()
+        result = runner.invoke(
+            benchmark_group,
+            ["locate", "--sizes", "5", "--queries", "1", "--repeat", "1"]
+            + ["--baseline", baseline],
+        )
+        assert result.exit_code == 1
+        assert "regression: search_us with 5 wifis" in result.output
+
+
+class TestQueue(object):
+    def test_bench(self):
+        results = bench_queue(frames=(1, 10), items=20, networks=5, repeat=1)
+        assert [(result["encoding"], result["frame"]) for result in results] == [
+            ("gzip", 1),
+            ("frame", 1),
+            ("frame", 10),
+        ]
+        for result in results:
+            assert result["bytes_per_item"] > 0
+            assert result["encode_us"] > 0
+            assert result["decode_us"] > 0
+        gzip, single, framed = [result["bytes_per_item"] for result in results]
+        assert gzip > single > framed
+
+    def test_command(self, tmpdir):
+        output = str(tmpdir / "report.json")
+        runner = CliRunner()
+        result = runner.invoke(
+            benchmark_group,
+            ["queue", "--items", "10", "--repeat", "1", "--output", output],
+        )
+        assert result.exit_code == 0
+        assert len(result.output.splitlines()) == 5
+        with open(output) as fd:
+            report = json.load(fd)
+        assert report["benchmark"] == "queue"
+        assert report["items"] == 10
+
+
+class TestPipeline(object):
+    def test_bench(self, redis, session):
+        result = bench_pipeline(session, redis, reports=20, networks=5)
+        assert result["reports"] == 20
+        assert result["observations"] > 20
+        assert result["reports_per_second"] > 0
+        assert set(result["stages"]) == set(
+            [
+                "submit_ms",
+                "incoming_ms",
+                "export_ms",
+                "update_blue_ms",
+                "update_cell_ms",
+                "update_wifi_ms",
+            ]
+        )
+        assert set(result["cpu"]) == set(
+            ["json_ms", "frame_ms", "validation_ms", "sharding_ms"]
+        )
+        assert result["database"]["select_for_update"]["statements"] > 0
+        assert result["database"]["write"]["statements"] > 0
+        assert sum(
+            session.query(shard).count() for shard in WifiShard.shards().values()
+        )
+        assert not redis.keys("update_*")
+        assert not redis.keys("queue_export_*")
+
+    def test_bench_not_empty(self, redis, session):
+        redis.lpush("update_incoming", b"queued")
+        with pytest.raises(ValueError):
+            bench_pipeline(session, redis, reports=1, networks=1)
+        assert redis.llen("update_incoming") == 1
+
+    def test_command(self, redis, tmpdir):
+        output = str(tmpdir / "report.json")
+        runner = CliRunner()
+        result = runner.invoke(
+            benchmark_group,
+            ["pipeline", "--reports", "10", "--networks", "2", "--seed", "1"]
+            + ["--output", output],
+        )
+        assert result.exit_code == 0
+        assert "reports/s:" in result.output
+        with open(output) as fd:
+            report = json.load(fd)
+        assert report["benchmark"] == "pipeline"
+        assert report["results"]["reports"] == 10
+
+    def test_command_same_redis_db(self, redis):
+        db = redis.connection_pool.connection_kwargs["db"]
+        runner = CliRunner()
+        result = runner.invoke(
+            benchmark_group, ["pipeline", "--reports", "1", "--redis-db", str(db)]
+        )
+        assert result.exit_code == 2
+        assert "--redis-db" in result.output
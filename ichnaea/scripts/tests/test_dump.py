@@ -1,6 +1,9 @@
 import os.path
 
+from ichnaea.api.locate.internal import STATION_ROW_TYPES
+from ichnaea.api.locate.snapshot import StationSnapshot
 from ichnaea.conftest import GB_LAT, GB_LON
+from ichnaea.models import encode_cellid, encode_mac
 from ichnaea.scripts import dump
 from ichnaea.tests.factories import BlueShardFactory, CellShardFactory, WifiShardFactory
 from ichnaea import util
@@ -28,6 +31,22 @@ class TestDump(object):
             == 0
         )
 
+    def test_main_snapshot(self, db):
+        assert (
+            dump.main(
+                [
+                    "script",
+                    "--datatype=wifi",
+                    "--filename=/tmp/foo",
+                    "--format=snapshot",
+                ],
+                _db=db,
+                _dump_file=None,
+                _dump_snapshot=_dump_nothing,
+            )
+            == 0
+        )
+
     def test_where(self):
         assert dump.where_area(None, None, None) is None
         assert dump.where_area(GB_LAT, None, None) is None
@@ -83,3 +102,59 @@ class TestDump(object):
         wifis = WifiShardFactory.create_batch(5)
         session.flush()
         self._export(session, "wifi", self._mac_keys(wifis))
+
+    def _snapshot(self, session, datatype, expected_keys, restrict=False):
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, datatype + ".snapshot")
+            if restrict:
+                dump.dump_snapshot(
+                    datatype, session, path, lat=GB_LAT, lon=GB_LON, radius=25000
+                )
+            else:
+                dump.dump_snapshot(datatype, session, path)
+
+            snapshot = StationSnapshot(path, *STATION_ROW_TYPES[datatype])
+            assert len(snapshot) == len(expected_keys)
+            for key in expected_keys:
+                assert snapshot.get(key) is not None
+            snapshot.close()
+
+    def test_snapshot_replace(self, session):
+        wifis = WifiShardFactory.create_batch(2)
+        session.flush()
+        with util.selfdestruct_tempdir() as temp_dir:
+            path = os.path.join(temp_dir, "wifi.snapshot")
+            with open(path, "wb") as fd:
+                fd.write(b"old")
+            with open(path, "rb") as fd:
+                dump.dump_snapshot("wifi", session, path)
+                # The old file is replaced, not overwritten in place.
+                assert fd.read() == b"old"
+            assert os.listdir(temp_dir) == ["wifi.snapshot"]
+
+            snapshot = StationSnapshot(path, *STATION_ROW_TYPES["wifi"])
+            assert len(snapshot) == 2
+            assert snapshot.get(encode_mac(wifis[0].mac)) is not None
+            snapshot.close()
+
+    def test_snapshot_blue(self, session):
+        BlueShardFactory(lat=46.5743, lon=6.3532, region="FR")
+        blues = BlueShardFactory.create_batch(2)
+        session.flush()
+        keys = [encode_mac(blue.mac) for blue in blues]
+        self._snapshot(session, "blue", keys, restrict=True)
+
+    def test_snapshot_cell(self, session):
+        cells = CellShardFactory.create_batch(2)
+        cells.append(CellShardFactory(lat=46.5743, lon=6.3532, region="FR"))
+        # Stations without a position aren't part of the snapshot.
+        CellShardFactory(lat=None, lon=None)
+        session.flush()
+        keys = [encode_cellid(*cell.cellid) for cell in cells]
+        self._snapshot(session, "cell", keys)
+
+    def test_snapshot_wifi(self, session):
+        wifis = WifiShardFactory.create_batch(20)
+        session.flush()
+        keys = [encode_mac(wifi.mac) for wifi in wifis]
+        self._snapshot(session, "wifi", keys)
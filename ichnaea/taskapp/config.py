@@ -9,7 +9,7 @@ from ichnaea.db import configure_db
 from ichnaea.geoip import configure_geoip
 from ichnaea.log import configure_raven, configure_stats
 from ichnaea.models import BlueShard, CellShard, DataMap, WifiShard
-from ichnaea.queue import DataQueue
+from ichnaea.queue import configure_queue
 
 TASK_QUEUES = (
     Queue("celery_blue", routing_key="celery_blue"),
@@ -38,28 +38,38 @@ def configure_celery(celery_app):
 
 def configure_data(redis_client):
     """
-    Configure fixed set of data queues.
+    Configure fixed set of data queues, stored in Redis lists or
+    streams depending on the ``queue_backend`` setting.
     """
     data_queues = {
         # *_incoming need to be the exact same as in webapp.config
-        "update_incoming": DataQueue(
-            "update_incoming", redis_client, batch=5000, compress=True
+        "update_incoming": configure_queue(
+            "update_incoming", redis_client, batch=5000, compress=True, framed=True
         )
     }
     for key in ("update_cellarea",):
-        data_queues[key] = DataQueue(key, redis_client, batch=100, json=False)
+        data_queues[key] = configure_queue(key, redis_client, batch=100, json=False)
+    # The station queues hold binary encoded observations, see
+    # ichnaea.models.observation, or JSON encoded ones if json=True.
+    # They are reliable, so observations aren't lost if a worker dies.
     for shard_id in BlueShard.shards().keys():
         key = "update_blue_" + shard_id
-        data_queues[key] = DataQueue(key, redis_client, batch=500)
+        data_queues[key] = configure_queue(
+            key, redis_client, batch=500, json=False, reliable=True
+        )
     for shard_id in DataMap.shards().keys():
         key = "update_datamap_" + shard_id
-        data_queues[key] = DataQueue(key, redis_client, batch=500, json=False)
+        data_queues[key] = configure_queue(key, redis_client, batch=500, json=False)
     for shard_id in CellShard.shards().keys():
         key = "update_cell_" + shard_id
-        data_queues[key] = DataQueue(key, redis_client, batch=500)
+        data_queues[key] = configure_queue(
+            key, redis_client, batch=500, json=False, reliable=True
+        )
     for shard_id in WifiShard.shards().keys():
         key = "update_wifi_" + shard_id
-        data_queues[key] = DataQueue(key, redis_client, batch=500)
+        data_queues[key] = configure_queue(
+            key, redis_client, batch=500, json=False, reliable=True
+        )
     return data_queues
 
 
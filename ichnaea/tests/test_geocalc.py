@@ -1,13 +1,22 @@
+import itertools
+
+import numpy
 import pytest
 
 from geocalc import (
     bbox,
+    condensed_distances,
+    cross_distances,
     destination,
     distance,
+    distances,
+    distances_from,
     haversine_distance,
     vincenty_distance,
     latitude_add,
     longitude_add,
+    max_distance,
+    pairwise_distances,
     random_points,
 )
 from ichnaea import constants
@@ -152,6 +161,112 @@ class TestVincentyDistance(object):
         assert round(self.dist(-100.0, -186.0, 0.0, 0.0), 4) == 11112616.8752
 
 
+LATS = numpy.array([90.0, 0.0, 44.0349396, -100.0, 1.0], dtype=numpy.double)
+LONS = numpy.array([0.0, 179.7, -79.4908184, -186.0, 1.1], dtype=numpy.double)
+
+
+class TestDistances(object):
+    def test_matches_scalar(self):
+        result = distances(LATS, LONS, 44.0337065, -79.4908184)
+        assert result.dtype == numpy.double
+        assert result.shape == (5,)
+        for i in range(5):
+            assert result[i] == distance(LATS[i], LONS[i], 44.0337065, -79.4908184)
+
+    def test_haversine_fallback(self):
+        result = distances(LATS[1:2], LONS[1:2], 0.5, 0.0)
+        assert result[0] == distance(0.0, 179.7, 0.5, 0.0)
+
+    def test_strided(self):
+        points = numpy.array(
+            [(lat, lon, 1.0) for lat, lon in zip(LATS, LONS)], dtype=numpy.double
+        )
+        result = distances(points[:, 0], points[:, 1], 1.0, 1.0)
+        assert (result == distances(LATS, LONS, 1.0, 1.0)).all()
+
+    def test_empty(self):
+        empty = numpy.array([], dtype=numpy.double)
+        assert distances(empty, empty, 1.0, 1.0).shape == (0,)
+
+    def test_length_mismatch(self):
+        with pytest.raises(ValueError):
+            distances(LATS, LONS[:2], 1.0, 1.0)
+
+
+class TestDistancesFrom(object):
+    def test_matches_scalar(self):
+        result = distances_from(44.0337065, -79.4908184, LATS, LONS)
+        assert result.shape == (5,)
+        for i in range(5):
+            assert result[i] == distance(44.0337065, -79.4908184, LATS[i], LONS[i])
+
+    def test_length_mismatch(self):
+        with pytest.raises(ValueError):
+            distances_from(1.0, 1.0, LATS, LONS[:2])
+
+
+class TestPairwiseDistances(object):
+    def test_matches_scalar(self):
+        lats2 = LATS[::-1].copy()
+        lons2 = LONS[::-1].copy()
+        result = pairwise_distances(LATS, LONS, lats2, lons2)
+        assert result.shape == (5,)
+        for i in range(5):
+            assert result[i] == distance(LATS[i], LONS[i], lats2[i], lons2[i])
+
+    def test_length_mismatch(self):
+        with pytest.raises(ValueError):
+            pairwise_distances(LATS, LONS, LATS[:2], LONS[:2])
+
+
+class TestCrossDistances(object):
+    def test_matches_scalar(self):
+        result = cross_distances(LATS, LONS, LATS[:3], LONS[:3])
+        assert result.shape == (5, 3)
+        for i in range(5):
+            for j in range(3):
+                assert result[i, j] == distance(LATS[i], LONS[i], LATS[j], LONS[j])
+
+    def test_length_mismatch(self):
+        with pytest.raises(ValueError):
+            cross_distances(LATS, LONS[:2], LATS, LONS)
+
+
+class TestCondensedDistances(object):
+    def test_matches_scalar(self):
+        result = condensed_distances(LATS, LONS)
+        assert result.shape == (10,)
+        pairs = itertools.combinations(zip(LATS, LONS), 2)
+        for value, (a, b) in zip(result, pairs):
+            assert value == distance(a[0], a[1], b[0], b[1])
+
+    def test_matches_cross_distances(self):
+        square = cross_distances(LATS, LONS, LATS, LONS)
+        first, second = numpy.triu_indices(5, 1)
+        assert (condensed_distances(LATS, LONS) == square[first, second]).all()
+
+    def test_small(self):
+        assert condensed_distances(LATS[:0], LONS[:0]).shape == (0,)
+        assert condensed_distances(LATS[:1], LONS[:1]).shape == (0,)
+        assert condensed_distances(LATS[:2], LONS[:2]).shape == (1,)
+
+    def test_length_mismatch(self):
+        with pytest.raises(ValueError):
+            condensed_distances(LATS, LONS[:2])
+
+
+class TestMaxDistance(object):
+    def test_max(self):
+        points = numpy.column_stack((LATS, LONS))
+        assert max_distance(1.0, 1.0, points) == max(
+            distance(1.0, 1.0, lat, lon) for lat, lon in zip(LATS, LONS)
+        )
+
+    def test_empty(self):
+        points = numpy.empty((0, 2), dtype=numpy.double)
+        assert max_distance(1.0, 1.0, points) == 0.0
+
+
 class TestLatitudeAdd(object):
     def test_returns_min_lat(self):
         assert latitude_add(-85.0, 0.0, -1000000) == constants.MIN_LAT
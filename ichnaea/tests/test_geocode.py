@@ -1,7 +1,41 @@
-from ichnaea.geocode import GEOCODER
+import random
+
+import pytest
+from shapely import geometry
+
+import geocalc
+from ichnaea.geocode import (
+    configure_geocoder,
+    Geocoder,
+    GEOCODER,
+    GRID_BORDER,
+    GRID_OUTSIDE,
+    LOADED_ATTRIBUTES,
+    read_regions_geojson,
+    read_regions_wkb,
+    RegionCache,
+    RegionGrid,
+    REGIONS_WKB_FILE,
+    regions_digest,
+    write_regions_wkb,
+)
 from ichnaea.models.constants import ALL_VALID_MCCS
 
 
+@pytest.fixture(scope="module")
+def plain_geocoder():
+    geocoder = Geocoder(grid_file=None)
+    yield geocoder
+    geocoder.close()
+
+
+@pytest.fixture(scope="module")
+def cached_geocoder():
+    geocoder = Geocoder(cache_size=1000, cache_precision=2)
+    yield geocoder
+    geocoder.close()
+
+
 class TestGeocoder(object):
     def test_no_region(self):
         func = GEOCODER.region
@@ -59,6 +93,242 @@ class TestGeocoder(object):
         for invalid in (None, 42, "A", "us", "USA", "AA"):
             assert GEOCODER.region_max_radius(invalid) is None
 
+    def test_boundary_distance(self):
+        for code in ("CA", "CH", "FR", "GB", "RU", "US"):
+            boundary = GEOCODER._boundaries[code]
+            for _ in range(50):
+                i = random.randrange(len(boundary.lats))
+                lat = min(
+                    max(boundary.lats[i] + random.uniform(-2.0, 2.0), -90.0), 90.0
+                )
+                lon = boundary.lons[i] + random.uniform(-2.0, 2.0)
+                distances = geocalc.distances(boundary.lats, boundary.lons, lat, lon)
+                assert GEOCODER._boundary_distance(code, lat, lon) == distances.min()
+                assert (
+                    GEOCODER._boundary_distance(code, lat, lon, farthest=True)
+                    == distances.max()
+                )
+
+    def test_tie_break(self):
+        distances = {"AA": 2.0, "BB": 1.0, "CC": 1.0, "DD": 3.0, "EE": 3.0}
+        assert Geocoder._tie_break(distances) == "CC"
+        assert Geocoder._tie_break(distances, farthest=True) == "EE"
+
+
+class TestLoad(object):
+    def test_lazy(self):
+        geocoder = Geocoder()
+        assert not geocoder._loaded
+        geocoder.close()
+        assert geocoder.region(51.5, -0.1) == "GB"
+        assert geocoder._loaded
+        geocoder.close()
+
+    def test_no_partial_attributes(self):
+        geocoder = Geocoder(grid_file=None)
+        build_regions = geocoder._build_regions
+
+        def _build_regions(*args):
+            attributes = build_regions(*args)
+            # Nothing is visible to other threads while loading.
+            assert not set(geocoder.__dict__) & LOADED_ATTRIBUTES
+            return attributes
+
+        geocoder._build_regions = _build_regions
+        geocoder.load()
+        assert set(geocoder.__dict__) >= LOADED_ATTRIBUTES
+        assert geocoder.region(51.5, -0.1) == "GB"
+        geocoder.close()
+
+    def test_wkb(self, tmpdir):
+        filename = str(tmpdir / "regions.wkb.gz")
+        shapes, radii, buffered_shapes = read_regions_geojson()
+        write_regions_wkb(filename, shapes, radii, buffered_shapes, digest=b"\x01" * 20)
+
+        loaded_shapes, loaded_radii, loaded_buffered = read_regions_wkb(filename)
+        assert loaded_radii == radii
+        assert set(loaded_shapes.keys()) == set(shapes.keys())
+        assert set(loaded_buffered.keys()) == set(buffered_shapes.keys())
+        for code, shape in shapes.items():
+            assert loaded_shapes[code].wkb == shape.wkb
+            assert loaded_buffered[code].wkb == buffered_shapes[code].wkb
+
+        assert read_regions_wkb(filename, digest=b"\x01" * 20) is not None
+        assert read_regions_wkb(filename, digest=b"\x00" * 20) is None
+
+    def test_wkb_current(self):
+        assert read_regions_wkb(REGIONS_WKB_FILE, digest=regions_digest()) is not None
+
+
+class TestRegionGrid(object):
+    def test_loaded(self):
+        assert GEOCODER._grid is not None
+        assert GEOCODER._grid.digest == regions_digest()
+
+    def test_lookup(self):
+        grid = GEOCODER._grid
+        assert grid.codes[grid.lookup(51.5142, -0.0931)] == "GB"
+        assert grid.lookup(0.0, -30.0) == GRID_OUTSIDE
+        assert grid.lookup(90.0, 0.0) == GRID_BORDER
+        assert grid.lookup(0.0, 180.0) == GRID_BORDER
+        assert grid.lookup(float("nan"), 0.0) == GRID_BORDER
+
+    def test_same_regions(self, plain_geocoder):
+        positions = [
+            (random.uniform(-90.0, 90.0), random.uniform(-180.0, 180.0))
+            for _ in range(5000)
+        ]
+        # Positions around some of the borders.
+        for lat, lon in ((46.2, 6.1), (42.4, 3.3), (31.5, 34.5), (49.7, 6.1)):
+            positions.extend(
+                [
+                    (lat + random.uniform(-0.5, 0.5), lon + random.uniform(-0.5, 0.5))
+                    for _ in range(500)
+                ]
+            )
+        for lat, lon in positions:
+            assert GEOCODER.region(lat, lon) == plain_geocoder.region(lat, lon)
+            assert GEOCODER.any_region(lat, lon) == plain_geocoder.any_region(lat, lon)
+
+    def test_build(self, plain_geocoder, tmpdir):
+        grid = RegionGrid.build(plain_geocoder, depth=5, digest=b"\x01" * 20)
+        assert len(grid.nodes) % 4 == 0
+        filename = str(tmpdir / "grid.bin.gz")
+        grid.dump(filename)
+
+        loaded = RegionGrid.load(filename)
+        assert loaded.depth == 5
+        assert loaded.digest == b"\x01" * 20
+        assert loaded.codes == grid.codes
+        assert list(loaded.nodes) == list(grid.nodes)
+        for _ in range(1000):
+            lat = random.uniform(-90.0, 90.0)
+            lon = random.uniform(-180.0, 180.0)
+            value = loaded.lookup(lat, lon)
+            if value >= 0:
+                assert plain_geocoder.region(lat, lon) == loaded.codes[value]
+            elif value == GRID_OUTSIDE:
+                assert plain_geocoder.region(lat, lon) is None
+
+    def test_stale(self, plain_geocoder, tmpdir):
+        grid = RegionGrid.build(plain_geocoder, depth=2, digest=b"\x00" * 20)
+        filename = str(tmpdir / "grid.bin.gz")
+        grid.dump(filename)
+        geocoder = Geocoder(grid_file=filename)
+        assert geocoder._grid is None
+        geocoder.close()
+
+
+class TestBatch(object):
+    def positions(self):
+        positions = [
+            (random.uniform(-90.0, 90.0), random.uniform(-180.0, 180.0))
+            for _ in range(2000)
+        ]
+        # Positions around some of the borders.
+        for lat, lon in ((46.2, 6.1), (49.0, -97.0), (31.5, 34.5), (49.2, -2.1)):
+            positions.extend(
+                [
+                    (lat + random.uniform(-0.5, 0.5), lon + random.uniform(-0.5, 0.5))
+                    for _ in range(500)
+                ]
+            )
+        return [lat for lat, lon in positions], [lon for lat, lon in positions]
+
+    def test_empty(self):
+        assert GEOCODER.regions([], []) == []
+        assert list(GEOCODER.in_regions([], [], [])) == []
+        assert GEOCODER.regions_for_cells([], [], []) == []
+
+    def test_invalid(self):
+        assert GEOCODER.regions([float("nan"), 91.0], [0.0, 0.0]) == [None, None]
+        assert list(
+            GEOCODER.in_regions(
+                [51.5, 51.5, 51.5], [-0.1, -0.1, -0.1], ["GB", "XX", None]
+            )
+        ) == [True, False, False]
+
+    @pytest.mark.parametrize("geocoder", ["grid", "plain"])
+    def test_regions(self, geocoder, plain_geocoder):
+        geocoder = GEOCODER if geocoder == "grid" else plain_geocoder
+        lats, lons = self.positions()
+        expected = [plain_geocoder.region(lat, lon) for lat, lon in zip(lats, lons)]
+        assert geocoder.regions(lats, lons) == expected
+
+    @pytest.mark.parametrize("geocoder", ["grid", "plain"])
+    def test_in_regions(self, geocoder, plain_geocoder):
+        geocoder = GEOCODER if geocoder == "grid" else plain_geocoder
+        lats, lons = self.positions()
+        codes = [
+            random.choice(["CA", "CH", "FR", "GB", "IL", "JE", "US", None])
+            for _ in lats
+        ]
+        expected = [
+            plain_geocoder.in_region(lat, lon, code)
+            for lat, lon, code in zip(lats, lons, codes)
+        ]
+        assert list(geocoder.in_regions(lats, lons, codes)) == expected
+
+    def test_regions_for_cells(self):
+        lats, lons = self.positions()
+        mccs = [random.choice([208, 228, 234, 302, 310, 425, 1]) for _ in lats]
+        expected = [
+            GEOCODER.region_for_cell(lat, lon, mcc)
+            for lat, lon, mcc in zip(lats, lons, mccs)
+        ]
+        assert GEOCODER.regions_for_cells(lats, lons, mccs) == expected
+
+
+class TestRegionCache(object):
+    def test_disabled(self):
+        assert Geocoder().cache is None
+
+    def test_configure(self):
+        geocoder = configure_geocoder(cache_size=10, cache_precision=4)
+        assert geocoder.cache.max_size == 10
+        assert geocoder.cache.precision == 4
+        assert configure_geocoder(cache_size=0).cache is None
+
+    def test_bounded(self):
+        cache = RegionCache(2, 3)
+        for i in range(3):
+            cache.set(cache.key(float(i), 0.0), "GB")
+        assert len(cache) == 2
+        assert cache.get(cache.key(0.0, 0.0)) is None
+        assert cache.get(cache.key(2.0, 0.0)) == "GB"
+
+    def test_key(self):
+        cache = RegionCache(10, 3)
+        assert cache.key(51.5005, -0.1005) == (51500, -101)
+        assert cache.box((51500, -101)).contains(geometry.Point(-0.1005, 51.5005))
+
+    def test_region(self, cached_geocoder, plain_geocoder, metricsmock):
+        cached_geocoder.cache.clear()
+        positions = []
+        for lat, lon in ((46.2, 6.1), (42.4, 3.3), (49.2, -2.1), (0.0, 0.0)):
+            positions.extend(
+                [
+                    (lat + random.uniform(-0.5, 0.5), lon + random.uniform(-0.5, 0.5))
+                    for _ in range(500)
+                ]
+            )
+        for _ in range(2):
+            for lat, lon in positions:
+                assert cached_geocoder.region(lat, lon) == plain_geocoder.region(
+                    lat, lon
+                )
+            lats = [lat for lat, lon in positions]
+            lons = [lon for lat, lon in positions]
+            assert cached_geocoder.regions(lats, lons) == plain_geocoder.regions(
+                lats, lons
+            )
+
+        assert 0 < len(cached_geocoder.cache) <= 1000
+        for status in ("hit", "border", "miss"):
+            assert metricsmock.has_record(
+                "incr", "geocoder.region_cache", tags=["status:%s" % status]
+            )
+
 
 class TestRegionsForMcc(object):
     def test_no_match(self):
@@ -3,6 +3,7 @@ import shutil
 import tempfile
 
 from maxminddb.const import MODE_AUTO, MODE_MMAP
+import pytest
 
 from ichnaea.geocode import GEOCODER
 from ichnaea import geoip
@@ -114,11 +115,177 @@ class TestLookup(object):
     def test_fail(self, geoip_db):
         assert geoip_db.lookup("127.0.0.1") is None
 
+    def test_region_only(self, geoip_data, geoip_db):
+        for name in ("London", "London2", "Bhutan"):
+            data = geoip_data[name]
+            assert geoip_db.lookup_region(data["ip"]) == data["region_code"]
+        assert geoip_db.lookup_region("2a02:ffc0::") == "GI"
+        assert geoip_db.lookup_region("127.0.0.1") is None
+        assert geoip_db.lookup_region("546.839.319.-1") is None
+
     def test_fail_bad_ip(self, geoip_db):
         assert geoip_db.lookup("546.839.319.-1") is None
 
     def test_with_dummy_db(self):
         assert geoip.GeoIPNull().lookup("200") is None
+        assert geoip.GeoIPNull().lookup_region("200") is None
+
+
+class TestCache(object):
+    def test_disabled(self):
+        with geoip.configure_geoip(
+            GEOIP_TEST_FILE, reload_interval=0, cache_size=0
+        ) as db:
+            assert db._cache is None
+            assert db.lookup("127.0.0.1") is None
+
+    def test_hit(self, geoip_data, metricsmock):
+        london = geoip_data["London"]
+        with geoip.configure_geoip(
+            GEOIP_TEST_FILE, reload_interval=0, cache_size=10
+        ) as db:
+            metricsmock.clear_records()
+            result = db.lookup(london["ip"])
+            assert metricsmock.has_record(
+                "incr", "geoip.cache", value=1, tags=["status:miss"]
+            )
+            # Changes to the result don't change the cached result.
+            result["region_code"] = "XX"
+            assert db.lookup(london["ip"])["region_code"] == "GB"
+            assert metricsmock.has_record(
+                "incr", "geoip.cache", value=1, tags=["status:hit"]
+            )
+
+    def test_not_found(self, metricsmock):
+        with geoip.configure_geoip(
+            GEOIP_TEST_FILE, reload_interval=0, cache_size=10
+        ) as db:
+            metricsmock.clear_records()
+            assert db.lookup("127.0.0.2") is None
+            assert db.lookup("127.0.0.2") is None
+            assert metricsmock.has_record(
+                "incr", "geoip.cache", value=1, tags=["status:hit"]
+            )
+
+    def test_region(self, geoip_data):
+        london = geoip_data["London"]
+        with geoip.configure_geoip(
+            GEOIP_TEST_FILE, reload_interval=0, cache_size=10
+        ) as db:
+            assert db.lookup_region(london["ip"]) == "GB"
+            assert db.lookup_region("127.0.0.2") is None
+            db._cache.put(("region", london["ip"]), "XX")
+            assert db.lookup_region(london["ip"]) == "XX"
+            assert db._cache.get(("region", "127.0.0.2"), "missing") is None
+
+            # A cached full lookup result is used as well.
+            assert db.lookup(london["ip"])["region_code"] == "GB"
+            assert db.lookup_region(london["ip"]) == "GB"
+
+    def test_clear(self, geoip_data):
+        london = geoip_data["London"]
+        with geoip.configure_geoip(
+            GEOIP_TEST_FILE, reload_interval=0, cache_size=10
+        ) as db:
+            db.lookup(london["ip"])
+            assert db._cache.get(london["ip"]) is not None
+            db.clear_cache()
+            assert db._cache.get(london["ip"]) is None
+
+    def test_expired(self, geoip_data):
+        london = geoip_data["London"]
+        with geoip.configure_geoip(
+            GEOIP_TEST_FILE, reload_interval=0, cache_size=10, cache_ttl=1
+        ) as db:
+            db.lookup(london["ip"])
+            db._cache.put(london["ip"], {"region_code": "XX"}, timeout=-1)
+            assert db.lookup(london["ip"])["region_code"] == "GB"
+
+
+class TestReload(object):
+    @pytest.fixture
+    def geoip_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "GeoIP2-City.mmdb")
+            shutil.copyfile(GEOIP_TEST_FILE, filename)
+            yield filename
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _replace(self, filename, source=GEOIP_TEST_FILE):
+        # Replace the file the same way a deployment would.
+        shutil.copyfile(source, filename + ".new")
+        os.rename(filename + ".new", filename)
+
+    def test_disabled(self, geoip_file):
+        with geoip.configure_geoip(geoip_file, reload_interval=0) as db:
+            assert isinstance(db, geoip.GeoIPWrapper)
+
+    def test_unchanged(self, geoip_file):
+        with geoip.configure_geoip(geoip_file, reload_interval=60) as db:
+            assert isinstance(db, geoip.GeoIPReloader)
+            assert not db.check_reload()
+            assert db.reloads == 0
+            assert db.reloaded is None
+
+    def test_reload(self, geoip_data, geoip_file, metricsmock):
+        london = geoip_data["London"]
+        with geoip.configure_geoip(geoip_file, reload_interval=60, cache_size=10) as db:
+            old_db = db._db
+            age = db.age
+            db.lookup(london["ip"])
+            self._replace(geoip_file)
+            assert db.check_reload()
+            assert db._db is not old_db
+            assert old_db._db_reader.closed
+            assert db.reloads == 1
+            assert db.reloaded is not None
+            assert metricsmock.has_record(
+                "incr", "geoip.reload", value=1, tags=["status:success"]
+            )
+            # The new database starts out with an empty cache.
+            assert db._db._cache.get(london["ip"]) is None
+            assert db.lookup(london["ip"])["region_code"] == "GB"
+            assert db.lookup_region(london["ip"]) == "GB"
+            assert db.ping()
+            assert db.age == age
+
+    def test_reload_interval(self, geoip_file):
+        with geoip.configure_geoip(geoip_file, reload_interval=60) as db:
+            self._replace(geoip_file)
+            db.lookup("127.0.0.1")
+            assert db.reloads == 0
+            db._next_check = 0
+            db.lookup("127.0.0.1")
+            assert db.reloads == 1
+
+    def test_in_flight(self, geoip_file):
+        with geoip.configure_geoip(geoip_file, reload_interval=60) as db:
+            old_db = db._acquire()
+            self._replace(geoip_file)
+            assert db.check_reload()
+            assert not old_db._db_reader.closed
+            assert old_db.lookup("127.0.0.1") is None
+            db._release(old_db)
+            assert old_db._db_reader.closed
+            assert not db._retired
+
+    def test_invalid_file(self, geoip_file, metricsmock, raven):
+        with geoip.configure_geoip(
+            geoip_file, reload_interval=60, raven_client=raven
+        ) as db:
+            old_db = db._db
+            self._replace(geoip_file, source=GEOIP_BAD_FILE)
+            assert not db.check_reload()
+            assert db._db is old_db
+            assert db.ping()
+            assert metricsmock.has_record(
+                "incr", "geoip.reload", value=1, tags=["status:failure"]
+            )
+            # The same broken file isn't tried again.
+            assert not db.check_reload()
+        raven.check([("InvalidDatabaseError", 1)])
 
 
 class TestRadius(object):
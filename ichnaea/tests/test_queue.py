@@ -1,11 +1,55 @@
+import time
 from uuid import uuid4
 
-from ichnaea.queue import DataQueue
+import pytest
+
+from ichnaea.queue import (
+    configure_queue,
+    DataQueue,
+    decode_frame,
+    encode_frame,
+    frame_size,
+    ready_many,
+    StreamQueue,
+)
+
+
+class TestFrame(object):
+    def test_roundtrip(self):
+        items = [b"\x00ab", b"", b"123"]
+        frame = encode_frame(items)
+        assert frame_size(frame) == 3
+        assert decode_frame(frame) == items
+
+    def test_uncompressed(self):
+        items = [b"abc", b"def"]
+        frame = encode_frame(items, compress=False)
+        assert frame.endswith(b"\x00\x00\x00\x03abc\x00\x00\x00\x03def")
+        assert decode_frame(frame) == items
+
+    def test_unframed(self):
+        assert frame_size(b'{"a": 1}') == 1
+
+    def test_version(self):
+        frame = bytearray(encode_frame([b"abc"]))
+        frame[3] = 2
+        with pytest.raises(ValueError):
+            decode_frame(bytes(frame))
 
 
 class TestDataQueue(object):
-    def _make_queue(self, redis, batch=0, compress=False, json=True):
-        return DataQueue(uuid4().hex, redis, batch=batch, compress=compress, json=json)
+    def _make_queue(
+        self, redis, batch=0, compress=False, json=True, framed=False, reliable=False
+    ):
+        return DataQueue(
+            uuid4().hex,
+            redis,
+            batch=batch,
+            compress=compress,
+            json=json,
+            framed=framed,
+            reliable=reliable,
+        )
 
     def test_objects(self, redis):
         queue = self._make_queue(redis)
@@ -70,3 +114,307 @@ class TestDataQueue(object):
         assert queue.size() == 2
         queue.dequeue()
         assert queue.size() == 0
+
+    def test_framed(self, redis):
+        queue = self._make_queue(redis, compress=True, framed=True)
+        items = [{"a": 1}, "b", 2]
+        queue.enqueue(items)
+        assert redis.llen(queue.key) == 1
+        assert queue.size() == 3
+        assert queue.dequeue() == items
+        assert queue.size() == 0
+        assert not redis.exists(queue.count_key)
+
+    def test_framed_binary(self, redis):
+        queue = self._make_queue(redis, json=False, framed=True)
+        items = [b"\x00ab", b"123"]
+        queue.enqueue(items)
+        assert queue.dequeue() == items
+
+    def test_framed_batch(self, redis):
+        queue = self._make_queue(redis, batch=3, compress=True, framed=True)
+        queue.enqueue([1, 2, 3, 4, 5], batch=2)
+        assert redis.llen(queue.key) == 3
+        # whole frames are returned
+        assert queue.dequeue() == [1, 2, 3, 4]
+        assert queue.size() == 1
+        assert queue.dequeue() == [5]
+        assert queue.size() == 0
+
+    def test_framed_compat(self, redis):
+        old_queue = self._make_queue(redis, compress=True)
+        queue = DataQueue(old_queue.key, redis, compress=True, framed=True)
+        old_queue.enqueue([{"a": 1}, "b"])
+        queue.enqueue([3, 4])
+        assert queue.size() == 3
+        assert queue.dequeue(batch=3) == [{"a": 1}, "b", 3, 4]
+        assert queue.size() == 0
+
+    def test_framed_ready(self, redis):
+        queue = self._make_queue(redis, batch=4, framed=True)
+        assert not queue.ready()
+        queue.enqueue(["a", "b", "c"])
+        assert not queue.ready()
+        queue.enqueue(["d"])
+        assert queue.ready()
+
+    def test_framed_pipe(self, redis):
+        queue = self._make_queue(redis, framed=True)
+        pipe = redis.pipeline()
+        queue.enqueue([1, 2, 3], pipe=pipe)
+        assert queue.size() == 0
+        pipe.execute()
+        assert queue.size() == 3
+
+    def test_dequeue_status(self, redis):
+        queue = self._make_queue(redis, batch=3)
+        queue.enqueue([1, 2, 3, 4, 5])
+        items, size, age = queue.dequeue_status()
+        assert items == [1, 2, 3]
+        assert (size, age) == (2, 0)
+        assert not queue.is_ready(size, age)
+        redis.expire(queue.key, 70000)
+        items, size, age = queue.dequeue_status(batch=1)
+        assert items == [4]
+        assert (size, age) == (1, 16400)
+        assert queue.is_ready(size, age)
+        items, size, age = queue.dequeue_status()
+        assert items == [5]
+        assert (size, age) == (0, -1)
+        assert not queue.is_ready(size, age)
+
+    def test_dequeue_status_framed(self, redis):
+        queue = self._make_queue(redis, batch=3, framed=True)
+        queue.enqueue([1, 2, 3, 4, 5], batch=2)
+        items, size, age = queue.dequeue_status()
+        assert items == [1, 2, 3, 4]
+        assert (size, age) == (1, 0)
+        items, size, age = queue.dequeue_status()
+        assert items == [5]
+        assert (size, age) == (0, -1)
+        assert not redis.exists(queue.count_key)
+
+    def test_ready_many(self, redis):
+        queues = [self._make_queue(redis, batch=2) for _ in range(3)]
+        queues.append(self._make_queue(redis, batch=2, framed=True))
+        assert ready_many(redis, []) == []
+        assert ready_many(redis, queues) == [False] * 4
+
+        queues[0].enqueue(["a", "b"])
+        queues[1].enqueue(["a"])
+        queues[2].enqueue(["a"])
+        redis.expire(queues[2].key, 70000)
+        queues[3].enqueue(["a", "b"])
+        assert ready_many(redis, queues) == [True, False, True, True]
+        assert ready_many(redis, queues, batch=1) == [True] * 4
+
+    def test_consume(self, redis):
+        queue = self._make_queue(redis, batch=2)
+        queue.enqueue([1, 2, 3])
+        with queue.consume() as (items, size, age):
+            assert items == [1, 2]
+            assert (size, age) == (1, 0)
+        assert queue.size() == 1
+        assert not redis.exists(queue.inflight_key)
+
+    def test_consume_reliable(self, redis):
+        queue = self._make_queue(redis, batch=2, reliable=True)
+        queue.enqueue([1, 2, 3])
+        with queue.consume() as (items, size, age):
+            assert items == [1, 2]
+            assert (size, age) == (1, 0)
+            assert redis.zcard(queue.inflight_key) == 1
+        assert not redis.exists(queue.inflight_key)
+        assert not redis.keys(queue.inflight_key + ":*")
+        assert queue.requeue_expired(now=time.time() + 3600) == (0, 0)
+        assert queue.dequeue() == [3]
+
+    def test_consume_reliable_failure(self, redis):
+        queue = self._make_queue(redis, batch=2, reliable=True)
+        queue.enqueue([1, 2, 3])
+        with pytest.raises(ValueError):
+            with queue.consume() as (items, size, age):
+                raise ValueError("worker failed")
+        assert queue.size() == 1
+
+        assert queue.requeue_expired() == (0, 0)
+        assert queue.requeue_expired(now=time.time() + 3600) == (2, 0)
+        assert queue.size() == 3
+        assert not redis.exists(queue.inflight_key)
+        # The requeued batch is taken again first, as a whole.
+        with queue.consume(batch=1) as (items, size, age):
+            assert items == [1, 2]
+            assert size == 1
+        assert queue.dequeue(batch=0) == [3]
+        assert not redis.keys(queue.inflight_key + "*")
+        assert not redis.exists(queue.retry_key)
+        assert not redis.exists(queue.attempts_key)
+
+    def test_consume_reliable_attempts(self, redis):
+        queue = self._make_queue(redis, batch=1, reliable=True)
+        queue.max_attempts = 2
+        queue.enqueue([1, 1])
+        with pytest.raises(ValueError):
+            with queue.consume():
+                raise ValueError("worker failed")
+        assert queue.requeue_expired(now=time.time() + 3600) == (1, 0)
+        assert redis.hvals(queue.attempts_key) == [b"1"]
+
+        with pytest.raises(ValueError):
+            with queue.consume() as (items, size, age):
+                assert items == [1]
+                # An identical copy of the failed item is acknowledged.
+                with queue.consume() as (other_items, size, age):
+                    assert other_items == [1]
+                assert redis.hvals(queue.attempts_key) == [b"1"]
+                raise ValueError("worker failed")
+
+        # The failed copy kept its attempt count and is dead-lettered.
+        assert queue.requeue_expired(now=time.time() + 3600) == (0, 1)
+        assert redis.lrange(queue.deadletter_key, 0, -1) == [b"1"]
+        assert not redis.exists(queue.attempts_key)
+        assert queue.size() == 0
+
+    def test_consume_reliable_deadletter(self, redis):
+        queue = self._make_queue(redis, batch=2, reliable=True)
+        queue.max_attempts = 2
+        queue.enqueue([1, 2, 3])
+        for count in ((2, 0), (0, 2)):
+            with pytest.raises(ValueError):
+                with queue.consume():
+                    raise ValueError("worker failed")
+            assert queue.requeue_expired(now=time.time() + 3600) == count
+
+        # The items which failed too often no longer block the queue.
+        assert queue.dequeue(batch=0) == [3]
+        assert redis.lrange(queue.deadletter_key, 0, -1) == [b"1", b"2"]
+        assert 0 < redis.ttl(queue.deadletter_key) <= queue.deadletter_ttl
+        assert not redis.exists(queue.attempts_key)
+
+    def test_consume_reliable_framed(self, redis):
+        queue = self._make_queue(redis, batch=2, framed=True, reliable=True)
+        queue.enqueue([1, 2, 3], batch=2)
+        with pytest.raises(ValueError):
+            with queue.consume():
+                raise ValueError("worker failed")
+        assert queue.size() == 1
+
+        assert queue.requeue_expired(now=time.time() + 3600) == (2, 0)
+        assert queue.size() == 3
+        assert queue.dequeue(batch=0) == [1, 2]
+        assert queue.dequeue(batch=0) == [3]
+
+
+class TestStreamQueue(object):
+    def _make_queue(
+        self, redis, batch=0, compress=False, json=True, framed=False, reliable=False
+    ):
+        return StreamQueue(
+            uuid4().hex,
+            redis,
+            batch=batch,
+            compress=compress,
+            json=json,
+            framed=framed,
+            reliable=reliable,
+        )
+
+    def test_configure(self, redis):
+        queue = configure_queue("queue", redis, backend="stream", batch=10)
+        assert isinstance(queue, StreamQueue)
+        assert queue.batch == 10
+        queue = configure_queue("queue", redis, backend="list")
+        assert not isinstance(queue, StreamQueue)
+
+    def test_objects(self, redis):
+        queue = self._make_queue(redis)
+        items = [{"a": 1}, "b", 2]
+        queue.enqueue(items)
+        assert redis.type(queue.key) == b"stream"
+        assert queue.dequeue() == items
+        assert queue.dequeue() == []
+
+    def test_compress_framed(self, redis):
+        queue = self._make_queue(redis, batch=2, compress=True, framed=True)
+        queue.enqueue([{"a": 1}, {"b": 2}, {"c": 3}])
+        assert redis.xlen(queue.key) == 3
+        assert queue.dequeue() == [{"a": 1}, {"b": 2}]
+        assert queue.dequeue() == [{"c": 3}]
+
+    def test_dequeue_status(self, redis):
+        queue = self._make_queue(redis, batch=2)
+        assert queue.dequeue_status() == ([], 0, -1)
+        queue.enqueue([1, 2, 3])
+        assert queue.dequeue_status() == ([1, 2], 1, 0)
+        assert queue.dequeue_status() == ([3], 0, 0)
+        assert redis.xlen(queue.key) == 0
+
+    def test_consumers(self, redis):
+        queue = self._make_queue(redis, batch=2, reliable=True)
+        other = StreamQueue(queue.key, redis, batch=2, reliable=True)
+        queue.enqueue([1, 2, 3, 4, 5])
+        with queue.consume() as (items, size, age):
+            assert items == [1, 2]
+            with other.consume() as (other_items, size, age):
+                assert other_items == [3, 4]
+                assert size == 1
+        assert queue.size() == 1
+        assert redis.xlen(queue.key) == 1
+
+    def test_maxlen(self, redis):
+        queue = StreamQueue(uuid4().hex, redis, json=False, maxlen=100)
+        queue.enqueue([b"%d" % i for i in range(1000)])
+        assert redis.xlen(queue.key) < 1000
+        assert queue.trimmed() == 1000 - redis.xlen(queue.key)
+        assert queue.trimmed() == 0
+        assert queue.dequeue(batch=0)[-1] == b"999"
+
+    def test_expired(self, redis):
+        queue = self._make_queue(redis)
+        queue.enqueue([1])
+        assert queue.dequeue() == [1]
+        # The consumer group is created again, after the stream expired.
+        redis.delete(queue.key)
+        assert queue.dequeue_status() == ([], 0, -1)
+        queue.enqueue([2])
+        assert queue.dequeue() == [2]
+
+    def test_ready_many(self, redis):
+        queues = [self._make_queue(redis, batch=2) for _ in range(2)]
+        queues.append(DataQueue(uuid4().hex, redis, batch=2))
+        assert ready_many(redis, queues) == [False] * 3
+
+        queues[0].enqueue(["a", "b"])
+        queues[1].enqueue(["a"])
+        queues[2].enqueue(["a", "b"])
+        assert ready_many(redis, queues) == [True, False, True]
+        assert ready_many(redis, queues, batch=1) == [True] * 3
+
+    def test_consume_reliable_failure(self, redis):
+        queue = self._make_queue(redis, batch=2, reliable=True)
+        queue.enqueue([1, 2, 3])
+        with pytest.raises(ValueError):
+            with queue.consume() as (items, size, age):
+                raise ValueError("worker failed")
+        assert queue.size() == 1
+
+        assert queue.requeue_expired() == (0, 0)
+        assert queue.requeue_expired(now=time.time() + 3600) == (2, 0)
+        assert queue.size() == 3
+        assert redis.xinfo_consumers(queue.key, queue.group) == []
+        assert queue.dequeue(batch=0) == [3, 1, 2]
+
+    def test_consume_reliable_deadletter(self, redis):
+        queue = self._make_queue(redis, batch=2, reliable=True)
+        queue.max_attempts = 2
+        queue.enqueue([1, 2])
+        for count in ((2, 0), (0, 2)):
+            with pytest.raises(ValueError):
+                with queue.consume():
+                    raise ValueError("worker failed")
+            assert queue.requeue_expired(now=time.time() + 3600) == count
+
+        assert queue.size() == 0
+        assert redis.xlen(queue.key) == 0
+        assert redis.lrange(queue.deadletter_key, 0, -1) == [b"1", b"2"]
+        assert 0 < redis.ttl(queue.deadletter_key) <= queue.deadletter_ttl
@@ -16,7 +16,7 @@ from ichnaea.db import configure_db, db_session, db_worker_session, ping_session
 from ichnaea.geoip import configure_geoip
 from ichnaea.http import configure_http_session
 from ichnaea.log import configure_logging, configure_raven, configure_stats
-from ichnaea.queue import DataQueue
+from ichnaea.queue import configure_queue
 from ichnaea.webapp.monitor import configure_monitor
 
 
@@ -85,8 +85,8 @@ def main(
 
     # Needs to be the exact same as the *_incoming entries in taskapp.config.
     registry.data_queues = data_queues = {
-        "update_incoming": DataQueue(
-            "update_incoming", redis_client, batch=100, compress=True
+        "update_incoming": configure_queue(
+            "update_incoming", redis_client, batch=100, compress=True, framed=True
         )
     }
 
@@ -6,6 +6,7 @@ import time
 from pyramid.httpexceptions import HTTPServiceUnavailable
 
 from ichnaea.db import ping_session
+from ichnaea.geoip import GeoIPReloader
 from ichnaea.util import contribute_info, version_info
 from ichnaea.webapp.view import BaseView
 
@@ -41,6 +42,9 @@ def check_geoip(request):
     result = _check_timed(geoip_db.ping)
     result["age_in_days"] = geoip_db.age
     result["version"] = geoip_db.version
+    if isinstance(geoip_db, GeoIPReloader):
+        result["reloads"] = geoip_db.reloads
+        result["reloaded"] = geoip_db.reloaded
     return result
 
 
@@ -3,7 +3,7 @@ import webtest
 
 from ichnaea.cache import configure_redis
 from ichnaea.db import configure_db
-from ichnaea.geoip import GeoIPNull
+from ichnaea.geoip import configure_geoip, GeoIPNull
 from ichnaea.webapp.config import main
 
 
@@ -65,6 +65,22 @@ class TestHeartbeat(object):
         # Run "make update-vendored" when this gets too old
         assert 1 < data["geoip"]["age_in_days"] < 1000
 
+    def test_geoip_reload(self, db, http_session, raven, redis_client):
+        geoip_db = configure_geoip(raven_client=raven, reload_interval=60)
+        app = _make_app(
+            _db=db,
+            _geoip_db=geoip_db,
+            _http_session=http_session,
+            _raven_client=raven,
+            _redis_client=redis_client,
+        )
+        try:
+            data = app.get("/__heartbeat__", status=200).json
+            assert data["geoip"]["reloads"] == 0
+            assert data["geoip"]["reloaded"] is None
+        finally:
+            geoip_db.close()
+
 
 class TestHeartbeatErrors(object):
     @pytest.fixture(scope="function")